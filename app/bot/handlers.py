@@ -1,16 +1,20 @@
-from typing import Dict
+from typing import Dict, Optional
+import asyncio
 import os
 import logging
+from pathlib import Path
 
 from aiogram import F
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import Message, CallbackQuery, FSInputFile
+from aiogram.types import Message, CallbackQuery, BufferedInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from app.bot.main import dp, bot, config_manager, user_manager, notification_scheduler, UPLOAD_DIR, OUTPUT_DIR, ACCESS_PASSWORD
-from app.excel.order_generator import OrderGenerator
+from app.bot.main import dp, bot, config_manager, user_manager, sessions, blob_store, price_indexes, order_cache, order_queue, get_generation_pool, SHARED_SESSIONS, OUTPUT_DIR, ARCHIVE_ORDERS, ORDER_QUEUE, ACCESS_PASSWORD
+from app.core.blob_store import sha256_bytes, sha256_file
+from app.excel.batch import BatchOrderBuilder, zip_orders
+from app.excel.incremental import IncrementalOrderSession
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -40,21 +44,205 @@ class OrderStates(StatesGroup):
     configuring_notification_days = State()
     configuring_notification_weeks = State()
     configuring_notification_weekdays = State()
+    waiting_for_batch_warehouse = State()
+    waiting_for_batch_preorders = State()
+    waiting_for_correction = State()
 
 
-user_data: Dict[int, Dict] = {}
+def get_user_data(user_id: int) -> Dict:
+    return sessions.get(user_id)
 
 
-def get_user_data(user_id: int) -> Dict:
-    if user_id not in user_data:
-        user_data[user_id] = {
-            'price_file': None,
-            'warehouse_file': None,
-            'preorders_file': None,
-            'supplier': None,
-            'config': None
-        }
-    return user_data[user_id]
+async def store_input(user_id: int, data: Dict, kind: str, content: bytes) -> None:
+    """Кладёт загруженный файл склада или предзаказов в сессию.
+
+    Байты остаются в памяти, а при общих сессиях файл ещё и сохраняется в blob-хранилище:
+    в общее хранилище попадает только sha256, и другой процесс бота прочитает файл по нему.
+    """
+    if SHARED_SESSIONS:
+        path, sha256 = await asyncio.to_thread(blob_store.put_bytes, content)
+        sessions.track_file(user_id, path)
+    else:
+        sha256 = sha256_bytes(content)
+    data[f'{kind}_file'] = content
+    data[f'{kind}_sha256'] = sha256
+
+
+async def load_inputs(data: Dict, *kinds: str) -> bool:
+    """Возвращает в сессию байты входных файлов, которых нет в памяти этого процесса.
+
+    False — файла нет ни в памяти, ни в blob-хранилище (сессия истекла или была сброшена).
+    """
+    for kind in kinds:
+        if data.get(f'{kind}_file') is not None:
+            continue
+        sha256 = data.get(f'{kind}_sha256')
+        path = blob_store.path_for(sha256) if sha256 else None
+        if path is None or not await asyncio.to_thread(path.exists):
+            return False
+        data[f'{kind}_file'] = await asyncio.to_thread(path.read_bytes)
+    return True
+
+
+async def answer_session_expired(message: Message, state: FSMContext) -> None:
+    await state.clear()
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🔙 Назад в меню", callback_data="menu_main")
+    await message.answer("⌛ Данные заказа устарели, начните заново.", reply_markup=builder.as_markup())
+
+
+def resolve_supplier(supplier_name: str) -> Optional[Dict]:
+    """Свежая конфигурация поставщика с локальными путями прайса и индекса.
+
+    Запрос в Postgres и загрузка файлов блокируют, поэтому вызывается через asyncio.to_thread.
+    """
+    return price_indexes.resolve(supplier_name, config_manager.get_supplier_config(supplier_name))
+
+
+async def download_to_memory(document) -> bytes:
+    """Скачивает документ в память: файлы склада и предзаказов нужны только на время генерации."""
+    file = await bot.get_file(document.file_id)
+    buffer = await bot.download_file(file.file_path)
+    return buffer.getvalue()
+
+
+# Ссылки на фоновые задачи построения индексов, чтобы их не собрал сборщик мусора
+price_index_tasks = set()
+
+
+async def build_price_index(supplier_name: str) -> None:
+    """Фоновое построение индекса прайса после загрузки прайса или изменения разметки"""
+    try:
+        await asyncio.to_thread(price_indexes.ensure, supplier_name)
+    except Exception as e:
+        logger.error(f"Ошибка построения индекса прайса '{supplier_name}': {e}", exc_info=True)
+
+
+def schedule_price_index_build(supplier_name: str) -> None:
+    task = asyncio.create_task(build_price_index(supplier_name))
+    price_index_tasks.add(task)
+    task.add_done_callback(price_index_tasks.discard)
+
+
+def order_session_for(data: Dict, config: Dict) -> IncrementalOrderSession:
+    """Сессия генерации заказа для текущих поставщика, разметки и прайса пользователя"""
+    order_session = data.get('order_session')
+    if order_session is None or not order_session.matches(data['supplier'], config, data.get('price_sha256')):
+        order_session = IncrementalOrderSession(data['supplier'], config, data['price_file'], data.get('price_sha256'))
+        data['order_session'] = order_session
+    return order_session
+
+
+def _log_speculative_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.info(f"Фоновый разбор входного файла не удался: {task.exception()}")
+
+
+def start_speculative_parse(data: Dict, kind: str) -> None:
+    """Разбирает только что загруженный файл в фоне, пока пользователь выбирает следующий.
+
+    kind: 'price' (индекс прайса), 'warehouse' или 'preorders'. Ошибки здесь не важны:
+    при генерации файл будет разобран заново и ошибка покажется пользователю.
+    """
+    config = data.get('config')
+    # В режиме очереди заказ собирает воркер, локальный разбор ему не поможет
+    if ORDER_QUEUE or not config or not data.get('price_file') or not data.get('price_sha256'):
+        return
+    order_session = order_session_for(data, config)
+    if kind == 'price':
+        call = asyncio.to_thread(order_session.prefetch_price_index)
+    else:
+        call = asyncio.to_thread(order_session.prefetch, kind, data[f'{kind}_file'], data[f'{kind}_sha256'])
+    task = asyncio.create_task(call)
+    task.add_done_callback(_log_speculative_failure)
+    data.setdefault('parse_tasks', []).append(task)
+
+
+async def await_speculative_parse(data: Dict) -> None:
+    """Дожидается фонового разбора, который ещё не закончился к моменту генерации"""
+    tasks = data.pop('parse_tasks', None) or []
+    pending = [t for t in tasks if not t.done()]
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+def warehouse_summary(warehouse_diag: Dict) -> str:
+    if not warehouse_diag:
+        return "(нет метрик)"
+    return (
+        f"Строк просмотрено: {warehouse_diag.get('rows_seen', '?')}, "
+        f"артикулов: {warehouse_diag.get('articles_seen', '?')}, "
+        f"кол-во>0: {warehouse_diag.get('valid_qty_rows', '?')}, "
+        f"итемов: {warehouse_diag.get('total_items_found', 0)}"
+    )
+
+
+async def enqueue_order(message: Message, data: Dict, config: Dict, output_name: str) -> None:
+    """Ставит генерацию заказа в очередь; результат придёт через deliver_order_job"""
+    supplier_name = data['supplier']
+    price_bytes = None
+    if data['price_sha256'] != config.get('price_sha256'):
+        # Разовый прайс пользователя: воркер может работать на другой машине, передаём его целиком
+        price_bytes = await asyncio.to_thread(Path(data['price_file']).read_bytes)
+    hashes = {k: data[k] for k in ('price_sha256', 'warehouse_sha256', 'preorders_sha256')}
+    job_id = await asyncio.to_thread(
+        order_queue.enqueue, message.from_user.id, message.chat.id, supplier_name, config, hashes,
+        output_name, data['warehouse_file'], data['preorders_file'], price_bytes
+    )
+    logger.info(f"Заказ для '{supplier_name}' поставлен в очередь (задание {job_id})")
+    await message.answer(f"🕒 Заказ поставлен в очередь (№{job_id}). Пришлю файл, как только он будет готов.")
+
+
+async def deliver_order_job(job: Dict) -> None:
+    """Отправляет пользователю результат задания из очереди заказов"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🔙 В главное меню", callback_data="menu_main")
+    if job['status'] != 'done' or job['result'] is None:
+        await bot.send_message(job['chat_id'], f"❌ Ошибка при генерации заказа: {job['error']}",
+                               reply_markup=builder.as_markup())
+        return
+    payload = job['payload']
+    quantities = job['quantities'] or {}
+    diagnostics = job['diagnostics'] or {}
+    cache_key = order_cache.make_key(payload['price_sha256'], payload['warehouse_sha256'],
+                                     payload['preorders_sha256'], payload['config'])
+    order_cache.put(cache_key, job['result'], quantities, diagnostics)
+    if diagnostics.get('preview'):
+        await bot.send_message(job['chat_id'], "🔎 Диагностика файла 'Заказ на склад':\n"
+                               + warehouse_summary(diagnostics.get('warehouse')) + "\n\n"
+                               + diagnostics['preview'][:3500])
+    if ARCHIVE_ORDERS:
+        await asyncio.to_thread((OUTPUT_DIR / payload['output_name']).write_bytes, job['result'])
+    await bot.send_message(
+        job['chat_id'],
+        f"✅ Заказ успешно сгенерирован!\n\n"
+        f"📊 Найдено товаров: {len(quantities)}\n"
+        f"📦 Общее количество: {sum(quantities.values())}",
+        reply_markup=builder.as_markup()
+    )
+    await bot.send_document(job['chat_id'], BufferedInputFile(job['result'], filename=payload['output_name']))
+
+
+def get_order_result_keyboard():
+    builder = InlineKeyboardBuilder()
+    builder.button(text="✏️ Исправить заказ на склад", callback_data="regen_warehouse")
+    builder.button(text="✏️ Исправить предзаказы", callback_data="regen_preorders")
+    builder.button(text="🔙 В главное меню", callback_data="menu_main")
+    builder.adjust(1)
+    return builder.as_markup()
+
+
+def keep_order_session(user_id: int, data: Dict, order_session: IncrementalOrderSession) -> None:
+    """Сбрасывает сессию, оставляя входы последнего заказа для быстрой перегенерации."""
+    keep_files = [data.get('price_file')]
+    keep_files += [str(blob_store.path_for(data[key])) for key in ('warehouse_sha256', 'preorders_sha256')
+                   if data.get(key)]
+    new_data = sessions.reset(user_id, keep=('supplier', 'price_file', 'price_sha256', 'warehouse_file',
+                                             'warehouse_sha256', 'preorders_file', 'preorders_sha256'),
+                              keep_files=keep_files)
+    # Признак сохраняется в общем хранилище: исправить заказ можно и в другом процессе бота
+    new_data['last_order'] = True
+    new_data['order_session'] = order_session
 
 
 def column_letter_to_index(column: str) -> int:
@@ -89,6 +277,7 @@ def get_main_menu():
     builder = InlineKeyboardBuilder()
     builder.button(text="📦 Управление поставщиками", callback_data="menu_suppliers")
     builder.button(text="📋 Сгенерировать заказ", callback_data="menu_generate")
+    builder.button(text="🗂️ Заказы по нескольким поставщикам", callback_data="menu_batch")
     builder.button(text="📖 Справка", callback_data="menu_help")
     builder.adjust(1)
     return builder.as_markup()
@@ -349,9 +538,9 @@ async def process_configuring_price_file(message: Message, state: FSMContext):
         return
     
     try:
-        file = await bot.get_file(message.document.file_id)
-        tmp_path = UPLOAD_DIR / f"suppliers_{user_id}_{file.file_id}.xlsx"
-        await bot.download_file(file.file_path, tmp_path)
+        tmp_path, price_sha256 = await blob_store.fetch(bot, message.document)
+        # До сохранения в конфигурации загрузка принадлежит сессии и удаляется вместе с ней
+        sessions.track_file(user_id, tmp_path)
         price_source_path = tmp_path
         
         # Получаем все данные из состояния
@@ -379,11 +568,14 @@ async def process_configuring_price_file(message: Message, state: FSMContext):
                 'start_row': 1,
             },
             'price_file': str(price_source_path),
-            'price_template': str(tmp_path)
+            'price_template': str(tmp_path),
+            'price_sha256': price_sha256
         }
         
-        # Сохраняем конфигурацию
+        # Сохраняем конфигурацию; индекс прайса строится в фоне
         config_manager.set_supplier_config(supplier_name, config)
+        sessions.untrack_file(user_id, tmp_path)
+        schedule_price_index_build(supplier_name)
         
         builder = InlineKeyboardBuilder()
         builder.button(text="📦 К списку поставщиков", callback_data="menu_suppliers")
@@ -458,7 +650,7 @@ async def callback_select_supplier(callback: CallbackQuery, state: FSMContext):
     
     data = get_user_data(user_id)
     data['supplier'] = supplier_name
-    config = config_manager.get_supplier_config(supplier_name)
+    config = await asyncio.to_thread(resolve_supplier, supplier_name)
     data['config'] = config
     
     # Проверяем, есть ли сохраненный прайс-лист
@@ -470,6 +662,7 @@ async def callback_select_supplier(callback: CallbackQuery, state: FSMContext):
     if saved_price_file and os.path.exists(saved_price_file):
         # Используем сохраненный прайс-лист
         data['price_file'] = saved_price_file
+        data['price_sha256'] = config.get('price_sha256')
         builder = InlineKeyboardBuilder()
         builder.button(text="📄 Использовать сохраненный", callback_data="use_saved_price")
         builder.button(text="🔄 Заменить прайс-лист", callback_data="replace_price")
@@ -503,11 +696,14 @@ async def callback_use_saved_price(callback: CallbackQuery, state: FSMContext):
     data = get_user_data(user_id)
     
     supplier_name = data['supplier']
-    config = config_manager.get_supplier_config(supplier_name)
+    config = await asyncio.to_thread(resolve_supplier, supplier_name)
     saved_price_file = config.get('price_file')
     
     if saved_price_file and os.path.exists(saved_price_file):
         data['price_file'] = saved_price_file
+        data['price_sha256'] = config.get('price_sha256')
+        data['config'] = config
+        start_speculative_parse(data, 'price')
         
         builder = InlineKeyboardBuilder()
         builder.button(text="❌ Отменить", callback_data="cancel_order")
@@ -737,8 +933,7 @@ async def callback_notif_days(callback: CallbackQuery, state: FSMContext):
     config_manager.set_supplier_config(supplier_name, config)
     
     # Сбрасываем время последней отправки, чтобы первое уведомление отправилось сразу
-    if notification_scheduler:
-        notification_scheduler.reset_notification_time(supplier_name)
+    config_manager.reset_notification_time(supplier_name)
     
     builder = InlineKeyboardBuilder()
     builder.button(text="🔙 Назад к поставщику", callback_data=f"supplier_{supplier_name}")
@@ -874,8 +1069,7 @@ async def callback_notif_weekdays_done(callback: CallbackQuery, state: FSMContex
     config_manager.set_supplier_config(supplier_name, config)
     
     # Сбрасываем время последней отправки, чтобы первое уведомление отправилось сразу
-    if notification_scheduler:
-        notification_scheduler.reset_notification_time(supplier_name)
+    config_manager.reset_notification_time(supplier_name)
     
     weekdays_names = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
     selected_names = [weekdays_names[i] for i in sorted(weekdays)]
@@ -1044,13 +1238,7 @@ async def callback_edit_price_file(callback: CallbackQuery, state: FSMContext):
 async def callback_cancel_order(callback: CallbackQuery, state: FSMContext):
     """Обработчик отмены заказа"""
     user_id = callback.from_user.id
-    user_data[user_id] = {
-        'price_file': None,
-        'warehouse_file': None,
-        'preorders_file': None,
-        'supplier': None,
-        'config': None
-    }
+    sessions.reset(user_id)
     await state.clear()
     await callback.message.edit_text(
         "❌ Заказ отменен.",
@@ -1246,9 +1434,8 @@ async def process_editing_price_file(message: Message, state: FSMContext):
         return
     
     try:
-        file = await bot.get_file(message.document.file_id)
-        tmp_path = UPLOAD_DIR / f"suppliers_{user_id}_{file.file_id}.xlsx"
-        await bot.download_file(file.file_path, tmp_path)
+        tmp_path, price_sha256 = await blob_store.fetch(bot, message.document)
+        sessions.track_file(user_id, tmp_path)
         new_price_file = tmp_path
         
         config = config_manager.get_supplier_config(supplier_name)
@@ -1259,7 +1446,9 @@ async def process_editing_price_file(message: Message, state: FSMContext):
         
         config['price_file'] = str(new_price_file)
         config['price_template'] = str(tmp_path)
+        config['price_sha256'] = price_sha256
         config_manager.set_supplier_config(supplier_name, config)
+        sessions.untrack_file(user_id, tmp_path)
         
         await finish_editing(message, state, supplier_name, "Прайс-лист: обновлен")
     except Exception as e:
@@ -1269,6 +1458,8 @@ async def process_editing_price_file(message: Message, state: FSMContext):
 
 async def finish_editing(message: Message, state: FSMContext, supplier_name: str, changed_param: str):
     """Завершает редактирование и возвращает к деталям поставщика"""
+    # Новый прайс или разметка делают сохранённый индекс неактуальным — перестраиваем в фоне
+    schedule_price_index_build(supplier_name)
     config = config_manager.get_supplier_config(supplier_name)
     price_list = config['price_list']
     
@@ -1326,10 +1517,12 @@ async def process_price_file(message: Message, state: FSMContext):
         return
     
     try:
-        file = await bot.get_file(message.document.file_id)
-        tmp_path = UPLOAD_DIR / f"{user_id}_price_{file.file_id}.xlsx"
-        await bot.download_file(file.file_path, tmp_path)
+        tmp_path, sha256 = await blob_store.fetch(bot, message.document)
+        # Прайс для разового заказа: удаляется с сессией, если не совпал с прайсом поставщика
+        sessions.track_file(user_id, tmp_path)
         data['price_file'] = str(tmp_path)
+        data['price_sha256'] = sha256
+        start_speculative_parse(data, 'price')
         
         await message.answer("✅ Прайс-лист загружен!\n\n📤 Теперь загрузите файл 'Заказ на склад' (Excel файл):")
         await state.set_state(OrderStates.waiting_for_warehouse)
@@ -1355,10 +1548,9 @@ async def process_warehouse_file(message: Message, state: FSMContext):
         return
     
     try:
-        file = await bot.get_file(message.document.file_id)
-        tmp_path = UPLOAD_DIR / f"{user_id}_warehouse_{file.file_id}.xlsx"
-        await bot.download_file(file.file_path, tmp_path)
-        data['warehouse_file'] = str(tmp_path)
+        content = await download_to_memory(message.document)
+        await store_input(user_id, data, 'warehouse', content)
+        start_speculative_parse(data, 'warehouse')
         
         await message.answer("✅ Заказ на склад загружен!\n\n📤 Теперь загрузите файл 'Предзаказы клиентов' (Excel файл):")
         await state.set_state(OrderStates.waiting_for_preorders)
@@ -1384,42 +1576,51 @@ async def process_preorders_file(message: Message, state: FSMContext):
         return
     
     try:
-        file = await bot.get_file(message.document.file_id)
-        tmp_path = UPLOAD_DIR / f"{user_id}_preorders_{file.file_id}.xlsx"
-        await bot.download_file(file.file_path, tmp_path)
-        data['preorders_file'] = str(tmp_path)
+        content = await download_to_memory(message.document)
+        await store_input(user_id, data, 'preorders', content)
     except Exception as e:
         logger.error(f"Ошибка при загрузке предзаказов: {e}")
         await message.answer(f"❌ Ошибка при загрузке файла: {str(e)}")
         return
+    if not data.get('supplier') or not data.get('price_file') or not await load_inputs(data, 'warehouse'):
+        await answer_session_expired(message, state)
+        return
     
     await message.answer("⏳ Обрабатываю файлы и генерирую заказ...")
     
-    # Сохраняем пути к временным файлам, чтобы удалить их после использования
-    warehouse_tmp_path = data.get('warehouse_file')
-    preorders_tmp_path = data.get('preorders_file')
-
     try:
         # Генерируем заказ (берём свежую конфигурацию поставщика)
         supplier_name = data['supplier']
-        config = config_manager.get_supplier_config(supplier_name)
+        config = await asyncio.to_thread(resolve_supplier, supplier_name)
         price_config = config['price_list']
-        warehouse_config = config['warehouse_order']
-        preorders_config = config['preorders']
-        
-        generator = OrderGenerator(price_config)
-        # Выходной файл всегда в .xlsx
-        output_file = OUTPUT_DIR / f"{user_id}_order_{file.file_id}.xlsx"
         
-        quantities = generator.generate_order(
-            price_file=data['price_file'],
-            warehouse_file=data['warehouse_file'],
-            preorders_file=data['preorders_file'],
-            output_file=str(output_file),
-            warehouse_config=warehouse_config,
-            preorders_config=preorders_config,
-            price_template=config.get('price_template')
-        )
+        # Результат собираем в памяти, выходной файл всегда в .xlsx
+        output_name = f"{user_id}_order_{message.document.file_id}.xlsx"
+        if not data.get('price_sha256'):
+            data['price_sha256'] = await asyncio.to_thread(sha256_file, data['price_file'])
+        # Прайс и склад обычно уже разобраны в фоне, пока пользователь выбирал файлы
+        await await_speculative_parse(data)
+        order_session = order_session_for(data, config)
+        generator = order_session.generator
+        cache_key = order_cache.make_key(data['price_sha256'], data['warehouse_sha256'],
+                                         data['preorders_sha256'], config)
+        cached = order_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Заказ для '{supplier_name}' взят из кэша")
+            output_bytes, quantities = cached.output, cached.quantities
+            generator.last_diagnostics = dict(cached.diagnostics)
+        elif ORDER_QUEUE:
+            await enqueue_order(message, data, config, output_name)
+            sessions.reset(user_id)
+            await state.clear()
+            return
+        else:
+            output_bytes, quantities = await asyncio.to_thread(
+                order_session.generate,
+                data['warehouse_file'], data['warehouse_sha256'],
+                data['preorders_file'], data['preorders_sha256']
+            )
+            order_cache.put(cache_key, output_bytes, quantities, generator.last_diagnostics)
         # Если ничего не найдено по складу — отправим предпросмотр для диагностики
         if quantities and sum(quantities.values()) == 0:
             # ничего не зашло во вход (защита от деления на 0 ниже)
@@ -1433,42 +1634,27 @@ async def process_preorders_file(message: Message, state: FSMContext):
                 quantity_col = price_config.get('quantity_col', 9)
                 preview = generator.preview_warehouse(data['warehouse_file'], article_col, quantity_col, rows=10)
                 # краткая сводка
-                if warehouse_diag:
-                    summary = (
-                        f"Строк просмотрено: {warehouse_diag.get('rows_seen', '?')}, "
-                        f"артикулов: {warehouse_diag.get('articles_seen', '?')}, "
-                        f"кол-во>0: {warehouse_diag.get('valid_qty_rows', '?')}, "
-                        f"итемов: {warehouse_diag.get('total_items_found', 0)}"
-                    )
-                else:
-                    summary = "(нет метрик)"
+                summary = warehouse_summary(warehouse_diag)
                 await message.answer("🔎 Диагностика файла 'Заказ на склад':\n" + summary + "\n\n" + preview[:3500])
             except Exception as _:
                 # молча игнорируем предпросмотр, чтобы не прерывать сценарий
                 pass
         
         # Отправляем результат
-        result_file = FSInputFile(str(output_file))
-        
-        builder = InlineKeyboardBuilder()
-        builder.button(text="🔙 В главное меню", callback_data="menu_main")
+        result_file = BufferedInputFile(output_bytes, filename=output_name)
+        if ARCHIVE_ORDERS:
+            await asyncio.to_thread((OUTPUT_DIR / output_name).write_bytes, output_bytes)
         
         await message.answer(
             f"✅ Заказ успешно сгенерирован!\n\n"
             f"📊 Найдено товаров: {len(quantities)}\n"
             f"📦 Общее количество: {sum(quantities.values())}",
-            reply_markup=builder.as_markup()
+            reply_markup=get_order_result_keyboard()
         )
         await message.answer_document(result_file)
         
-        # Очищаем данные пользователя
-        user_data[user_id] = {
-            'price_file': None,
-            'warehouse_file': None,
-            'preorders_file': None,
-            'supplier': None,
-            'config': None
-        }
+        # Очищаем данные пользователя, входы заказа оставляем для исправлений
+        keep_order_session(user_id, data, order_session)
         
         await state.clear()
         
@@ -1476,15 +1662,260 @@ async def process_preorders_file(message: Message, state: FSMContext):
         logger.error(f"Ошибка при генерации заказа: {e}", exc_info=True)
         await message.answer(f"❌ Ошибка при генерации заказа: {str(e)}")
         await state.clear()
-    finally:
-        # Удаляем загруженные временные файлы: склад и предзаказы
-        try:
-            if warehouse_tmp_path and os.path.exists(warehouse_tmp_path):
-                os.remove(warehouse_tmp_path)
-        except Exception:
-            pass
-        try:
-            if preorders_tmp_path and os.path.exists(preorders_tmp_path):
-                os.remove(preorders_tmp_path)
-        except Exception:
-            pass
+
+
+@dp.callback_query(F.data.in_({"regen_warehouse", "regen_preorders"}))
+async def callback_regen_order(callback: CallbackQuery, state: FSMContext):
+    """Исправление одного из входных файлов последнего заказа"""
+    data = get_user_data(callback.from_user.id)
+    if not data.get('last_order'):
+        await callback.answer("❌ Нет заказа для исправления, сгенерируйте его заново", show_alert=True)
+        return
+    kind = callback.data.replace("regen_", "")
+    data['regen_kind'] = kind
+    title = "Заказ на склад" if kind == 'warehouse' else "Предзаказы клиентов"
+    await callback.message.answer(f"📤 Загрузите исправленный файл '{title}' (Excel файл):")
+    await state.set_state(OrderStates.waiting_for_correction)
+    await callback.answer()
+
+
+@dp.message(StateFilter(OrderStates.waiting_for_correction), F.document)
+async def process_correction_file(message: Message, state: FSMContext):
+    """Перегенерация заказа: заново читается только исправленный файл"""
+    user_id = message.from_user.id
+    data = get_user_data(user_id)
+    kind = data.get('regen_kind')
+    if not data.get('last_order') or kind not in ('warehouse', 'preorders'):
+        await message.answer("❌ Нет заказа для исправления, сгенерируйте его заново")
+        await state.clear()
+        return
+    
+    file_name = message.document.file_name or ""
+    if not file_name.lower().endswith('.xlsx'):
+        await message.answer("❌ Пожалуйста, отправьте файл Excel в формате .xlsx")
+        return
+    
+    try:
+        content = await download_to_memory(message.document)
+        await store_input(user_id, data, kind, content)
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке исправленного файла: {e}")
+        await message.answer(f"❌ Ошибка при загрузке файла: {str(e)}")
+        return
+    if not await load_inputs(data, 'warehouse', 'preorders'):
+        await answer_session_expired(message, state)
+        return
+    
+    await message.answer("⏳ Пересобираю заказ...")
+    try:
+        supplier_name = data['supplier']
+        config = await asyncio.to_thread(resolve_supplier, supplier_name)
+        if not config:
+            await message.answer(f"❌ Поставщик '{supplier_name}' не найден")
+            await state.clear()
+            return
+        # Конфигурация или прайс поменялись (или сессию восстановили в другом процессе) —
+        # предыдущий результат не годится
+        order_session = data.get('order_session')
+        if order_session is None or not order_session.matches(supplier_name, config, data['price_sha256']):
+            order_session = IncrementalOrderSession(supplier_name, config, data['price_file'], data['price_sha256'])
+        cache_key = order_cache.make_key(data['price_sha256'], data['warehouse_sha256'],
+                                         data['preorders_sha256'], config)
+        output_bytes, quantities = await asyncio.to_thread(
+            order_session.generate,
+            data['warehouse_file'], data['warehouse_sha256'],
+            data['preorders_file'], data['preorders_sha256']
+        )
+        order_cache.put(cache_key, output_bytes, quantities, order_session.generator.last_diagnostics)
+        
+        output_name = f"{user_id}_order_{message.document.file_id}.xlsx"
+        if ARCHIVE_ORDERS:
+            await asyncio.to_thread((OUTPUT_DIR / output_name).write_bytes, output_bytes)
+        await message.answer(
+            f"✅ Заказ пересобран!\n\n"
+            f"📊 Найдено товаров: {len(quantities)}\n"
+            f"📦 Общее количество: {sum(quantities.values())}",
+            reply_markup=get_order_result_keyboard()
+        )
+        await message.answer_document(BufferedInputFile(output_bytes, filename=output_name))
+        keep_order_session(user_id, data, order_session)
+    except Exception as e:
+        logger.error(f"Ошибка при перегенерации заказа: {e}", exc_info=True)
+        await message.answer(f"❌ Ошибка при генерации заказа: {str(e)}")
+    await state.clear()
+
+
+def batch_suppliers_with_price() -> list:
+    """Поставщики, для которых есть сохранённый прайс-лист (только они участвуют в пакете)."""
+    result = []
+    for supplier in config_manager.list_suppliers():
+        config = resolve_supplier(supplier) or {}
+        if config.get('price_file') and os.path.exists(config['price_file']):
+            result.append(supplier)
+    return result
+
+
+async def batch_available(data: Dict) -> list:
+    """Список для клавиатуры пакета: считается при открытии меню и берётся из сессии при кликах."""
+    if data.get('batch_available') is None:
+        data['batch_available'] = await asyncio.to_thread(batch_suppliers_with_price)
+    return data['batch_available']
+
+
+def get_batch_keyboard(suppliers: list, selected: list):
+    builder = InlineKeyboardBuilder()
+    for supplier in suppliers:
+        mark = "✅ " if supplier in selected else ""
+        builder.button(text=f"{mark}{supplier}", callback_data=f"batch_toggle_{supplier}")
+    builder.button(text="☑️ Выбрать все", callback_data="batch_all")
+    builder.button(text="➡️ Далее", callback_data="batch_done")
+    builder.button(text="❌ Отменить", callback_data="cancel_order")
+    builder.adjust(1)
+    return builder.as_markup()
+
+
+@dp.callback_query(F.data == "menu_batch")
+async def callback_menu_batch(callback: CallbackQuery, state: FSMContext):
+    """Обработчик меню пакетной генерации заказов"""
+    suppliers = await asyncio.to_thread(batch_suppliers_with_price)
+    if not suppliers:
+        builder = InlineKeyboardBuilder()
+        builder.button(text="🔙 Назад в меню", callback_data="menu_main")
+        await callback.message.edit_text(
+            "❌ Нет поставщиков с сохранённым прайс-листом.",
+            reply_markup=builder.as_markup()
+        )
+        await callback.answer()
+        return
+    data = sessions.reset(callback.from_user.id)
+    data['batch_available'] = suppliers
+    # Список, а не set: выбор сохраняется в общем хранилище сессий вместе с остальными данными
+    data['batch_suppliers'] = sorted(suppliers)
+    await callback.message.edit_text(
+        "🗂️ Выберите поставщиков для заказа (по умолчанию выбраны все):",
+        reply_markup=get_batch_keyboard(suppliers, data['batch_suppliers'])
+    )
+    await callback.answer()
+
+
+@dp.callback_query(F.data.startswith("batch_toggle_"))
+async def callback_batch_toggle(callback: CallbackQuery):
+    """Обработчик выбора поставщика в пакете"""
+    supplier_name = callback.data.replace("batch_toggle_", "")
+    data = get_user_data(callback.from_user.id)
+    selected = set(data.get('batch_suppliers') or [])
+    if supplier_name in selected:
+        selected.remove(supplier_name)
+    else:
+        selected.add(supplier_name)
+    data['batch_suppliers'] = selected = sorted(selected)
+    suppliers = await batch_available(data)
+    await callback.message.edit_reply_markup(reply_markup=get_batch_keyboard(suppliers, selected))
+    await callback.answer()
+
+
+@dp.callback_query(F.data == "batch_all")
+async def callback_batch_all(callback: CallbackQuery):
+    """Обработчик выбора всех поставщиков в пакете"""
+    data = get_user_data(callback.from_user.id)
+    suppliers = await batch_available(data)
+    data['batch_suppliers'] = sorted(suppliers)
+    await callback.message.edit_reply_markup(reply_markup=get_batch_keyboard(suppliers, data['batch_suppliers']))
+    await callback.answer()
+
+
+@dp.callback_query(F.data == "batch_done")
+async def callback_batch_done(callback: CallbackQuery, state: FSMContext):
+    """Обработчик завершения выбора поставщиков"""
+    data = get_user_data(callback.from_user.id)
+    if not data.get('batch_suppliers'):
+        await callback.answer("❌ Выберите хотя бы одного поставщика", show_alert=True)
+        return
+    builder = InlineKeyboardBuilder()
+    builder.button(text="❌ Отменить", callback_data="cancel_order")
+    await callback.message.edit_text(
+        f"✅ Выбрано поставщиков: {len(data['batch_suppliers'])}\n\n"
+        f"📤 Загрузите файл 'Заказ на склад' (Excel файл):",
+        reply_markup=builder.as_markup()
+    )
+    await state.set_state(OrderStates.waiting_for_batch_warehouse)
+    await callback.answer()
+
+
+@dp.message(StateFilter(OrderStates.waiting_for_batch_warehouse), F.document)
+async def process_batch_warehouse_file(message: Message, state: FSMContext):
+    """Обработка загрузки заказа на склад для пакета"""
+    data = get_user_data(message.from_user.id)
+    file_name = message.document.file_name or ""
+    if not file_name.lower().endswith('.xlsx'):
+        await message.answer("❌ Пожалуйста, отправьте файл Excel в формате .xlsx")
+        return
+    try:
+        await store_input(message.from_user.id, data, 'warehouse', await download_to_memory(message.document))
+        await message.answer("✅ Заказ на склад загружен!\n\n📤 Теперь загрузите файл 'Предзаказы клиентов' (Excel файл):")
+        await state.set_state(OrderStates.waiting_for_batch_preorders)
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке заказа на склад: {e}")
+        await message.answer(f"❌ Ошибка при загрузке файла: {str(e)}")
+
+
+@dp.message(StateFilter(OrderStates.waiting_for_batch_preorders), F.document)
+async def process_batch_preorders_file(message: Message, state: FSMContext):
+    """Обработка загрузки предзаказов и пакетная генерация заказов"""
+    user_id = message.from_user.id
+    data = get_user_data(user_id)
+    file_name = message.document.file_name or ""
+    if not file_name.lower().endswith('.xlsx'):
+        await message.answer("❌ Пожалуйста, отправьте файл Excel в формате .xlsx")
+        return
+    try:
+        await store_input(user_id, data, 'preorders', await download_to_memory(message.document))
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке предзаказов: {e}")
+        await message.answer(f"❌ Ошибка при загрузке файла: {str(e)}")
+        return
+    selected = data.get('batch_suppliers')
+    if not selected or not await load_inputs(data, 'warehouse'):
+        # Сессия истекла (или сброшена) между шагами: выбор поставщиков нужно повторить
+        await state.clear()
+        builder = InlineKeyboardBuilder()
+        builder.button(text="🗂️ Выбрать поставщиков", callback_data="menu_batch")
+        builder.button(text="🔙 Назад в меню", callback_data="menu_main")
+        builder.adjust(1)
+        await message.answer("⌛ Выбор поставщиков для пакета устарел, начните заново.",
+                             reply_markup=builder.as_markup())
+        return
+
+    await message.answer(f"⏳ Генерирую заказы для {len(selected)} поставщиков...")
+    try:
+        configs = {}
+        for supplier_name in selected:
+            config = await asyncio.to_thread(resolve_supplier, supplier_name)
+            if config and config.get('price_file'):
+                configs[supplier_name] = config
+        # Файлы заказов из пула процессов лежат в разделяемой памяти только до выхода из with
+        with BatchOrderBuilder(data['warehouse_file'], data['preorders_file'], pool=get_generation_pool()) as builder:
+            results = await asyncio.to_thread(builder.run, configs)
+            archive = await asyncio.to_thread(zip_orders, results)
+            has_orders = any(result.output is not None for result in results.values())
+
+        lines = []
+        for supplier_name, result in results.items():
+            if result.error:
+                lines.append(f"❌ {supplier_name}: {result.error}")
+            else:
+                lines.append(f"✅ {supplier_name}: товаров {len(result.quantities)}, "
+                             f"количество {sum(result.quantities.values())}")
+        menu = InlineKeyboardBuilder()
+        menu.button(text="🔙 В главное меню", callback_data="menu_main")
+        await message.answer("📦 Пакетная генерация завершена:\n\n" + "\n".join(lines), reply_markup=menu.as_markup())
+        if has_orders:
+            await message.answer_document(BufferedInputFile(archive, filename=f"{user_id}_orders.zip"))
+
+        # Как и после одиночного заказа, сессия сбрасывается только после успешной генерации
+        sessions.reset(user_id)
+        await state.clear()
+    except Exception as e:
+        logger.error(f"Ошибка при пакетной генерации заказов: {e}", exc_info=True)
+        await message.answer(f"❌ Ошибка при генерации заказов: {str(e)}")
+        await state.clear()
@@ -1,17 +1,31 @@
 """Точка входа Telegram-бота"""
 import asyncio
 import logging
+import multiprocessing
 import os
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List
 
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.base import StorageKey
 from dotenv import load_dotenv
 
+from app.bot.session_store import SessionStore, TTLMemoryStorage
+from app.core.blob_store import BlobStore
+from app.core.db import Database
+from app.excel.excel_processor import preload_openpyxl
+from app.excel.order_cache import OrderResultCache
 from app.managers.config_manager import SupplierConfigManager
+from app.managers.price_index_manager import PriceIndexManager
 from app.managers.user_manager import UserManager
+from app.scheduler.janitor import MIN_FILE_AGE, CleanupRule, StorageJanitor
+from app.scheduler.leader import LeaderLease
 from app.scheduler.notification_scheduler import NotificationScheduler
+from app.scheduler.order_jobs import JobResultDispatcher, OrderJobQueue, OrderJobWorker
 
 
 load_dotenv()
@@ -24,10 +38,56 @@ if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не установлен в переменных окружения")
 
 ACCESS_PASSWORD = os.getenv('ACCESS_PASSWORD', '123')
+NOTIFICATION_DIGEST = os.getenv('NOTIFICATION_DIGEST', '1').lower() not in ('0', 'false', 'no')
+
+SESSION_TTL = float(os.getenv('SESSION_TTL', '7200'))
+SESSION_MAX = int(os.getenv('SESSION_MAX', '1000'))
+
+# polling — long polling; webhook — встроенный сервер aiohttp (см. app/bot/webhook.py)
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+if BOT_MODE == 'webhook' and not WEBHOOK_SECRET:
+    raise ValueError("WEBHOOK_SECRET не установлен в переменных окружения (нужен в режиме webhook)")
+# Сколько апдейтов обрабатывается одновременно в режимах webhook и супервизора
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '32'))
+# Сколько секунд при остановке ждать завершения начатых апдейтов
+UPDATE_DRAIN_TIMEOUT = float(os.getenv('UPDATE_DRAIN_TIMEOUT', '30'))
+
+# Номер процесса и число процессов в режиме супервизора (python -m app.supervisor).
+# Уведомления, очистка хранилища и доставка чужих результатов — только в процессе 0
+BOT_WORKER_INDEX = int(os.getenv('BOT_WORKER_INDEX', '0'))
+BOT_WORKER_COUNT = int(os.getenv('BOT_WORKER_COUNT', '1'))
+
+# memory — состояния в памяти процесса; postgres — общее хранилище для нескольких процессов бота
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'memory').lower()
 
 bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+if FSM_STORAGE == 'postgres':
+    from app.bot.pg_storage import PostgresStorage
+    storage = PostgresStorage(Database.get_instance().dsn,
+                              max_size=int(os.getenv('FSM_POOL_SIZE', '10')),
+                              cache_ttl=float(os.getenv('FSM_CACHE_TTL', '30')))
+else:
+    storage = TTLMemoryStorage(ttl_seconds=SESSION_TTL, max_keys=SESSION_MAX * 5)
 dp = Dispatcher(storage=storage)
+# Временные файлы закрытых сессий удаляет очистка хранилища в отдельном потоке: проверка
+# ссылок ходит в Postgres, а сессии вытесняются прямо в обработчиках
+session_cleanup = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session-cleanup')
+# В режиме postgres сессии дублируются в общем хранилище, и пользователя может обслужить любой процесс
+SHARED_SESSIONS = FSM_STORAGE == 'postgres'
+# Файлы сессий других процессов бота видны только через общее хранилище. Без него при нескольких
+# процессах blob, совпавший по sha256 с чужой загрузкой, нельзя удалять ни при сбросе сессии,
+# ни по квоте: такие файлы удаляет только правило возраста (он намного больше SESSION_TTL)
+SESSION_FILES_VISIBLE = SHARED_SESSIONS or BOT_WORKER_COUNT == 1
+
+
+def release_session_files(paths) -> None:
+    if SESSION_FILES_VISIBLE:
+        session_cleanup.submit(storage_janitor.release, paths)
+
+
+sessions = SessionStore(ttl_seconds=SESSION_TTL, max_sessions=SESSION_MAX,
+                        release_files=release_session_files, shared=SHARED_SESSIONS)
 
 config_manager = SupplierConfigManager()
 user_manager = UserManager()
@@ -35,25 +95,337 @@ notification_scheduler: NotificationScheduler | None = None
 
 UPLOAD_DIR = Path("uploads")
 OUTPUT_DIR = Path("outputs")
+# Копия сгенерированных заказов на диске нужна только для архива: пользователю файл уходит из памяти
+ARCHIVE_ORDERS = os.getenv('ARCHIVE_ORDERS', '0').lower() in ('1', 'true', 'yes')
 UPLOAD_DIR.mkdir(exist_ok=True)
 OUTPUT_DIR.mkdir(exist_ok=True)
+blob_store = BlobStore(UPLOAD_DIR / "blobs")
+# Индексы и шаблоны прайсов, общие для всех реплик бота
+price_indexes = PriceIndexManager(blob_store)
+order_cache = OrderResultCache(max_bytes=int(os.getenv('ORDER_CACHE_MB', '64')) * 1024 * 1024)
+
+# Очередь заказов в Postgres: обработчик только ставит задание, генерируют воркеры
+# (ORDER_WORKERS потоков в этом процессе и/или отдельные процессы python -m app.worker)
+ORDER_QUEUE = os.getenv('ORDER_QUEUE', '0').lower() in ('1', 'true', 'yes')
+ORDER_WORKERS = int(os.getenv('ORDER_WORKERS', '1'))
+order_queue = OrderJobQueue()
+order_workers = [OrderJobWorker(price_indexes, job_timeout=float(os.getenv('JOB_TIMEOUT', '600')),
+                                retention=float(os.getenv('JOB_RETENTION_HOURS', '168')) * 3600)
+                 for _ in range(ORDER_WORKERS if ORDER_QUEUE else 0)]
+job_results: JobResultDispatcher | None = None
+
+# Пакетная генерация в отдельных процессах (0 — в потоках процесса бота). Файлы заказов
+# возвращаются через разделяемую память (app/excel/result_channel.py), а не через pickle.
+# ORDER_PROCESSES — процессов на хост: в режиме супервизора они делятся между процессами бота.
+# У процессов пула свой кэш индексов прайсов, и PREWARM_PRICE_INDEXES его не прогревает:
+# первый заказ поставщика в каждом процессе пула читает сохранённый индекс с диска
+ORDER_PROCESSES = int(os.getenv('ORDER_PROCESSES', '0'))
+_generation_pool: ProcessPoolExecutor | None = None
+
+
+def get_generation_pool() -> ProcessPoolExecutor | None:
+    """Пул процессов генерации; создаётся при первом пакетном заказе, а не при импорте."""
+    global _generation_pool
+    if _generation_pool is None and ORDER_PROCESSES > 0:
+        _generation_pool = ProcessPoolExecutor(max_workers=max(1, ORDER_PROCESSES // BOT_WORKER_COUNT),
+                                               mp_context=multiprocessing.get_context('spawn'))
+    return _generation_pool
+
+
+# Ключ, под которым в хранилище FSM лежит сериализуемая часть пользовательской сессии
+SESSION_DESTINY = 'session'
+
+
+def session_files() -> List[str]:
+    """Файлы живых сессий: этого процесса и, при общем хранилище, всех процессов бота."""
+    paths = sessions.referenced_files()
+    if SHARED_SESSIONS:
+        paths += Database.get_instance().fsm_session_files(SESSION_DESTINY)
+    return paths
+
+
+DAY = 24 * 3600
+UPLOADS_QUOTA = int(os.getenv('UPLOADS_QUOTA_MB', '2048')) * 1024 * 1024
+if not SESSION_FILES_VISIBLE:
+    logger.warning("Несколько процессов бота без FSM_STORAGE=postgres: квота uploads/ и удаление файлов "
+                   "закрытых сессий отключены, загрузки удаляются только по возрасту")
+storage_janitor = StorageJanitor(
+    config_manager,
+    rules=[
+        CleanupRule(UPLOAD_DIR, max_age_seconds=float(os.getenv('UPLOADS_MAX_AGE_DAYS', '30')) * DAY,
+                    max_total_bytes=UPLOADS_QUOTA if SESSION_FILES_VISIBLE else None),
+        CleanupRule(OUTPUT_DIR, max_age_seconds=float(os.getenv('OUTPUTS_MAX_AGE_DAYS', '7')) * DAY,
+                    max_total_bytes=int(os.getenv('OUTPUTS_QUOTA_MB', '512')) * 1024 * 1024),
+    ],
+    interval=float(os.getenv('JANITOR_INTERVAL', '3600')),
+    extra_references=session_files,
+    on_run=sessions.sweep,
+    # Загрузка попадает в общее хранилище только после обработчика: свежие файлы не освобождаем
+    release_min_age=MIN_FILE_AGE if SHARED_SESSIONS else 0.0,
+)
 
 # Импортируем обработчики (они используют dp/bot/config_manager от сюда)
 from app.bot import handlers  # noqa: E402,F401
 
 
-async def main():
-    global notification_scheduler
-    logger.info("Запуск бота...")
-    notification_scheduler = NotificationScheduler(bot, config_manager, user_manager)
-    scheduler_task = asyncio.create_task(notification_scheduler.start())
+# Готовность к обработке апдейтов: polling стартует сразу, а апдейты, пришедшие
+# до завершения миграции и загрузки пользователей, ждут здесь, а не теряются
+ready = asyncio.Event()
+STARTUP_TIMEOUT = float(os.getenv('STARTUP_TIMEOUT', '120'))
+PREWARM_PRICE_INDEXES = os.getenv('PREWARM_PRICE_INDEXES', '1').lower() not in ('0', 'false', 'no')
+
+
+@dp.update.outer_middleware()
+async def readiness_gate(handler, event, data):
+    if not ready.is_set():
+        await asyncio.wait_for(ready.wait(), timeout=STARTUP_TIMEOUT)
+    return await handler(event, data)
+
+
+def _lower_thread_priority() -> None:
+    # На Linux приоритет задаётся отдельно для каждого потока; на других ОС просто пропускаем
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except (AttributeError, OSError):
+        pass
+
+
+async def prewarm_price_indexes() -> None:
+    """Загружает (или строит) индексы сохранённых прайсов и импортирует openpyxl, чтобы
+    первый заказ после рестарта шёл как в установившемся режиме: прайс не разбирается
+    (заказ пишется в XML шаблона по индексу), а openpyxl уже готов к чтению загрузок.
+    Работает в одном низкоприоритетном потоке, отдельно от пула, которым пользуются обработчики.
+    """
+    started = time.monotonic()
+    loop = asyncio.get_running_loop()
+    try:
+        suppliers = await asyncio.to_thread(config_manager.list_suppliers)
+    except Exception as e:
+        logger.error(f"Прогрев индексов прайсов пропущен: {e}")
+        return
+    stats: Dict[str, int] = {}
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='prewarm',
+                            initializer=_lower_thread_priority) as executor:
+        await loop.run_in_executor(executor, preload_openpyxl)
+        for i, supplier_name in enumerate(suppliers, 1):
+            try:
+                status = await loop.run_in_executor(executor, price_indexes.ensure, supplier_name)
+            except Exception as e:
+                status = 'error'
+                logger.error(f"Прогрев индекса прайса '{supplier_name}' не удался: {e}")
+            stats[status] = stats.get(status, 0) + 1
+            logger.info(f"Прогрев индексов прайсов: {i}/{len(suppliers)} ('{supplier_name}': {status})")
+    logger.info(f"Прогрев индексов прайсов завершён за {time.monotonic() - started:.2f} с: {stats}")
+
+
+# Как часто удалять из общего хранилища FSM записи, не менявшиеся дольше SESSION_TTL
+FSM_PURGE_INTERVAL = float(os.getenv('FSM_PURGE_INTERVAL', '600'))
+
+
+async def session_persistence(handler, event, data):
+    """Синхронизирует сессию пользователя с общим хранилищем на каждом апдейте.
+
+    Сессия читается перед обработкой (предыдущий апдейт мог обработать другой процесс)
+    и сохраняется после неё, если изменилась.
+    """
+    user = data.get('event_from_user')
+    if user is None:
+        return await handler(event, data)
+    key = StorageKey(bot_id=bot.id, chat_id=user.id, user_id=user.id, destiny=SESSION_DESTINY)
+    sessions.restore(user.id, await storage.get_data(key))
+    before = sessions.snapshot(user.id)
+    try:
+        return await handler(event, data)
+    finally:
+        after = sessions.snapshot(user.id)
+        if after != before:
+            await storage.set_data(key, after)
+            sessions.mark_synced(user.id, after)
+
+
+async def purge_shared_sessions() -> None:
+    """Удаляет устаревшие записи FSM и временные файлы брошенных в них сессий."""
+    suffix = f":{SESSION_DESTINY}"
+    while True:
+        await asyncio.sleep(FSM_PURGE_INTERVAL)
+        try:
+            rows = await storage.purge(SESSION_TTL)
+        except Exception as e:
+            logger.error(f"Ошибка очистки хранилища FSM: {e}")
+            continue
+        if not rows:
+            continue
+        files = [path for key, payload in rows if key.endswith(suffix) for path in payload.get('uploads') or []]
+        if files:
+            sessions.release_files(files)
+        logger.info(f"Удалено устаревших записей FSM: {len(rows)}, временных файлов к удалению: {len(files)}")
+
+
+if SHARED_SESSIONS:
+    dp.update.outer_middleware(session_persistence)
+
+
+# Пауза между попытками запуска растёт вдвое до STARTUP_RETRY_MAX секунд
+STARTUP_RETRY_MAX = float(os.getenv('STARTUP_RETRY_MAX', '60'))
+
+
+async def prepare() -> None:
+    """Миграция и загрузка пользователей; при ошибке повторяется, пока база не станет доступна."""
+    delay = 1.0
+    attempt = 1
+    while True:
+        try:
+            await Database.get_instance().ensure_ready()
+            await asyncio.to_thread(user_manager.load)
+            return
+        except Exception as e:
+            logger.error(f"Запуск не удался (попытка {attempt}): {e}; повтор через {delay:.0f} с", exc_info=True)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STARTUP_RETRY_MAX)
+            attempt += 1
+
+
+async def startup():
+    """Миграция схемы и загрузка кэшей в фоне, после чего открывается readiness gate."""
+    global notification_scheduler, job_results
+    started = time.monotonic()
+    await prepare()
+    user_manager.start_sync()
+    ready.set()
+    logger.info(f"Бот готов к обработке апдейтов за {time.monotonic() - started:.2f} с")
+    background = []
+    if BOT_WORKER_INDEX == 0:
+        # Уведомления рассылает только одна реплика — владелец advisory-блокировки
+        leader = LeaderLease(Database.get_instance().dsn, 'notification_scheduler')
+        notification_scheduler = NotificationScheduler(bot, config_manager, user_manager,
+                                                       digest=NOTIFICATION_DIGEST, leader=leader)
+        background += [notification_scheduler.start(), storage_janitor.start()]
+        if SHARED_SESSIONS:
+            background.append(purge_shared_sessions())
+    if ORDER_QUEUE:
+        for worker in order_workers:
+            worker.start()
+        # В режиме супервизора каждый процесс доставляет результаты только своим пользователям
+        shard = (BOT_WORKER_INDEX, BOT_WORKER_COUNT) if BOT_WORKER_COUNT > 1 else None
+        job_results = JobResultDispatcher(handlers.deliver_order_job, shard=shard)
+        background.append(job_results.start())
+    if PREWARM_PRICE_INDEXES:
+        background.append(prewarm_price_indexes())
+    await asyncio.gather(*background)
+
+
+def stop_on_signals(*signals: int) -> asyncio.Event:
+    """Событие остановки, устанавливаемое указанными сигналами (там, где цикл их поддерживает)."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in signals:
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    return stop_event
+
+
+async def run_webhook():
+    from app.bot.update_feeder import UpdateFeeder
+    from app.bot.webhook import WebhookServer
+
+    feeder = UpdateFeeder(dp, bot, UPDATE_CONCURRENCY)
+    server = WebhookServer(
+        bot, WEBHOOK_SECRET, feeder.feed,
+        path=os.getenv('WEBHOOK_PATH', '/telegram/webhook'),
+        host=os.getenv('WEBHOOK_HOST', '0.0.0.0'),
+        port=int(os.getenv('WEBHOOK_PORT', '8080')),
+        public_url=os.getenv('WEBHOOK_URL') or None,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=UPDATE_CONCURRENCY,
+    )
+    stop_event = stop_on_signals(signal.SIGINT, signal.SIGTERM)
+    await feeder.startup()
+    try:
+        await server.run(stop_event, on_stop=lambda: feeder.drain(UPDATE_DRAIN_TIMEOUT))
+    finally:
+        await feeder.shutdown()
+
+
+async def run_routed(updates) -> None:
+    """Обрабатывает апдейты из канала супервизора (Connection из multiprocessing.Pipe).
+
+    Приходят пары (seq, апдейт), None — остановка. Обработанный апдейт подтверждается
+    отправкой seq обратно: неподтверждённые апдейты супервизор повторит, если процесс упадёт.
+    """
+    from app.bot.update_feeder import UpdateFeeder
+
+    feeder = UpdateFeeder(dp, bot, UPDATE_CONCURRENCY)
+    # SIGINT из терминала приходит всей группе процессов — останавливает супервизор
+    stop_event = stop_on_signals(signal.SIGTERM)
+    loop = asyncio.get_running_loop()
+
+    def ack(seq: int) -> None:
+        try:
+            updates.send(seq)
+        except OSError:
+            # Супервизор уже закрыл канал: подтверждать некому
+            pass
+
+    def pump():
+        while True:
+            try:
+                message = updates.recv()
+            except (EOFError, OSError):
+                message = None
+            if message is None:
+                loop.call_soon_threadsafe(stop_event.set)
+                return
+            seq, payload = message
+            # Ждём свободного слота прямо в потоке чтения: апдейты копятся у супервизора
+            accepted = asyncio.run_coroutine_threadsafe(
+                feeder.feed(payload, on_done=lambda seq=seq: ack(seq)), loop).result()
+            if not accepted:
+                loop.call_soon_threadsafe(ack, seq)
+
+    await feeder.startup()
+    threading.Thread(target=pump, name="routed-updates", daemon=True).start()
+    logger.info(f"Процесс бота {BOT_WORKER_INDEX}/{BOT_WORKER_COUNT} принимает апдейты от супервизора")
+    try:
+        await stop_event.wait()
+        await feeder.drain(UPDATE_DRAIN_TIMEOUT)
+    finally:
+        await feeder.shutdown()
+
+
+def _log_startup_failure(task: asyncio.Task) -> None:
+    # Без этого исключение фоновой задачи запуска всплыло бы только при остановке бота
+    if not task.cancelled() and task.exception() is not None:
+        logger.critical("Фоновый запуск бота завершился ошибкой", exc_info=task.exception())
+
+
+async def main(updates=None):
+    """updates — канал апдейтов от супервизора; без него бот получает апдейты сам."""
+    logger.info(f"Запуск бота (режим: {'supervisor' if updates is not None else BOT_MODE})...")
+    startup_task = asyncio.create_task(startup())
+    startup_task.add_done_callback(_log_startup_failure)
     try:
-        await dp.start_polling(bot)
+        if updates is not None:
+            await run_routed(updates)
+        elif BOT_MODE == 'webhook':
+            await run_webhook()
+        else:
+            await dp.start_polling(bot)
     finally:
-        notification_scheduler.stop()
-        scheduler_task.cancel()
+        if notification_scheduler:
+            notification_scheduler.stop()
+        storage_janitor.stop()
+        if job_results:
+            job_results.stop()
+        for worker in order_workers:
+            worker.stop()
+        if _generation_pool:
+            _generation_pool.shutdown(wait=False, cancel_futures=True)
+        user_manager.stop_sync()
+        startup_task.cancel()
         try:
-            await scheduler_task
+            await startup_task
         except asyncio.CancelledError:
             pass
 
@@ -0,0 +1,189 @@
+"""Хранилище FSM aiogram в Postgres для нескольких процессов бота"""
+import asyncio
+import copy
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+
+from app.core.db import Database, FSM_CHANNEL
+
+
+logger = logging.getLogger(__name__)
+
+
+def build_key(key: StorageKey) -> str:
+    parts = [str(key.bot_id)]
+    if getattr(key, 'business_connection_id', None):
+        parts.append(key.business_connection_id)
+    parts.extend((str(key.chat_id), str(key.user_id)))
+    if key.thread_id:
+        parts.append(str(key.thread_id))
+    parts.append(key.destiny)
+    return ":".join(parts)
+
+
+class PostgresStorage(BaseStorage):
+    """Состояния и данные FSM в таблице fsm_storage (state TEXT, data JSONB).
+
+    Соединения берутся из пула psycopg_pool. Прочитанные строки держатся в небольшом
+    локальном кэше (TTL + LRU). Каждая запись публикует NOTIFY в FSM_CHANNEL, и другие
+    процессы бота сбрасывают у себя этот ключ; после переподключения слушателя кэш
+    очищается целиком, поскольку уведомления за время разрыва потеряны.
+    Записи, не менявшиеся дольше заданного срока, удаляет purge.
+    """
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 10,
+                 cache_ttl: float = 30.0, cache_size: int = 5000):
+        self.pool = AsyncConnectionPool(dsn, min_size=min_size, max_size=max_size, open=False)
+        self.dsn = dsn
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        # Свои уведомления не обрабатываем: кэш этого процесса уже обновлён при записи
+        self.origin = uuid.uuid4().hex
+        self._cache: "OrderedDict[str, Tuple[float, Optional[str], Dict[str, Any]]]" = OrderedDict()
+        self._open_lock = asyncio.Lock()
+        self._opened = False
+        self._listen_stop = threading.Event()
+
+    async def _ensure_open(self) -> None:
+        if self._opened:
+            return
+        async with self._open_lock:
+            if not self._opened:
+                await self.pool.open()
+                self._start_listener()
+                self._opened = True
+
+    def _start_listener(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._listen_stop.clear()
+        threading.Thread(
+            target=Database(self.dsn).listen,
+            args=(FSM_CHANNEL, lambda payload: loop.call_soon_threadsafe(self._invalidate, payload),
+                  self._listen_stop),
+            kwargs={'on_connect': lambda: loop.call_soon_threadsafe(self._cache.clear)},
+            name="fsm-listen",
+            daemon=True,
+        ).start()
+
+    def _invalidate(self, payload: str) -> None:
+        origin, _, key = payload.partition(':')
+        if origin == self.origin:
+            return
+        if key == '*':
+            self._cache.clear()
+        else:
+            self._cache.pop(key, None)
+
+    async def _notify(self, conn, key: str) -> None:
+        # Уведомление уходит вместе с фиксацией транзакции записи
+        await conn.execute("SELECT pg_notify(%s, %s)", (FSM_CHANNEL, f"{self.origin}:{key}"))
+
+    def _cached(self, key: str) -> Optional[Tuple[Optional[str], Dict[str, Any]]]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, state, data = entry
+        if expires_at < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return state, data
+
+    def _remember(self, key: str, state: Optional[str], data: Dict[str, Any]) -> None:
+        self._cache[key] = (time.monotonic() + self.cache_ttl, state, data)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+        await self._ensure_open()
+        async with self.pool.connection() as conn:
+            cur = await conn.execute("SELECT state, data FROM fsm_storage WHERE key = %s", (key,))
+            row = await cur.fetchone()
+        state, data = (row[0], row[1] or {}) if row else (None, {})
+        self._remember(key, state, data)
+        return state, data
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = build_key(key)
+        value = state.state if isinstance(state, State) else state
+        await self._ensure_open()
+        async with self.pool.connection() as conn:
+            await conn.execute(
+                """
+                INSERT INTO fsm_storage (key, state) VALUES (%s, %s)
+                ON CONFLICT (key) DO UPDATE SET state = EXCLUDED.state, updated_at = now()
+                """,
+                (storage_key, value),
+            )
+            # Пустые записи не храним
+            await conn.execute("DELETE FROM fsm_storage WHERE key = %s AND state IS NULL AND data = '{}'::jsonb",
+                               (storage_key,))
+            await self._notify(conn, storage_key)
+        cached = self._cached(storage_key)
+        if cached is not None:
+            self._remember(storage_key, value, cached[1])
+        else:
+            self._cache.pop(storage_key, None)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(build_key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key = build_key(key)
+        data = copy.deepcopy(data)
+        await self._ensure_open()
+        async with self.pool.connection() as conn:
+            await conn.execute(
+                """
+                INSERT INTO fsm_storage (key, data) VALUES (%s, %s)
+                ON CONFLICT (key) DO UPDATE SET data = EXCLUDED.data, updated_at = now()
+                """,
+                (storage_key, Jsonb(data)),
+            )
+            await conn.execute("DELETE FROM fsm_storage WHERE key = %s AND state IS NULL AND data = '{}'::jsonb",
+                               (storage_key,))
+            await self._notify(conn, storage_key)
+        cached = self._cached(storage_key)
+        if cached is not None:
+            self._remember(storage_key, cached[0], data)
+        else:
+            self._cache.pop(storage_key, None)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(build_key(key))
+        return copy.deepcopy(data)
+
+    async def purge(self, ttl_seconds: float) -> List[Tuple[str, Dict[str, Any]]]:
+        """Удаляет записи, не менявшиеся дольше ttl_seconds; возвращает (ключ, данные) удалённых."""
+        await self._ensure_open()
+        async with self.pool.connection() as conn:
+            cur = await conn.execute(
+                "DELETE FROM fsm_storage WHERE updated_at < now() - make_interval(secs => %s) RETURNING key, data",
+                (ttl_seconds,),
+            )
+            rows = await cur.fetchall()
+            if rows:
+                await self._notify(conn, '*')
+        if rows:
+            self._cache.clear()
+        return [(key, data or {}) for key, data in rows]
+
+    async def close(self) -> None:
+        if self._opened:
+            self._opened = False
+            self._listen_stop.set()
+            await self.pool.close()
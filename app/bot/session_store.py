@@ -0,0 +1,263 @@
+"""Ограниченные по времени жизни и размеру хранилища пользовательских сессий"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+
+logger = logging.getLogger(__name__)
+
+
+def new_session() -> Dict[str, Any]:
+    return {
+        'price_file': None,
+        'warehouse_file': None,
+        'preorders_file': None,
+        'supplier': None,
+        'config': None,
+        # Временные загрузки, принадлежащие сессии: удаляются вместе с ней
+        'uploads': [],
+    }
+
+
+# Объекты в памяти, построенные из данных сессии: при восстановлении из общего хранилища
+# они сохраняются, только если исходные данные не поменялись (байты файла — по его sha256)
+DERIVED_FROM = {
+    'warehouse_file': 'warehouse_sha256',
+    'preorders_file': 'preorders_sha256',
+}
+
+
+def _is_serializable(value: Any) -> bool:
+    try:
+        json.dumps(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def _remove_files(paths: List[str]) -> None:
+    for path in paths:
+        try:
+            if path and os.path.exists(path):
+                os.remove(path)
+        except Exception as e:
+            logger.warning(f"Не удалось удалить временный файл {path}: {e}")
+
+
+class SessionStore:
+    """Сессии пользователей с TTL и LRU-вытеснением.
+
+    При вытеснении, истечении или сбросе сессии удаляются зарегистрированные в ней
+    через track_file временные файлы, поэтому брошенные сценарии не оставляют мусор в uploads/.
+    release_files заменяет немедленное удаление: например, передаёт пути очистке хранилища,
+    которая в фоне пропускает файлы, всё ещё используемые поставщиками и другими сессиями.
+
+    shared=True — сессии дублируются в общем хранилище (snapshot/restore) и их может
+    продолжить другой процесс бота. Тогда вытеснение по TTL/LRU убирает только копию
+    в памяти, а файлы освобождаются при сбросе сессии или при очистке общего хранилища.
+    """
+
+    def __init__(self, ttl_seconds: float = 7200, max_sessions: int = 1000,
+                 release_files: Optional[Callable[[List[str]], None]] = None, shared: bool = False):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.release_files = release_files or _remove_files
+        self.shared = shared
+        self._sessions: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._touched: Dict[int, float] = {}
+        # Последний снимок, совпадающий с общим хранилищем: по нему видно, что сессию меняли извне
+        self._synced: Dict[int, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, user_id: int) -> Dict[str, Any]:
+        with self._lock:
+            self._evict_expired()
+            session = self._sessions.get(user_id)
+            if session is None:
+                session = new_session()
+                self._sessions[user_id] = session
+                self._evict_overflow()
+            else:
+                self._sessions.move_to_end(user_id)
+            self._touched[user_id] = time.monotonic()
+            return session
+
+    def has(self, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self._sessions
+
+    def snapshot(self, user_id: int) -> Dict[str, Any]:
+        """Сериализуемая часть сессии для общего хранилища.
+
+        Байты входных файлов, фоновые задачи и объекты генерации остаются только в памяти
+        процесса: файлы восстанавливаются по sha256, объекты строятся заново при необходимости.
+        """
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                return {}
+            return {k: v for k, v in session.items()
+                    if v is not None and v != [] and _is_serializable(v)}
+
+    def restore(self, user_id: int, payload: Dict[str, Any]) -> None:
+        """Приводит сессию в памяти к состоянию из общего хранилища.
+
+        Если хранилище не менялось с последней синхронизации этого процесса, ничего не делает:
+        так не теряются изменения параллельных апдейтов этого же пользователя. Иначе
+        сериализуемая часть заменяется целиком (словарь обновляется на месте), а объекты
+        в памяти остаются, если построены из тех же данных (DERIVED_FROM).
+        """
+        with self._lock:
+            if self._synced.get(user_id) == payload and user_id in self._sessions:
+                return
+            session = self._sessions.get(user_id)
+            restored = new_session()
+            restored.update(payload)
+            if session is not None:
+                for key, value in session.items():
+                    if key in restored and restored[key] is not None:
+                        continue
+                    if _is_serializable(value):
+                        continue
+                    source = DERIVED_FROM.get(key)
+                    if source and session.get(source) != restored.get(source):
+                        continue
+                    restored[key] = value
+                session.clear()
+                session.update(restored)
+                self._sessions.move_to_end(user_id)
+            else:
+                self._sessions[user_id] = restored
+            self._touched[user_id] = time.monotonic()
+            self._synced[user_id] = payload
+            self._evict_overflow()
+
+    def mark_synced(self, user_id: int, payload: Dict[str, Any]) -> None:
+        """Снимок payload записан в общее хранилище."""
+        with self._lock:
+            if user_id in self._sessions:
+                self._synced[user_id] = payload
+
+    def track_file(self, user_id: int, path: str) -> None:
+        uploads = self.get(user_id)['uploads']
+        if str(path) not in uploads:
+            uploads.append(str(path))
+
+    def untrack_file(self, user_id: int, path: str) -> None:
+        """Файл больше не временный (например, сохранён в конфигурации поставщика)."""
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is not None and str(path) in session['uploads']:
+                session['uploads'].remove(str(path))
+
+    def reset(self, user_id: int, keep: Iterable[str] = (), keep_files: Iterable[str] = ()) -> Dict[str, Any]:
+        """Новая пустая сессия; keep — ключи, переносимые из старой, keep_files — её файлы, которые
+        по-прежнему нужны (остаются за новой сессией, остальные освобождаются)."""
+        with self._lock:
+            old = self._sessions.pop(user_id, None)
+            self._touched.pop(user_id, None)
+        session = self.get(user_id)
+        if old:
+            for key in keep:
+                session[key] = old.get(key)
+            keep_files = {str(path) for path in keep_files}
+            session['uploads'] = [path for path in old['uploads'] if path in keep_files]
+            released = [path for path in old['uploads'] if path not in keep_files]
+            if released:
+                self.release_files(released)
+        return session
+
+    def discard(self, user_id: int) -> None:
+        with self._lock:
+            old = self._sessions.pop(user_id, None)
+            self._touched.pop(user_id, None)
+            self._synced.pop(user_id, None)
+        if old:
+            self.release_files(old['uploads'])
+
+    def referenced_files(self) -> List[str]:
+        """Файлы, которые сейчас используются живыми сессиями."""
+        with self._lock:
+            paths: List[str] = []
+            for session in self._sessions.values():
+                paths.extend(session['uploads'])
+                paths.extend(session[k] for k in ('price_file', 'warehouse_file', 'preorders_file') if isinstance(session.get(k), str))
+            return paths
+
+    def sweep(self) -> int:
+        with self._lock:
+            return self._evict_expired()
+
+    def _evict(self, user_id: int) -> None:
+        session = self._sessions.pop(user_id)
+        self._touched.pop(user_id, None)
+        self._synced.pop(user_id, None)
+        # Сессию из общего хранилища может продолжить другой процесс: её файлы ещё нужны
+        if not self.shared:
+            self.release_files(session['uploads'])
+
+    def _evict_expired(self) -> int:
+        deadline = time.monotonic() - self.ttl_seconds
+        evicted = 0
+        # OrderedDict упорядочен по последнему обращению: просроченные — в начале
+        while self._sessions:
+            user_id = next(iter(self._sessions))
+            if self._touched.get(user_id, 0) > deadline:
+                break
+            self._evict(user_id)
+            evicted += 1
+        if evicted:
+            logger.info(f"Удалено просроченных сессий: {evicted}")
+        return evicted
+
+    def _evict_overflow(self) -> None:
+        while len(self._sessions) > self.max_sessions:
+            self._evict(next(iter(self._sessions)))
+
+
+class TTLMemoryStorage(MemoryStorage):
+    """MemoryStorage aiogram с TTL и ограничением числа ключей (LRU)."""
+
+    def __init__(self, ttl_seconds: float = 7200, max_keys: int = 5000):
+        super().__init__()
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max_keys
+        self._touched: "OrderedDict[StorageKey, float]" = OrderedDict()
+
+    def _touch(self, key: StorageKey) -> None:
+        now = time.monotonic()
+        self._touched[key] = now
+        self._touched.move_to_end(key)
+        deadline = now - self.ttl_seconds
+        while self._touched:
+            oldest, touched_at = next(iter(self._touched.items()))
+            if touched_at > deadline and len(self._touched) <= self.max_keys:
+                break
+            del self._touched[oldest]
+            self.storage.pop(oldest, None)
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        self._touch(key)
+        await super().set_state(key, state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        self._touch(key)
+        return await super().get_state(key)
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        self._touch(key)
+        await super().set_data(key, data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        self._touch(key)
+        return await super().get_data(key)
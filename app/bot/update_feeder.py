@@ -0,0 +1,76 @@
+"""Передача апдейтов в диспетчер в фоновых задачах с ограничением параллельности"""
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateFeeder:
+    """Обрабатывает апдейты, пришедшие не через polling (webhook, супервизор).
+
+    Каждый апдейт обрабатывается в отдельной задаче, одновременно — не больше
+    max_concurrency: когда все слоты заняты, feed ждёт свободного, и источник
+    апдейтов притормаживает. startup/shutdown повторяют жизненный цикл start_polling.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, max_concurrency: int = 32):
+        self.dp = dp
+        self.bot = bot
+        self.max_concurrency = max(1, max_concurrency)
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._workflow_data = {"dispatcher": dp, "bots": [bot], **dp.workflow_data}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def startup(self) -> None:
+        await self.dp.emit_startup(bot=self.bot, **self._workflow_data)
+
+    async def feed(self, payload: Dict[str, Any], on_done: Optional[Callable[[], None]] = None) -> bool:
+        """Ставит апдейт в обработку; False — апдейт не разобран.
+
+        on_done вызывается в цикле событий, когда обработка закончилась (в том числе ошибкой).
+        """
+        try:
+            update = Update.model_validate(payload, context={"bot": self.bot})
+        except ValueError as e:
+            logger.warning(f"Некорректный апдейт: {e}")
+            return False
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update, on_done))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _process(self, update: Update, on_done: Optional[Callable[[], None]] = None) -> None:
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            logger.error(f"Ошибка обработки апдейта {update.update_id}: {e}", exc_info=True)
+        finally:
+            self._slots.release()
+        # Отменённый при остановке апдейт не подтверждается
+        if on_done:
+            on_done()
+
+    async def drain(self, timeout: float) -> None:
+        """Ждёт завершения начатых апдейтов, не дождавшиеся за timeout секунд отменяются."""
+        if not self._tasks:
+            return
+        logger.info(f"Ожидание завершения обработки апдейтов: {len(self._tasks)}")
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+
+    async def shutdown(self) -> None:
+        try:
+            await self.dp.emit_shutdown(bot=self.bot, **self._workflow_data)
+        finally:
+            await self.bot.session.close()
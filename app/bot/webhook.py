@@ -0,0 +1,98 @@
+"""Приём апдейтов Telegram через webhook (встроенный сервер aiohttp).
+
+Локально режим проверяется без Telegram: WEBHOOK_URL не задаётся (webhook не регистрируется),
+а апдейт отправляется на сервер вручную:
+
+    curl -X POST http://127.0.0.1:8080/telegram/webhook \\
+         -H 'X-Telegram-Bot-Api-Secret-Token: <WEBHOOK_SECRET>' -H 'Content-Type: application/json' \\
+         -d '{"update_id": 1, "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"},
+              "from": {"id": 1, "is_bot": false, "first_name": "Test"}, "text": "/start"}}'
+"""
+import asyncio
+import logging
+import secrets
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot
+from aiohttp import web
+
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """HTTP-сервер, принимающий апдейты Telegram.
+
+    Разобранный JSON передаётся в accept (UpdateFeeder.feed или маршрутизатор супервизора);
+    ответ Telegram уходит, как только accept его принял, обработка идёт в фоне.
+    При остановке новые апдейты получают 503 — Telegram повторит их позже, в том числе
+    на другом экземпляре, — пока on_stop дорабатывает начатые.
+    """
+
+    def __init__(self, bot: Bot, secret_token: str, accept: Callable[[Dict[str, Any]], Awaitable[bool]],
+                 path: str = "/telegram/webhook", host: str = "0.0.0.0", port: int = 8080,
+                 public_url: Optional[str] = None, allowed_updates: Optional[List[str]] = None,
+                 max_connections: int = 40):
+        self.bot = bot
+        self.secret_token = secret_token
+        self.accept = accept
+        self.path = path
+        self.host = host
+        self.port = port
+        self.public_url = public_url
+        self.allowed_updates = allowed_updates
+        self.max_connections = max(1, min(max_connections, 100))
+        self._closing = False
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret_token):
+            logger.warning(f"Отклонён webhook-запрос с неверным секретом от {request.remote}")
+            return web.Response(status=401)
+        if self._closing:
+            return web.Response(status=503)
+        try:
+            payload = await request.json()
+        except ValueError as e:
+            logger.warning(f"Некорректный JSON в webhook: {e}")
+            return web.Response(status=400)
+        if not isinstance(payload, dict) or not await self.accept(payload):
+            return web.Response(status=400)
+        return web.Response()
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({'status': 'closing' if self._closing else 'ok'})
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        app.router.add_get("/healthz", self.health)
+        return app
+
+    async def run(self, stop_event: asyncio.Event,
+                  on_stop: Optional[Callable[[], Awaitable[None]]] = None) -> None:
+        """Обслуживает webhook до установки stop_event, затем корректно останавливается."""
+        runner = web.AppRunner(self.build_app())
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+        logger.info(f"Webhook-сервер слушает {self.host}:{self.port}{self.path}")
+        try:
+            if self.public_url:
+                # Webhook не снимается при остановке: другие экземпляры за балансировщиком продолжают работу
+                url = self.public_url.rstrip("/") + self.path
+                await self.bot.set_webhook(url, secret_token=self.secret_token,
+                                           allowed_updates=self.allowed_updates,
+                                           max_connections=self.max_connections)
+                logger.info(f"Webhook зарегистрирован: {url}")
+            else:
+                logger.info("WEBHOOK_URL не задан: webhook не регистрируется, апдейты принимаются только напрямую")
+            await stop_event.wait()
+        finally:
+            self._closing = True
+            try:
+                if on_stop:
+                    await on_stop()
+            finally:
+                await runner.cleanup()
+                logger.info("Webhook-сервер остановлен")
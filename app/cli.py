@@ -0,0 +1,165 @@
+"""Консольная пакетная генерация заказов без Telegram.
+
+Примеры:
+    python -m app.cli --manifest jobs.json --configs suppliers.json --workers 4
+    python -m app.cli --input-dir nightly/ --from-db --report report.json
+
+Манифест — JSON-список заданий {"supplier", "warehouse", "preorders", "price"?, "output"?}.
+В режиме --input-dir каждый подкаталог — задание: имя подкаталога = имя поставщика,
+внутри warehouse.xlsx, preorders.xlsx и необязательный price.xlsx
+(иначе берётся price_file из конфигурации поставщика).
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+
+logger = logging.getLogger(__name__)
+
+
+def load_manifest(path: Path) -> List[Dict]:
+    with open(path, encoding='utf-8') as f:
+        jobs = json.load(f)
+    base = path.parent
+    for job in jobs:
+        for key in ('price', 'warehouse', 'preorders', 'output'):
+            if job.get(key):
+                job[key] = str(base / job[key])
+    return jobs
+
+
+def scan_input_dir(path: Path) -> List[Dict]:
+    jobs = []
+    for job_dir in sorted(p for p in path.iterdir() if p.is_dir()):
+        job = {
+            'supplier': job_dir.name,
+            'warehouse': str(job_dir / 'warehouse.xlsx'),
+            'preorders': str(job_dir / 'preorders.xlsx'),
+        }
+        if (job_dir / 'price.xlsx').exists():
+            job['price'] = str(job_dir / 'price.xlsx')
+        jobs.append(job)
+    return jobs
+
+
+def load_configs(args) -> Dict[str, Dict]:
+    if args.configs:
+        with open(args.configs, encoding='utf-8') as f:
+            return json.load(f)
+    from app.core.blob_store import BlobStore
+    from app.core.db import Database
+    from app.managers.config_manager import SupplierConfigManager
+    from app.managers.price_index_manager import PriceIndexManager
+    Database.get_instance().migrate()
+    manager = SupplierConfigManager()
+    # Прайсы и индексы, которых нет на этой машине, скачиваются из общего хранилища
+    price_indexes = PriceIndexManager(BlobStore(Path('uploads') / 'blobs'))
+    return {name: price_indexes.resolve(name, manager.get_supplier_config(name)) for name in manager.list_suppliers()}
+
+
+def run_job(job: Dict, config: Dict, output_dir: str) -> Dict:
+    """Выполняет одно задание в рабочем процессе и возвращает строку отчёта с таймингами."""
+    from app.excel.order_generator import OrderGenerator
+    from app.excel.price_index import stored_index_path
+
+    report = {'supplier': job['supplier'], 'status': 'ok'}
+    started = time.perf_counter()
+    try:
+        price_file = job.get('price') or config.get('price_file')
+        if not price_file:
+            raise ValueError("не указан прайс-лист")
+        output = job.get('output') or os.path.join(output_dir, f"{job['supplier']}_order.xlsx")
+        generator = OrderGenerator(config['price_list'])
+
+        t = time.perf_counter()
+        warehouse = generator.read_warehouse_order(job['warehouse'], config['warehouse_order'])
+        report['warehouse_s'] = round(time.perf_counter() - t, 4)
+
+        t = time.perf_counter()
+        preorders = generator.read_preorders(job['preorders'], config['preorders'])
+        report['preorders_s'] = round(time.perf_counter() - t, 4)
+
+        t = time.perf_counter()
+        index_path = stored_index_path(config) if not job.get('price') else None
+        index = generator.read_price_index(price_file, index_path=index_path)
+        report['price_index_s'] = round(time.perf_counter() - t, 4)
+
+        t = time.perf_counter()
+        quantities = generator.merge_quantities(warehouse, preorders)
+        generator.render_order(price_file, quantities, output, price_index=index)
+        report['render_s'] = round(time.perf_counter() - t, 4)
+
+        report['items'] = len(quantities)
+        report['total_qty'] = sum(quantities.values())
+        report['output'] = output
+    except Exception as e:
+        report['status'] = 'error'
+        report['error'] = str(e)
+    report['total_s'] = round(time.perf_counter() - started, 4)
+    return report
+
+
+def print_report(rows: List[Dict]) -> None:
+    columns = ('supplier', 'status', 'items', 'warehouse_s', 'preorders_s', 'price_index_s', 'render_s', 'total_s')
+    print("\t".join(columns))
+    for row in rows:
+        print("\t".join(str(row.get(c, '')) for c in columns))
+        if row.get('error'):
+            print(f"  ! {row['error']}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Пакетная генерация заказов без Telegram")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--manifest', type=Path, help="JSON-манифест заданий")
+    source.add_argument('--input-dir', type=Path, help="каталог с подкаталогами заданий")
+    configs = parser.add_mutually_exclusive_group(required=True)
+    configs.add_argument('--configs', type=Path, help="JSON {поставщик: конфигурация}")
+    configs.add_argument('--from-db', action='store_true', help="брать конфигурации поставщиков из Postgres")
+    parser.add_argument('--output-dir', type=Path, default=Path('outputs') / 'cli')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--report', type=Path, help="куда сохранить JSON-отчёт")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    jobs = load_manifest(args.manifest) if args.manifest else scan_input_dir(args.input_dir)
+    supplier_configs = load_configs(args)
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+
+    rows: List[Dict] = []
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {}
+        for job in jobs:
+            config = supplier_configs.get(job['supplier'])
+            if not config:
+                rows.append({'supplier': job['supplier'], 'status': 'error',
+                             'error': "конфигурация поставщика не найдена"})
+                continue
+            futures[pool.submit(run_job, job, config, str(args.output_dir))] = job
+        for future in as_completed(futures):
+            rows.append(future.result())
+    elapsed = time.perf_counter() - started
+
+    rows.sort(key=lambda r: r['supplier'])
+    print_report(rows)
+    failed = sum(1 for r in rows if r['status'] != 'ok')
+    logger.info(f"Заданий: {len(rows)}, ошибок: {failed}, общее время: {elapsed:.2f} с")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({'elapsed_s': round(elapsed, 4), 'jobs': rows}, f, ensure_ascii=False, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
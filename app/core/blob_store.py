@@ -0,0 +1,114 @@
+"""Контентно-адресуемое хранилище загруженных файлов с дедупликацией"""
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def sha256_file(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """Файлы хранятся по SHA-256 содержимого в шардированных каталогах (ab/cd/<sha>.xlsx).
+
+    Дополнительно ведётся индекс file_unique_id Telegram -> sha256: повторная загрузка
+    того же документа (в том числе другим пользователем) не скачивается заново.
+    Хэш содержимого служит ключом для кэшей результатов разбора.
+    """
+
+    def __init__(self, root: Path, suffix: str = '.xlsx'):
+        self.root = Path(root)
+        self.suffix = suffix
+        self.ids_dir = self.root / 'by_id'
+        self.tmp_dir = self.root / 'tmp'
+        self.ids_dir.mkdir(parents=True, exist_ok=True)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256[2:4] / f"{sha256}{self.suffix}"
+
+    def exists(self, sha256: str) -> bool:
+        return self.path_for(sha256).exists()
+
+    def lookup_unique_id(self, file_unique_id: str) -> Optional[str]:
+        pointer = self.ids_dir / file_unique_id
+        try:
+            sha256 = pointer.read_text().strip()
+        except OSError:
+            return None
+        path = self.path_for(sha256)
+        if not path.exists():
+            return None
+        # Обновляем mtime, чтобы очистка по возрасту не удаляла используемые файлы
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return sha256
+
+    def _remember_unique_id(self, file_unique_id: Optional[str], sha256: str) -> None:
+        if not file_unique_id:
+            return
+        pointer = self.ids_dir / file_unique_id
+        tmp = self.tmp_dir / f"{uuid.uuid4().hex}.id"
+        tmp.write_text(sha256)
+        os.replace(tmp, pointer)
+
+    def put_file(self, tmp_path, file_unique_id: Optional[str] = None) -> Tuple[Path, str]:
+        """Переносит временный файл в хранилище (или удаляет его, если такой blob уже есть)."""
+        sha256 = sha256_file(tmp_path)
+        path = self.path_for(sha256)
+        if path.exists():
+            os.remove(tmp_path)
+            os.utime(path)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_path, path)
+        self._remember_unique_id(file_unique_id, sha256)
+        return path, sha256
+
+    def put_bytes(self, data: bytes, file_unique_id: Optional[str] = None) -> Tuple[Path, str]:
+        sha256 = sha256_bytes(data)
+        path = self.path_for(sha256)
+        try:
+            # Как и в put_file: повторно загруженный blob снова «молодой» для очистки
+            os.utime(path)
+        except FileNotFoundError:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.tmp_dir / f"{uuid.uuid4().hex}.part"
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        self._remember_unique_id(file_unique_id, sha256)
+        return path, sha256
+
+    async def fetch(self, bot, document) -> Tuple[Path, str]:
+        """Возвращает (путь, sha256) документа Telegram, скачивая его только при промахе."""
+        sha256 = await asyncio.to_thread(self.lookup_unique_id, document.file_unique_id)
+        if sha256:
+            logger.info(f"Файл {document.file_unique_id} уже в хранилище ({sha256[:12]}), скачивание пропущено")
+            return self.path_for(sha256), sha256
+        file = await bot.get_file(document.file_id)
+        tmp = self.tmp_dir / f"{uuid.uuid4().hex}.part"
+        try:
+            await bot.download_file(file.file_path, tmp)
+            return await asyncio.to_thread(self.put_file, tmp, document.file_unique_id)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
@@ -0,0 +1,166 @@
+"""Пакетная генерация заказов сразу по нескольким поставщикам"""
+import io
+import json
+import logging
+import re
+import zipfile
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from app.excel.excel_processor import ExcelSource
+from app.excel.order_generator import OrderGenerator
+from app.excel.price_index import stored_index_path
+from app.excel.result_channel import SharedResult, SharedResultHandle, publish_result
+
+
+logger = logging.getLogger(__name__)
+
+
+class BatchOrderResult:
+    """output — bytes или memoryview на разделяемую память (если заказ собран в другом процессе)."""
+    __slots__ = ('supplier', 'output', 'quantities', 'error')
+
+    def __init__(self, supplier: str, output: Optional[bytes] = None,
+                 quantities: Optional[Dict[str, float]] = None, error: Optional[str] = None):
+        self.supplier = supplier
+        self.output = output
+        self.quantities = quantities or {}
+        self.error = error
+
+
+def _render(config: Dict, warehouse: Dict[str, float],
+            preorders: Dict[str, float]) -> Tuple[io.BytesIO, Dict[str, float]]:
+    generator = OrderGenerator(config['price_list'])
+    final_quantities = generator.merge_quantities(warehouse, preorders)
+    buffer = io.BytesIO()
+    generator.render_order(config['price_file'], final_quantities, buffer,
+                           price_key=config.get('price_sha256'), index_path=stored_index_path(config))
+    return buffer, final_quantities
+
+
+def _discard_result(future) -> None:
+    """Освобождает сегмент задания, результат которого уже никто не заберёт."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    try:
+        SharedResult(future.result()).release()
+    except Exception as e:
+        logger.warning(f"Не удалось освободить сегмент результата: {e}")
+
+
+def build_order_in_process(config: Dict, warehouse: Dict[str, float],
+                           preorders: Dict[str, float]) -> SharedResultHandle:
+    """Собирает заказ в рабочем процессе; результат возвращается через разделяемую память."""
+    buffer, final_quantities = _render(config, warehouse, preorders)
+    return publish_result(buffer.getbuffer(), final_quantities)
+
+
+class BatchOrderBuilder:
+    """Один файл склада и один файл предзаказов -> заказы для набора поставщиков.
+
+    Входные файлы разбираются по одному разу на каждую различающуюся разметку
+    (склад читается по столбцам прайса поставщика, поэтому разметок может быть несколько),
+    после чего каждый поставщик сопоставляется со своим закэшированным индексом прайса.
+
+    С пулом процессов (pool) заказы собираются в нём, а файлы заказов остаются в
+    разделяемой памяти до close(): результаты нужно использовать до выхода из with.
+    """
+
+    def __init__(self, warehouse_source: ExcelSource, preorders_source: ExcelSource, max_workers: int = 4,
+                 pool: Optional[Executor] = None):
+        self.warehouse_source = warehouse_source
+        self.preorders_source = preorders_source
+        self.max_workers = max_workers
+        self.pool = pool
+        self._warehouse: Dict[tuple, Dict[str, float]] = {}
+        self._preorders: Dict[str, Dict[str, float]] = {}
+        self._shared: List[SharedResult] = []
+
+    @staticmethod
+    def _warehouse_key(config: Dict) -> tuple:
+        price_config = config['price_list']
+        return (price_config.get('article_col', 0), price_config.get('quantity_col', 9))
+
+    @staticmethod
+    def _preorders_key(config: Dict) -> str:
+        return json.dumps(config['preorders'], sort_keys=True)
+
+    def _parse_inputs(self, configs: Dict[str, Dict]) -> None:
+        for config in configs.values():
+            warehouse_key = self._warehouse_key(config)
+            if warehouse_key not in self._warehouse:
+                generator = OrderGenerator(config['price_list'])
+                self._warehouse[warehouse_key] = generator.read_warehouse_order(
+                    self.warehouse_source, config['warehouse_order'])
+            preorders_key = self._preorders_key(config)
+            if preorders_key not in self._preorders:
+                generator = OrderGenerator(config['price_list'])
+                self._preorders[preorders_key] = generator.read_preorders(
+                    self.preorders_source, config['preorders'])
+
+    def _build_one(self, supplier: str, config: Dict) -> BatchOrderResult:
+        try:
+            buffer, final_quantities = _render(config, self._warehouse[self._warehouse_key(config)],
+                                               self._preorders[self._preorders_key(config)])
+            return BatchOrderResult(supplier, buffer.getvalue(), final_quantities)
+        except Exception as e:
+            logger.error(f"Ошибка пакетной генерации для '{supplier}': {e}", exc_info=True)
+            return BatchOrderResult(supplier, error=str(e))
+
+    def _receive(self, supplier: str, future) -> BatchOrderResult:
+        try:
+            shared = SharedResult(future.result())
+        except Exception as e:
+            logger.error(f"Ошибка пакетной генерации для '{supplier}': {e}", exc_info=True)
+            return BatchOrderResult(supplier, error=str(e))
+        self._shared.append(shared)
+        return BatchOrderResult(supplier, shared.output, shared.quantities)
+
+    def run(self, configs: Dict[str, Dict]) -> Dict[str, BatchOrderResult]:
+        self._parse_inputs(configs)
+        if self.pool is not None:
+            futures = {}
+            results: Dict[str, BatchOrderResult] = {}
+            try:
+                for name, config in configs.items():
+                    futures[name] = self.pool.submit(
+                        build_order_in_process, config, self._warehouse[self._warehouse_key(config)],
+                        self._preorders[self._preorders_key(config)])
+                # Ждём все задания, даже если какое-то упало: иначе их сегменты некому освободить
+                for name, future in futures.items():
+                    results[name] = self._receive(name, future)
+                return results
+            finally:
+                # Если submit или ожидание прервались на середине, сегменты уже отправленных
+                # заданий освобождаются, как только задания закончатся
+                for name, future in futures.items():
+                    if name not in results and not future.cancel():
+                        future.add_done_callback(_discard_result)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {name: pool.submit(self._build_one, name, config) for name, config in configs.items()}
+            return {name: future.result() for name, future in futures.items()}
+
+    def close(self) -> None:
+        """Освобождает разделяемую память результатов, собранных в пуле процессов."""
+        for shared in self._shared:
+            shared.release()
+        self._shared.clear()
+
+    def __enter__(self) -> 'BatchOrderBuilder':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _safe_filename(name: str) -> str:
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', name).strip('_') or 'supplier'
+
+
+def zip_orders(results: Dict[str, BatchOrderResult]) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, result in results.items():
+            if result.output is not None:
+                zf.writestr(f"{_safe_filename(name)}.xlsx", result.output)
+    return buffer.getvalue()
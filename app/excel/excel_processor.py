@@ -1,29 +1,68 @@
 """Основной модуль для работы с Excel файлами и генерации заказов"""
+import io
 import os
 import errno
-from typing import Dict, List
+import importlib.util
+import logging
+import posixpath
+import re
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
 import shutil
 import zipfile
 import tempfile
 import xml.etree.ElementTree as ET
 ET.register_namespace('', 'http://schemas.openxmlformats.org/spreadsheetml/2006/main')
 
-try:
-    from openpyxl import load_workbook, Workbook
-    from openpyxl.utils import column_index_from_string
-    OPENPYXL_AVAILABLE = True
-except ImportError:
-    OPENPYXL_AVAILABLE = False
+logger = logging.getLogger(__name__)
+
+# openpyxl импортируется лениво, при первом чтении/записи: импорт занимает заметное время
+# и не должен задерживать старт бота
+OPENPYXL_AVAILABLE = importlib.util.find_spec('openpyxl') is not None
+
+
+# Источник книги: путь к файлу, bytes или file-like объект (BytesIO)
+ExcelSource = Union[str, os.PathLike, bytes, bytearray, BinaryIO]
+
+
+def is_xlsx_source(source: ExcelSource) -> bool:
+    # Данные в памяти принимаются только из .xlsx (расширение проверяет обработчик загрузки)
+    if isinstance(source, (bytes, bytearray)) or hasattr(source, 'read'):
+        return True
+    return os.fspath(source).lower().endswith('.xlsx')
+
+
+def _open_source(source: ExcelSource):
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return source
+
+
+def load_workbook(source: ExcelSource, *args, **kwargs):
+    from openpyxl import load_workbook as _load_workbook
+    return _load_workbook(_open_source(source), *args, **kwargs)
+
+
+def preload_openpyxl() -> None:
+    """Импортирует openpyxl заранее (в фоне): без этого импорт достаётся первой загрузке файла."""
+    if OPENPYXL_AVAILABLE:
+        importlib.import_module('openpyxl')
+
+
+def column_index_from_string(column: str) -> int:
+    from openpyxl.utils import column_index_from_string as _column_index_from_string
+    return _column_index_from_string(column)
 
  
 
 class ExcelProcessor:
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: ExcelSource):
         self.file_path = file_path
         self.workbook = None
         self.worksheet = None
         self.sheet_index = 0
-        self.is_xlsx = file_path.lower().endswith('.xlsx')
+        self.is_xlsx = is_xlsx_source(file_path)
 
     def read_file(self):
         if not (self.is_xlsx and OPENPYXL_AVAILABLE):
@@ -38,6 +77,19 @@ class ExcelProcessor:
         except (IndexError, AttributeError):
             return None
 
+    def iter_rows(self) -> Iterator[tuple]:
+        """Потоковое чтение листа (read_only): строки не накапливаются в памяти."""
+        if not (self.is_xlsx and OPENPYXL_AVAILABLE):
+            raise RuntimeError("Поддерживается только формат .xlsx")
+        wb = load_workbook(self.file_path, read_only=True, data_only=True)
+        try:
+            ws = wb.worksheets[self.sheet_index]
+            # Размеры из заголовка листа бывают неверными — читаем все строки
+            ws.reset_dimensions()
+            yield from ws.iter_rows(values_only=True)
+        finally:
+            wb.close()
+
     def get_all_data(self) -> List[List]:
         data = []
         for row in self.worksheet.iter_rows(values_only=True):
@@ -45,68 +97,51 @@ class ExcelProcessor:
             data.append(row_data)
         return data
 
-    def write_file(self, output_path: str, data: List[List], quantity_col: int,
+    def write_file(self, output_path: Union[str, BinaryIO], data: List[List], quantity_col: int,
                    quantities: Dict[str, float], article_col: int = 0, start_row: int = 2,
                    price_col: int = None, sum_col: int = None, template_file: str = None,
                    total_row: int = None, total_count_enabled: bool = True):
-        source_file = self.file_path
-        is_xlsx_source = source_file.lower().endswith('.xlsx')
-        base_name = os.path.splitext(os.path.basename(output_path))[0]
+        from app.excel.price_index import PriceIndex
+
+        # 1) Считаем список обновлений ячеек (A1 -> значение)
+        index = PriceIndex.from_rows(data, article_col, start_row, price_col)
+        updates = index.compute_updates(quantities, quantity_col, sum_col, price_col, total_row, total_count_enabled)
+        # 2) Записываем их в копию исходной книги
+        self.apply_updates(output_path, updates)
 
-        if not (is_xlsx_source and OPENPYXL_AVAILABLE):
+    def apply_updates(self, output_path: Union[str, BinaryIO], updates: Dict[str, float]) -> None:
+        """Записывает числа в копию книги: сначала прямо в XML листа, openpyxl — запасной путь."""
+        if not is_xlsx_source(self.file_path):
             raise RuntimeError("Поддерживается только формат .xlsx")
-        if is_xlsx_source and OPENPYXL_AVAILABLE:
-            # 1) Точная копия исходного файла
-            shutil.copy2(source_file, output_path)
-            # 2) Считаем список обновлений ячеек (A1 -> значение)
-            updates: Dict[str, float] = {}
-            def idx_to_col(col_index_zero_based: int) -> str:
-                n = col_index_zero_based + 1
-                s = ""
-                while n > 0:
-                    n, r = divmod(n - 1, 26)
-                    s = chr(65 + r) + s
-                return s
-            def rc_to_a1(r0: int, c0: int) -> str:
-                return f"{idx_to_col(c0)}{r0 + 1}"
-            total_quantity = 0.0
-            total_sum = 0.0
-            for row_idx, row_data in enumerate(data):
-                if row_idx < start_row:
-                    continue
-                article = None
-                if row_data and len(row_data) > article_col and row_data[article_col]:
-                    article = _normalize_article(row_data[article_col])
-                # Use normalized keys for lookup
-                norm_quantities: Dict[str, float] = { _normalize_article(k): v for k, v in quantities.items() if _normalize_article(k) }
-                if article and article in norm_quantities:
-                    qty = float(norm_quantities[article])
-                    if qty > 0:
-                        updates[rc_to_a1(row_idx, quantity_col)] = qty
-                        total_quantity += qty
-                        if sum_col is not None and price_col is not None:
-                            price = 0.0
-                            if price_col < len(row_data) and row_data[price_col]:
-                                try:
-                                    price = float(row_data[price_col])
-                                except (ValueError, TypeError):
-                                    price = 0.0
-                            if price > 0:
-                                row_sum = price * qty
-                                updates[rc_to_a1(row_idx, sum_col)] = row_sum
-                                total_sum += row_sum
-            if total_row is not None and total_row >= 0:
-                if total_count_enabled and quantity_col is not None:
-                    updates[rc_to_a1(total_row, quantity_col)] = total_quantity
-                if sum_col is not None:
-                    updates[rc_to_a1(total_row, sum_col)] = total_sum
-            # 3) Обновляем ячейки через openpyxl (как в test/edit_cells.py)
-            wb = load_workbook(output_path)
-            ws = wb.worksheets[self.sheet_index]
-            for a1_ref, number in updates.items():
-                ws[a1_ref].value = number
-            wb.save(output_path)
-            # 4) Готово
+        source = _open_source(self.file_path)
+        if hasattr(source, 'read'):
+            template = source.read()
+        else:
+            with open(source, 'rb') as f:
+                template = f.read()
+        output = patch_xlsx_numbers(template, self.sheet_index, updates)
+        if output is None:
+            logger.info("Книгу нельзя поправить в XML, она пересохраняется через openpyxl")
+            self.apply_updates_with_openpyxl(output_path, updates, template)
+            return
+        if hasattr(output_path, 'write'):
+            output_path.write(output)
+        else:
+            with open(output_path, 'wb') as f:
+                f.write(output)
+
+    def apply_updates_with_openpyxl(self, output_path: Union[str, BinaryIO], updates: Dict[str, float],
+                                    source: ExcelSource = None) -> None:
+        source_file = self.file_path if source is None else source
+        if not (is_xlsx_source(source_file) and OPENPYXL_AVAILABLE):
+            raise RuntimeError("Поддерживается только формат .xlsx")
+        # Исходный файл не копируем: книга открывается из источника, а результат
+        # сохраняется сразу в output_path (путь или буфер в памяти, например BytesIO)
+        wb = load_workbook(source_file)
+        ws = wb.worksheets[self.sheet_index]
+        for a1_ref, number in updates.items():
+            ws[a1_ref].value = number
+        wb.save(output_path)
 
     def close(self) -> None:
         """Совместимость: закрытие ресурсов (ничего не делает)."""
@@ -195,8 +230,8 @@ def _coerce_float(value) -> float | None:
     except ValueError:
         return None
 
-def collect_article_quantities_xlsx(file_path: str, sheet_index: int, article_col_letter: str, quantity_col_letter: str, max_rows: int = 1000, start_row: int = 2) -> Dict[str, float]:
-    if not (file_path.lower().endswith('.xlsx') and OPENPYXL_AVAILABLE):
+def collect_article_quantities_xlsx(file_path: ExcelSource, sheet_index: int, article_col_letter: str, quantity_col_letter: str, max_rows: int = 1000, start_row: int = 2) -> Dict[str, float]:
+    if not (is_xlsx_source(file_path) and OPENPYXL_AVAILABLE):
         raise RuntimeError("Поддерживается только формат .xlsx")
     wb = load_workbook(file_path, data_only=True)
     try:
@@ -227,14 +262,14 @@ def collect_article_quantities_xlsx(file_path: str, sheet_index: int, article_co
         except Exception:
             pass
 
-def get_warehouse_articles(file_path: str, sheet_index: int = 0, max_rows: int = 1000, start_row: int = 2) -> Dict[str, float]:
+def get_warehouse_articles(file_path: ExcelSource, sheet_index: int = 0, max_rows: int = 1000, start_row: int = 2) -> Dict[str, float]:
     return collect_article_quantities_xlsx(file_path, sheet_index, 'A', 'E', max_rows, start_row)
 
-def get_preorder_articles(file_path: str, sheet_index: int = 0, max_rows: int = 1000, start_row: int = 2) -> Dict[str, float]:
+def get_preorder_articles(file_path: ExcelSource, sheet_index: int = 0, max_rows: int = 1000, start_row: int = 2) -> Dict[str, float]:
     return collect_article_quantities_xlsx(file_path, sheet_index, 'C', 'E', max_rows, start_row)
 
-def collect_article_quantities_xlsx_all_sheets(file_path: str, article_col_letter: str, quantity_col_letter: str, max_rows: int = 1000, start_row: int = 2) -> Dict[str, float]:
-    if not (file_path.lower().endswith('.xlsx') and OPENPYXL_AVAILABLE):
+def collect_article_quantities_xlsx_all_sheets(file_path: ExcelSource, article_col_letter: str, quantity_col_letter: str, max_rows: int = 1000, start_row: int = 2) -> Dict[str, float]:
+    if not (is_xlsx_source(file_path) and OPENPYXL_AVAILABLE):
         raise RuntimeError("Поддерживается только формат .xlsx")
     wb = load_workbook(file_path, data_only=True)
     try:
@@ -262,14 +297,14 @@ def collect_article_quantities_xlsx_all_sheets(file_path: str, article_col_lette
         except Exception:
             pass
 
-def get_warehouse_articles_all_sheets(file_path: str, max_rows: int = 1000, start_row: int = 2) -> Dict[str, float]:
+def get_warehouse_articles_all_sheets(file_path: ExcelSource, max_rows: int = 1000, start_row: int = 2) -> Dict[str, float]:
     return collect_article_quantities_xlsx_all_sheets(file_path, 'A', 'E', max_rows, start_row)
 
-def get_preorder_articles_all_sheets(file_path: str, max_rows: int = 1000, start_row: int = 2) -> Dict[str, float]:
+def get_preorder_articles_all_sheets(file_path: ExcelSource, max_rows: int = 1000, start_row: int = 2) -> Dict[str, float]:
     return collect_article_quantities_xlsx_all_sheets(file_path, 'C', 'E', max_rows, start_row)
 
-def _print_articles_with_sheet_all_sheets(file_path: str, article_col_letter: str, quantity_col_letter: str, max_rows: int = 1000, start_row: int = 2) -> None:
-    if not (file_path.lower().endswith('.xlsx') and OPENPYXL_AVAILABLE):
+def _print_articles_with_sheet_all_sheets(file_path: ExcelSource, article_col_letter: str, quantity_col_letter: str, max_rows: int = 1000, start_row: int = 2) -> None:
+    if not (is_xlsx_source(file_path) and OPENPYXL_AVAILABLE):
         raise RuntimeError("Поддерживается только формат .xlsx")
     wb = load_workbook(file_path, data_only=True)
     try:
@@ -294,10 +329,10 @@ def _print_articles_with_sheet_all_sheets(file_path: str, article_col_letter: st
         except Exception:
             pass
 
-def print_warehouse_articles_with_sheets(file_path: str, max_rows: int = 1000, start_row: int = 2) -> None:
+def print_warehouse_articles_with_sheets(file_path: ExcelSource, max_rows: int = 1000, start_row: int = 2) -> None:
     _print_articles_with_sheet_all_sheets(file_path, 'A', 'E', max_rows, start_row)
 
-def print_preorder_articles_with_sheets(file_path: str, max_rows: int = 1000, start_row: int = 2) -> None:
+def print_preorder_articles_with_sheets(file_path: ExcelSource, max_rows: int = 1000, start_row: int = 2) -> None:
     _print_articles_with_sheet_all_sheets(file_path, 'C', 'E', max_rows, start_row)
 
 def _col_row_from_a1(a1: str) -> (str, int):
@@ -362,13 +397,13 @@ def _sheet_xml_name(sheet_index_zero_based: int) -> str:
     return f'xl/worksheets/sheet{sheet_index_zero_based + 1}.xml'
 
 def _rewrite_zip_with_replacement(src_path: str, dst_path: str, member_name: str, new_bytes: bytes) -> None:
-    with zipfile.ZipFile(src_path, 'r') as zin, zipfile.ZipFile(dst_path, 'w', compression=zipfile.ZIP_DEFLATED) as zout:
+    _rewrite_zip(src_path, dst_path, {member_name: new_bytes})
+
+def _rewrite_zip(src, dst, replacements: Dict[str, bytes]) -> None:
+    with zipfile.ZipFile(src, 'r') as zin, zipfile.ZipFile(dst, 'w', compression=zipfile.ZIP_DEFLATED) as zout:
         for item in zin.infolist():
-            data = zin.read(item.filename)
-            if item.filename == member_name:
-                zout.writestr(item, new_bytes)
-            else:
-                zout.writestr(item, data)
+            data = replacements.get(item.filename)
+            zout.writestr(item, data if data is not None else zin.read(item.filename))
 
 def _atomic_replace(path: str, tmp_path: str) -> None:
     try:
@@ -431,4 +466,230 @@ def ExcelProcessor__patch_sheet_xml(self, xlsx_path: str, sheet_index_zero_based
 # Привязываем как метод класса
 ExcelProcessor._patch_sheet_xml = ExcelProcessor__patch_sheet_xml
 
+_SHEET_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_PACKAGE_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+# Лист правится на уровне байтов: ElementTree при сериализации переименовывает префиксы
+# и выкидывает объявления пространств имён, на которые ссылается mc:Ignorable,
+# после чего Excel предлагает «восстановить» книгу
+_ROW_RE = re.compile(rb'<row\b[^>]*?/>|<row\b[^>]*>.*?</row>', re.S)
+_CELL_RE = re.compile(rb'<c\b[^>]*?/>|<c\b[^>]*>.*?</c>', re.S)
+_FORMULA_RE = re.compile(rb'<f[\s>/]')
+_R_ATTR_RE = re.compile(rb'\sr="([^"]*)"')
+_T_ATTR_RE = re.compile(rb'\st="[^"]*"')
+_SPANS_RE = re.compile(rb'\sspans="(\d+):(\d+)"')
+_DIMENSION_RE = re.compile(rb'<dimension\s+ref="([^"]*)"\s*/>')
+_CALC_PR_RE = re.compile(rb'<calcPr\b[^>]*?/?>')
+_FULL_CALC_RE = re.compile(rb'\sfullCalcOnLoad="[^"]*"')
+# Элементы workbook.xml, перед которыми по схеме должен стоять calcPr
+_AFTER_CALC_PR = (b'<oleSize', b'<customWorkbookViews', b'<pivotCaches', b'<smartTagPr', b'<smartTagTypes',
+                  b'<webPublishing', b'<fileRecoveryPr', b'<webPublishObjects', b'<extLst', b'</workbook>')
+
+
+def _column_number(letters: str) -> int:
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n
+
+
+def _column_letters(number: int) -> str:
+    letters = ""
+    while number > 0:
+        number, rest = divmod(number - 1, 26)
+        letters = chr(65 + rest) + letters
+    return letters
+
+
+def _split_a1(a1: str) -> Optional[Tuple[int, int]]:
+    col, row = _col_row_from_a1(a1)
+    if not col or not col.isupper() or row <= 0:
+        return None
+    return _column_number(col), row
+
+
+def _format_number(value: float) -> bytes:
+    number = float(value)
+    if number.is_integer() and abs(number) < 1e15:
+        return str(int(number)).encode('ascii')
+    return repr(number).encode('ascii')
+
+
+def _new_cell(a1: str, value: float) -> bytes:
+    return b'<c r="%s"><v>%s</v></c>' % (a1.encode('ascii'), _format_number(value))
+
+
+def _replace_cell(cell_xml: bytes, value: float) -> Optional[bytes]:
+    """Ячейка с тем же стилем, но с числом вместо прежнего значения (как ws[a1].value = число)."""
+    open_end = cell_xml.index(b'>')
+    open_tag = cell_xml[:open_end].rstrip(b'/')
+    # Формулу пришлось бы убрать и из calcChain.xml — такие книги пишет openpyxl
+    if _FORMULA_RE.search(cell_xml, open_end):
+        return None
+    open_tag = _T_ATTR_RE.sub(b'', open_tag)
+    return open_tag + b'><v>' + _format_number(value) + b'</v></c>'
+
+
+def _widen_spans(open_tag: bytes, columns) -> bytes:
+    m = _SPANS_RE.search(open_tag)
+    if m is None:
+        return open_tag
+    first = min(int(m.group(1)), *columns)
+    last = max(int(m.group(2)), *columns)
+    return open_tag[:m.start()] + b' spans="%d:%d"' % (first, last) + open_tag[m.end():]
+
+
+def _patch_row(row_xml: bytes, cells: Dict[int, Tuple[str, float]]) -> Optional[bytes]:
+    if row_xml.endswith(b'/>'):
+        open_tag, inner = row_xml[:-2], b''
+    else:
+        open_end = row_xml.index(b'>')
+        open_tag, inner = row_xml[:open_end], row_xml[open_end + 1:-len(b'</row>')]
+    pending = sorted(cells.items())
+    parts: List[bytes] = []
+    pos = 0
+    for m in _CELL_RE.finditer(inner):
+        ref = _R_ATTR_RE.search(m.group(), 0, m.group().index(b'>'))
+        parsed = _split_a1(ref.group(1).decode('ascii')) if ref else None
+        if parsed is None:
+            return None
+        col = parsed[0]
+        parts.append(inner[pos:m.start()])
+        pos = m.end()
+        while pending and pending[0][0] < col:
+            parts.append(_new_cell(*pending.pop(0)[1]))
+        if pending and pending[0][0] == col:
+            replaced = _replace_cell(m.group(), pending.pop(0)[1][1])
+            if replaced is None:
+                return None
+            parts.append(replaced)
+        else:
+            parts.append(m.group())
+    parts.append(inner[pos:])
+    parts.extend(_new_cell(a1, value) for _, (a1, value) in pending)
+    open_tag = _widen_spans(open_tag, cells.keys())
+    return open_tag + b'>' + b''.join(parts) + b'</row>'
+
+
+def _widen_dimension(sheet_xml: bytes, bounds: Tuple[int, int, int, int]) -> bytes:
+    m = _DIMENSION_RE.search(sheet_xml)
+    if m is None:
+        return sheet_xml
+    corners = [_split_a1(ref) for ref in m.group(1).decode('ascii').split(':')]
+    if not corners or None in corners:
+        return sheet_xml
+    min_col = min(bounds[0], *(c for c, _ in corners))
+    min_row = min(bounds[1], *(r for _, r in corners))
+    max_col = max(bounds[2], *(c for c, _ in corners))
+    max_row = max(bounds[3], *(r for _, r in corners))
+    ref = f"{_column_letters(min_col)}{min_row}:{_column_letters(max_col)}{max_row}".encode('ascii')
+    return sheet_xml[:m.start(1)] + ref + sheet_xml[m.end(1):]
+
+
+def _patch_sheet_numbers(sheet_xml: bytes, updates: Dict[str, float]) -> Optional[bytes]:
+    """Записывает числа в XML листа; None — если лист размечен так, что безопаснее openpyxl."""
+    by_row: Dict[int, Dict[int, Tuple[str, float]]] = {}
+    for a1, value in updates.items():
+        parsed = _split_a1(a1)
+        if parsed is None:
+            return None
+        col, row = parsed
+        by_row.setdefault(row, {})[col] = (a1, value)
+    start = sheet_xml.find(b'<sheetData')
+    if start < 0:
+        return None
+    open_end = sheet_xml.index(b'>', start)
+    if sheet_xml[open_end - 1:open_end] == b'/':
+        return None
+    close = sheet_xml.find(b'</sheetData>', open_end)
+    if close < 0:
+        return None
+    body = sheet_xml[open_end + 1:close]
+    pending_rows = sorted(by_row)
+    parts: List[bytes] = []
+    pos = 0
+    for m in _ROW_RE.finditer(body):
+        ref = _R_ATTR_RE.search(m.group(), 0, m.group().index(b'>'))
+        if ref is None or not ref.group(1).isdigit():
+            return None
+        row = int(ref.group(1))
+        parts.append(body[pos:m.start()])
+        pos = m.end()
+        while pending_rows and pending_rows[0] < row:
+            parts.append(_patch_row(b'<row r="%d"/>' % pending_rows[0], by_row[pending_rows.pop(0)]))
+        if pending_rows and pending_rows[0] == row:
+            patched = _patch_row(m.group(), by_row[pending_rows.pop(0)])
+            if patched is None:
+                return None
+            parts.append(patched)
+        else:
+            parts.append(m.group())
+    parts.append(body[pos:])
+    parts.extend(_patch_row(b'<row r="%d"/>' % row, by_row[row]) for row in pending_rows)
+    patched = sheet_xml[:open_end + 1] + b''.join(parts) + sheet_xml[close:]
+    if by_row:
+        columns = [col for cells in by_row.values() for col in cells]
+        patched = _widen_dimension(patched, (min(columns), min(by_row), max(columns), max(by_row)))
+    return patched
+
+
+def _force_full_calc(workbook_xml: bytes) -> bytes:
+    """Просит Excel пересчитать формулы при открытии: итоги в шаблоне зависят от записанных чисел."""
+    m = _CALC_PR_RE.search(workbook_xml)
+    if m is not None:
+        tag = _FULL_CALC_RE.sub(b'', m.group())
+        tag = tag.replace(b'<calcPr', b'<calcPr fullCalcOnLoad="1"', 1)
+        return workbook_xml[:m.start()] + tag + workbook_xml[m.end():]
+    positions = [p for p in (workbook_xml.find(tag) for tag in _AFTER_CALC_PR) if p >= 0]
+    if not positions:
+        return workbook_xml
+    at = min(positions)
+    return workbook_xml[:at] + b'<calcPr fullCalcOnLoad="1"/>' + workbook_xml[at:]
+
+
+def _worksheet_member(zf: zipfile.ZipFile, sheet_index_zero_based: int) -> Optional[str]:
+    """Путь к XML листа по порядку листов в workbook.xml (имена sheetN.xml не обязаны совпадать)."""
+    ns = _ns()
+    try:
+        workbook = ET.fromstring(zf.read('xl/workbook.xml'))
+        rels = ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+    except (KeyError, ET.ParseError):
+        return None
+    targets = {rel.get('Id'): rel.get('Target') for rel in rels.findall(f'{{{_PACKAGE_REL_NS}}}Relationship')}
+    worksheets = []
+    for sheet in workbook.findall('a:sheets/a:sheet', ns):
+        target = targets.get(sheet.get(f'{{{_SHEET_REL_NS}}}id'))
+        if target is None:
+            return None
+        member = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+        # openpyxl нумерует только рабочие листы, листы-диаграммы пропускает
+        if '/worksheets/' in member:
+            worksheets.append(member)
+    if sheet_index_zero_based >= len(worksheets):
+        return None
+    return worksheets[sheet_index_zero_based]
+
+
+def patch_xlsx_numbers(xlsx_bytes: bytes, sheet_index_zero_based: int, updates: Dict[str, float]) -> bytes | None:
+    """Записывает числа в ячейки листа прямо в XML, без разбора книги openpyxl.
 
+    Результат совпадает с ws[a1].value = число: стиль ячейки сохраняется, строковое
+    значение заменяется числом, недостающие ячейки и строки добавляются. Возвращает None,
+    если так книгу не поправить (формула в ячейке, нестандартная разметка листа) —
+    тогда изменения нужно применять через openpyxl.
+    """
+    try:
+        with zipfile.ZipFile(io.BytesIO(xlsx_bytes), 'r') as zf:
+            sheet_name = _worksheet_member(zf, sheet_index_zero_based)
+            if sheet_name is None:
+                return None
+            sheet_xml = zf.read(sheet_name)
+            workbook_xml = zf.read('xl/workbook.xml')
+    except (zipfile.BadZipFile, KeyError):
+        return None
+    patched = _patch_sheet_numbers(sheet_xml, updates)
+    if patched is None:
+        return None
+    out = io.BytesIO()
+    _rewrite_zip(io.BytesIO(xlsx_bytes), out, {sheet_name: patched, 'xl/workbook.xml': _force_full_calc(workbook_xml)})
+    return out.getvalue()
@@ -0,0 +1,118 @@
+"""Инкрементальная перегенерация заказа при исправлении одного из входных файлов"""
+import io
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.excel.excel_processor import ExcelProcessor, ExcelSource, patch_xlsx_numbers
+from app.excel.order_generator import OrderGenerator
+from app.excel.price_index import stored_index_path
+
+
+logger = logging.getLogger(__name__)
+
+# Сколько разобранных входов держим в одной сессии (текущие + пара предыдущих версий)
+MAX_PARSED_INPUTS = 6
+
+
+class IncrementalOrderSession:
+    """Состояние генерации заказа одного пользователя.
+
+    Разобранные карты артикул -> количество хранятся по хэшу содержимого, поэтому при
+    исправлении одного файла заново читается только он. Новый результат получается
+    из предыдущего: меняются только ячейки, значения которых изменились.
+    """
+
+    def __init__(self, supplier: str, config: Dict, price_file: str, price_sha256: Optional[str] = None):
+        self.supplier = supplier
+        self.config = config
+        self.price_file = price_file
+        self.price_sha256 = price_sha256
+        self.generator = OrderGenerator(config['price_list'])
+        self.parsed: "OrderedDict[Tuple[str, str], Tuple[Dict[str, float], Dict]]" = OrderedDict()
+        self.warehouse_sha256: Optional[str] = None
+        self.preorders_sha256: Optional[str] = None
+        self.last_updates: Optional[Dict[str, float]] = None
+        self.last_output: Optional[bytes] = None
+        self.last_quantities: Dict[str, float] = {}
+        self.last_mode: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def matches(self, supplier: str, config: Dict, price_sha256: Optional[str]) -> bool:
+        same_layout = all(json.dumps(self.config.get(k), sort_keys=True) == json.dumps(config.get(k), sort_keys=True)
+                          for k in ('price_list', 'warehouse_order', 'preorders'))
+        return self.supplier == supplier and self.price_sha256 == price_sha256 and same_layout
+
+    def _parse(self, kind: str, source: ExcelSource, sha256: str) -> Dict[str, float]:
+        key = (kind, sha256)
+        with self._lock:
+            entry = self.parsed.get(key)
+            if entry is not None:
+                self.parsed.move_to_end(key)
+                self.generator.last_diagnostics[kind] = entry[1]
+                return entry[0]
+        if kind == 'warehouse':
+            quantities = self.generator.read_warehouse_order(source, self.config['warehouse_order'])
+        else:
+            quantities = self.generator.read_preorders(source, self.config['preorders'])
+        with self._lock:
+            self.parsed[key] = (quantities, dict(self.generator.last_diagnostics.get(kind) or {}))
+            while len(self.parsed) > MAX_PARSED_INPUTS:
+                self.parsed.popitem(last=False)
+        return quantities
+
+    def prefetch(self, kind: str, source: ExcelSource, sha256: str) -> None:
+        """Разбирает вход заранее (в фоне), чтобы generate взял готовый результат."""
+        self._parse(kind, source, sha256)
+
+    def prefetch_price_index(self) -> None:
+        self.generator.read_price_index(self.price_file, self.price_sha256, stored_index_path(self.config))
+
+    def has_parsed(self, kind: str, sha256: Optional[str]) -> bool:
+        with self._lock:
+            return sha256 is not None and (kind, sha256) in self.parsed
+
+    def generate(self, warehouse_source: Optional[ExcelSource], warehouse_sha256: str,
+                 preorders_source: Optional[ExcelSource], preorders_sha256: str) -> Tuple[bytes, Dict[str, float]]:
+        """Собирает заказ; источник можно не передавать, если его хэш уже разобран в сессии."""
+        warehouse = self._parse('warehouse', warehouse_source, warehouse_sha256)
+        preorders = self._parse('preorders', preorders_source, preorders_sha256)
+        final_quantities = self.generator.merge_quantities(warehouse, preorders)
+        price_config = self.config['price_list']
+        index = self.generator.read_price_index(self.price_file, self.price_sha256, stored_index_path(self.config))
+        updates = index.compute_updates(final_quantities, price_config.get('quantity_col', 9),
+                                        price_config.get('sum_col'), price_config.get('price_col'))
+        output = self._patch_previous(updates)
+        if output is None:
+            buffer = io.BytesIO()
+            ExcelProcessor(self.price_file).apply_updates(buffer, updates)
+            output = buffer.getvalue()
+            self.last_mode = 'full'
+        self.warehouse_sha256 = warehouse_sha256
+        self.preorders_sha256 = preorders_sha256
+        self.last_updates = updates
+        self.last_output = output
+        self.last_quantities = final_quantities
+        logger.info(f"Заказ для '{self.supplier}' собран (режим: {self.last_mode})")
+        return output, final_quantities
+
+    def _patch_previous(self, updates: Dict[str, float]) -> Optional[bytes]:
+        if self.last_output is None or self.last_updates is None:
+            return None
+        # Ячейку, из которой заказ ушёл, нужно вернуть к значению шаблона — это делает только полный путь
+        if any(a1 not in updates for a1 in self.last_updates):
+            return None
+        changed = {a1: v for a1, v in updates.items() if self.last_updates.get(a1) != v}
+        if not changed:
+            self.last_mode = 'unchanged'
+            return self.last_output
+        patched = patch_xlsx_numbers(self.last_output, 0, changed)
+        if patched is not None:
+            self.last_mode = 'xml-patch'
+            return patched
+        buffer = io.BytesIO()
+        ExcelProcessor(self.last_output).apply_updates_with_openpyxl(buffer, changed)
+        self.last_mode = 'patch'
+        return buffer.getvalue()
@@ -0,0 +1,71 @@
+"""Кэш готовых заказов по хэшам входных файлов и конфигурации поставщика"""
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, str, str, str]
+
+# Части конфигурации поставщика, влияющие на результат генерации
+ORDER_CONFIG_KEYS = ('price_list', 'warehouse_order', 'preorders')
+
+
+def config_hash(config: Dict) -> str:
+    payload = json.dumps(config, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CachedOrder:
+    __slots__ = ('output', 'quantities', 'diagnostics')
+
+    def __init__(self, output: bytes, quantities: Dict[str, float], diagnostics: Dict[str, object]):
+        self.output = output
+        self.quantities = quantities
+        self.diagnostics = diagnostics
+
+
+class OrderResultCache:
+    """LRU-кэш результатов generate_order, ограниченный суммарным размером xlsx.
+
+    Ключ — (хэш прайса, хэш склада, хэш предзаказов, хэш конфигурации поставщика),
+    поэтому повторная генерация тех же входов возвращает готовые байты без пересчёта.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_entries: int = 256):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.total_bytes = 0
+        self._entries: "OrderedDict[CacheKey, CachedOrder]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(price_hash: str, warehouse_hash: str, preorders_hash: str, config: Dict) -> CacheKey:
+        relevant = {k: config.get(k) for k in ORDER_CONFIG_KEYS}
+        return (price_hash, warehouse_hash, preorders_hash, config_hash(relevant))
+
+    def get(self, key: CacheKey) -> Optional[CachedOrder]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: CacheKey, output: bytes, quantities: Dict[str, float],
+            diagnostics: Optional[Dict[str, object]] = None) -> None:
+        if len(output) > self.max_bytes:
+            return
+        entry = CachedOrder(output, dict(quantities), dict(diagnostics or {}))
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= len(old.output)
+            self._entries[key] = entry
+            self.total_bytes += len(output)
+            while self._entries and (self.total_bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted.output)
@@ -1,14 +1,12 @@
 
 """Модуль для сопоставления товаров и генерации заказов"""
-from typing import Dict, Optional
+from typing import BinaryIO, Dict, Optional, Union
 import logging
+import sys
 from app.excel.excel_processor import ExcelProcessor, normalize_article as _norm_article
 from app.excel.excel_processor import _coerce_float as _coerce_qty
-try:
-    from openpyxl import load_workbook
-    OPENPYXL_AVAILABLE = True
-except ImportError:
-    OPENPYXL_AVAILABLE = False
+from app.excel.excel_processor import load_workbook, is_xlsx_source, ExcelSource, OPENPYXL_AVAILABLE
+from app.excel.price_index import PriceIndex, PriceItem, price_index_cache, _parse_price
 
 
 class OrderGenerator:
@@ -17,24 +15,23 @@ class OrderGenerator:
         self.logger = logging.getLogger(__name__)
         self.last_diagnostics: Dict[str, object] = {}
 
-    def read_price_list(self, file_path: str) -> Dict[str, Dict]:
-        processor = ExcelProcessor(file_path)
-        processor.read_file()
-        data = processor.get_all_data()
-        price_items = {}
+    def read_price_list(self, file_path: ExcelSource) -> Dict[str, PriceItem]:
+        """Артикул -> PriceItem (строка и цена); лист читается потоково, строки целиком не хранятся."""
         start_row = self.price_config.get('start_row', 2)
         article_col = self.price_config.get('article_col', 0)
-        for row_idx in range(start_row, len(data)):
-            row = data[row_idx]
+        price_col = self.price_config.get('price_col')
+        price_items: Dict[str, PriceItem] = {}
+        for row_idx, row in enumerate(ExcelProcessor(file_path).iter_rows()):
+            if row_idx < start_row:
+                continue
             if article_col < len(row) and row[article_col]:
                 article = str(row[article_col]).strip()
                 if article:
-                    price_items[article] = {'row': row_idx, 'data': row}
-        processor.close()
+                    price_items[sys.intern(article)] = PriceItem(row_idx, _parse_price(row, price_col))
         return price_items
 
-    def read_warehouse_order(self, file_path: str, config: Dict) -> Dict[str, float]:
-        if not (file_path.lower().endswith('.xlsx') and OPENPYXL_AVAILABLE):
+    def read_warehouse_order(self, file_path: ExcelSource, config: Dict) -> Dict[str, float]:
+        if not (is_xlsx_source(file_path) and OPENPYXL_AVAILABLE):
             # Фолбек на старый путь через ExcelProcessor (первый лист)
             processor = ExcelProcessor(file_path)
             processor.read_file()
@@ -103,8 +100,8 @@ class OrderGenerator:
             except Exception:
                 pass
 
-    def read_preorders(self, file_path: str, config: Dict) -> Dict[str, float]:
-        if not (file_path.lower().endswith('.xlsx') and OPENPYXL_AVAILABLE):
+    def read_preorders(self, file_path: ExcelSource, config: Dict) -> Dict[str, float]:
+        if not (is_xlsx_source(file_path) and OPENPYXL_AVAILABLE):
             # Фолбек: только первый лист
             processor = ExcelProcessor(file_path)
             processor.read_file()
@@ -182,8 +179,8 @@ class OrderGenerator:
             except Exception:
                 pass
 
-    def preview_warehouse(self, file_path: str, article_col: int, quantity_col: int, rows: int = 10) -> str:
-        if not (file_path.lower().endswith('.xlsx') and OPENPYXL_AVAILABLE):
+    def preview_warehouse(self, file_path: ExcelSource, article_col: int, quantity_col: int, rows: int = 10) -> str:
+        if not (is_xlsx_source(file_path) and OPENPYXL_AVAILABLE):
             return "(preview unavailable: not .xlsx)"
         wb = load_workbook(file_path, data_only=True)
         try:
@@ -209,12 +206,13 @@ class OrderGenerator:
             except Exception:
                 pass
 
-    def generate_order(self, price_file: str, warehouse_file: str, preorders_file: str,
-                      output_file: str, warehouse_config: Dict, preorders_config: Dict,
-                      price_template: Optional[str] = None):
-        price_items = self.read_price_list(price_file)
-        warehouse_quantities = self.read_warehouse_order(warehouse_file, warehouse_config)
-        preorder_quantities = self.read_preorders(preorders_file, preorders_config)
+    def read_price_index(self, price_file: ExcelSource, content_key: Optional[str] = None,
+                         index_path: Optional[str] = None) -> PriceIndex:
+        """Индекс прайс-листа из кэша, из сохранённого файла index_path или разбором прайса."""
+        return price_index_cache.get_or_build(price_file, self.price_config, content_key, index_path)
+
+    @staticmethod
+    def merge_quantities(warehouse_quantities: Dict[str, float], preorder_quantities: Dict[str, float]) -> Dict[str, float]:
         final_quantities: Dict[str, float] = {}
         all_articles = set(list(warehouse_quantities.keys()) + list(preorder_quantities.keys()))
         for article in all_articles:
@@ -228,21 +226,32 @@ class OrderGenerator:
                 final_qty = warehouse_qty + preorder_qty
             if final_qty > 0:
                 final_quantities[article] = final_qty
-        processor = ExcelProcessor(price_file)
-        processor.read_file()
-        data = processor.get_all_data()
-        quantity_col = self.price_config.get('quantity_col', 9)
-        article_col = self.price_config.get('article_col', 0)
-        price_col = self.price_config.get('price_col')
-        sum_col = self.price_config.get('sum_col')
-        start_row = self.price_config.get('start_row', 2)
-        total_row = None
-        total_count_enabled = False
-        # Для сохранения форматирования используем исходный шаблон, если он есть
-        template = price_template or price_file
-        processor.write_file(output_file, data, quantity_col, final_quantities,
-                             article_col, start_row, price_col, sum_col, template, total_row, total_count_enabled)
-        processor.close()
         return final_quantities
 
+    def render_order(self, price_file: ExcelSource, final_quantities: Dict[str, float],
+                     output_file: Union[str, BinaryIO], price_index: Optional[PriceIndex] = None,
+                     price_key: Optional[str] = None, index_path: Optional[str] = None) -> Dict[str, float]:
+        """Проставляет количества в прайс и сохраняет результат; возвращает записанные ячейки."""
+        index = price_index or self.read_price_index(price_file, price_key, index_path)
+        updates = index.compute_updates(
+            final_quantities,
+            self.price_config.get('quantity_col', 9),
+            self.price_config.get('sum_col'),
+            self.price_config.get('price_col'),
+        )
+        processor = ExcelProcessor(price_file)
+        processor.apply_updates(output_file, updates)
+        processor.close()
+        return updates
 
+    def generate_order(self, price_file: str, warehouse_file: ExcelSource, preorders_file: ExcelSource,
+                      output_file: Union[str, BinaryIO], warehouse_config: Dict, preorders_config: Dict,
+                      price_template: Optional[str] = None, price_sha256: Optional[str] = None,
+                      price_index_path: Optional[str] = None):
+        warehouse_quantities = self.read_warehouse_order(warehouse_file, warehouse_config)
+        preorder_quantities = self.read_preorders(preorders_file, preorders_config)
+        final_quantities = self.merge_quantities(warehouse_quantities, preorder_quantities)
+        # Книга открывается из прайс-листа поставщика (price_template совпадает с ним)
+        self.render_order(price_file, final_quantities, output_file, price_key=price_sha256,
+                          index_path=price_index_path)
+        return final_quantities
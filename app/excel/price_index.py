@@ -0,0 +1,335 @@
+"""Индекс прайс-листа: строки с артикулами и ценами для сопоставления и записи заказа"""
+import hashlib
+import json
+import logging
+import os
+import struct
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from app.excel.excel_processor import ExcelProcessor, ExcelSource, _normalize_article
+
+
+logger = logging.getLogger(__name__)
+
+
+# Версия формата файла индекса; при изменении формата старые индексы просто перестраиваются
+PRICE_INDEX_VERSION = 1
+_MAGIC = b'PIDX'
+_HEADER = struct.Struct('<4I')
+
+
+def idx_to_col(col_index_zero_based: int) -> str:
+    n = col_index_zero_based + 1
+    s = ""
+    while n > 0:
+        n, r = divmod(n - 1, 26)
+        s = chr(65 + r) + s
+    return s
+
+
+def rc_to_a1(r0: int, c0: int) -> str:
+    return f"{idx_to_col(c0)}{r0 + 1}"
+
+
+def _parse_price(row_data, price_col: Optional[int]) -> float:
+    if price_col is None or price_col >= len(row_data) or not row_data[price_col]:
+        return 0.0
+    try:
+        return float(row_data[price_col])
+    except (ValueError, TypeError):
+        return 0.0
+
+
+class PriceItem:
+    """Позиция прайса: индекс строки (с 0) и цена. Строка целиком не хранится."""
+    __slots__ = ('row', 'price')
+
+    def __init__(self, row: int, price: float = 0.0):
+        self.row = row
+        self.price = price
+
+    def __repr__(self) -> str:
+        return f"PriceItem(row={self.row}, price={self.price})"
+
+
+class PriceIndex:
+    """Разобранный прайс-лист в столбцовом виде: индексы строк и цены — в array,
+    нормализованные артикулы — интернированные строки.
+
+    Один артикул может встречаться в нескольких строках — заказ проставляется в каждую.
+    """
+    __slots__ = ('rows', 'articles', 'prices', '_positions', '_cells')
+
+    def __init__(self, rows: Optional[array] = None, articles: Optional[List[str]] = None,
+                 prices: Optional[array] = None):
+        self.rows = rows if rows is not None else array('i')
+        self.articles = articles if articles is not None else []
+        self.prices = prices if prices is not None else array('d')
+        self._positions: Optional[Dict[str, Union[int, Tuple[int, ...]]]] = None
+        self._cells: Dict[int, List[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[Tuple[int, str, float]]:
+        return zip(self.rows, self.articles, self.prices)
+
+    def append(self, row_idx: int, article: str, price: float) -> None:
+        self.rows.append(row_idx)
+        self.articles.append(sys.intern(article))
+        self.prices.append(price)
+        self._positions = None
+        self._cells = {}
+
+    def positions(self) -> Dict[str, Union[int, Tuple[int, ...]]]:
+        """Артикул -> позиция в индексе (кортеж позиций, если артикул повторяется в прайсе)."""
+        if self._positions is None:
+            positions: Dict[str, Union[int, Tuple[int, ...]]] = {}
+            for pos, article in enumerate(self.articles):
+                prev = positions.get(article)
+                if prev is None:
+                    positions[article] = pos
+                elif isinstance(prev, int):
+                    positions[article] = (prev, pos)
+                else:
+                    positions[article] = prev + (pos,)
+            self._positions = positions
+        return self._positions
+
+    def cell_refs(self, col: int) -> List[str]:
+        """Адреса A1 ячеек столбца col для каждой позиции индекса (считаются один раз на столбец)."""
+        refs = self._cells.get(col)
+        if refs is None:
+            letter = idx_to_col(col)
+            refs = self._cells[col] = [f"{letter}{row + 1}" for row in self.rows]
+        return refs
+
+    def to_bytes(self, layout: Dict) -> bytes:
+        # Нормализованные артикулы не содержат пробельных символов, поэтому '\n' — безопасный разделитель
+        header = json.dumps({'version': PRICE_INDEX_VERSION, 'layout': layout, 'count': len(self)}).encode('utf-8')
+        parts = (header, self.rows.tobytes(), self.prices.tobytes(), '\n'.join(self.articles).encode('utf-8'))
+        return _MAGIC + _HEADER.pack(*(len(part) for part in parts)) + b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, payload: bytes) -> Tuple["PriceIndex", Dict]:
+        """Разбирает сохранённый индекс; возвращает (индекс, заголовок)."""
+        if payload[:len(_MAGIC)] != _MAGIC:
+            raise ValueError("не файл индекса прайс-листа")
+        offset = len(_MAGIC) + _HEADER.size
+        if len(payload) < offset:
+            raise ValueError("повреждённый файл индекса")
+        sizes = _HEADER.unpack(payload[len(_MAGIC):offset])
+        # Обрезанный файл мог бы сохранить число артикулов, потеряв конец последнего
+        if len(payload) != offset + sum(sizes):
+            raise ValueError("повреждённый файл индекса")
+        chunks = []
+        for size in sizes:
+            chunks.append(payload[offset:offset + size])
+            offset += size
+        header = json.loads(chunks[0].decode('utf-8'))
+        if header.get('version') != PRICE_INDEX_VERSION:
+            raise ValueError(f"неподдерживаемая версия индекса: {header.get('version')}")
+        rows = array('i')
+        rows.frombytes(chunks[1])
+        prices = array('d')
+        prices.frombytes(chunks[2])
+        articles = [sys.intern(a) for a in chunks[3].decode('utf-8').split('\n')] if header['count'] else []
+        if not (len(rows) == len(prices) == len(articles) == header['count']):
+            raise ValueError("повреждённый файл индекса")
+        return cls(rows, articles, prices), header
+
+    @classmethod
+    def from_rows(cls, data: Iterable[Sequence], article_col: int = 0, start_row: int = 2,
+                  price_col: Optional[int] = None) -> "PriceIndex":
+        """Строит индекс по строкам листа; data может быть потоком (ExcelProcessor.iter_rows)."""
+        index = cls()
+        for row_idx, row_data in enumerate(data):
+            if row_idx < start_row:
+                continue
+            if not (row_data and len(row_data) > article_col and row_data[article_col]):
+                continue
+            article = _normalize_article(row_data[article_col])
+            if not article:
+                continue
+            index.append(row_idx, article, _parse_price(row_data, price_col))
+        return index
+
+    @classmethod
+    def from_source(cls, source: ExcelSource, price_config: Dict) -> "PriceIndex":
+        return cls.from_rows(ExcelProcessor(source).iter_rows(),
+                             price_config.get('article_col', 0),
+                             price_config.get('start_row', 2),
+                             price_config.get('price_col'))
+
+    def compute_updates(self, quantities: Dict[str, float], quantity_col: int, sum_col: Optional[int] = None,
+                        price_col: Optional[int] = None, total_row: Optional[int] = None,
+                        total_count_enabled: bool = True) -> Dict[str, float]:
+        """Ячейки (A1 -> значение), которые нужно записать в прайс для заказа quantities.
+
+        Перебираются только артикулы заказа (поиск по positions()), а не все строки прайса.
+        """
+        norm_quantities: Dict[str, float] = {}
+        for k, v in quantities.items():
+            article = _normalize_article(k)
+            if article:
+                norm_quantities[article] = v
+        positions = self.positions()
+        hits: List[Tuple[int, float]] = []
+        for article, qty in norm_quantities.items():
+            pos = positions.get(article)
+            if pos is None:
+                continue
+            if isinstance(pos, int):
+                hits.append((pos, qty))
+            else:
+                hits.extend((p, qty) for p in pos)
+        # Порядок строк прайса — как при полном проходе, чтобы итоги суммировались одинаково
+        hits.sort()
+        qty_cells = self.cell_refs(quantity_col)
+        sum_cells = self.cell_refs(sum_col) if sum_col is not None else None
+        updates: Dict[str, float] = {}
+        total_quantity = 0.0
+        total_sum = 0.0
+        for pos, raw_qty in hits:
+            qty = float(raw_qty)
+            if qty <= 0:
+                continue
+            updates[qty_cells[pos]] = qty
+            total_quantity += qty
+            price = self.prices[pos]
+            if sum_cells is not None and price_col is not None and price > 0:
+                row_sum = price * qty
+                updates[sum_cells[pos]] = row_sum
+                total_sum += row_sum
+        if total_row is not None and total_row >= 0:
+            if total_count_enabled and quantity_col is not None:
+                updates[rc_to_a1(total_row, quantity_col)] = total_quantity
+            if sum_col is not None:
+                updates[rc_to_a1(total_row, sum_col)] = total_sum
+        return updates
+
+
+def _source_key(source: ExcelSource, content_key: Optional[str]):
+    if content_key:
+        return content_key
+    if isinstance(source, (str, os.PathLike)):
+        try:
+            st = os.stat(source)
+        except OSError:
+            return None
+        return (os.path.abspath(source), st.st_mtime_ns, st.st_size)
+    return None
+
+
+def index_layout(price_config: Dict) -> Dict:
+    """Параметры разметки, от которых зависит содержимое индекса."""
+    return {
+        'start_row': price_config.get('start_row', 2),
+        'article_col': price_config.get('article_col', 0),
+        'price_col': price_config.get('price_col'),
+    }
+
+
+def index_path_for(price_file: str, price_config: Dict) -> str:
+    """Файл индекса лежит рядом с шаблоном прайса; разметка входит в имя."""
+    layout = json.dumps(index_layout(price_config), sort_keys=True).encode('utf-8')
+    base, _ = os.path.splitext(os.fspath(price_file))
+    return f"{base}.{hashlib.sha256(layout).hexdigest()[:12]}.pidx"
+
+
+def save_index_bytes(payload: bytes, path: str) -> None:
+    tmp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+def save_index(index: PriceIndex, path: str, price_config: Dict) -> None:
+    save_index_bytes(index.to_bytes(index_layout(price_config)), path)
+
+
+def load_index(path: str, price_config: Dict) -> Optional[PriceIndex]:
+    """Читает сохранённый индекс; None, если файла нет, он повреждён или построен для другой разметки."""
+    try:
+        with open(path, 'rb') as f:
+            index, header = PriceIndex.from_bytes(f.read())
+    except (OSError, ValueError, KeyError, struct.error) as e:
+        logger.warning(f"Индекс прайса {path} не загружен: {e}")
+        return None
+    if header.get('layout') != index_layout(price_config):
+        return None
+    return index
+
+
+def stored_index_path(config: Dict) -> Optional[str]:
+    """Путь к сохранённому индексу из конфигурации поставщика, если он актуален."""
+    meta = config.get('price_index')
+    if not meta or meta.get('version') != PRICE_INDEX_VERSION:
+        return None
+    if meta.get('sha256') != config.get('price_sha256') or meta.get('layout') != index_layout(config['price_list']):
+        return None
+    path = meta.get('path')
+    return path if path and os.path.exists(path) else None
+
+
+class PriceIndexCache:
+    """LRU-кэш индексов прайс-листов по содержимому файла и разметке."""
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, PriceIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _layout(price_config: Dict) -> tuple:
+        return (price_config.get('start_row', 2), price_config.get('article_col', 0), price_config.get('price_col'))
+
+    def get_or_build(self, source: ExcelSource, price_config: Dict, content_key: Optional[str] = None,
+                     index_path: Optional[str] = None) -> PriceIndex:
+        """Индекс из памяти, затем из сохранённого файла index_path, иначе разбор прайса."""
+        source_key = _source_key(source, content_key)
+        if source_key is None:
+            return PriceIndex.from_source(source, price_config)
+        key = (source_key, self._layout(price_config))
+        with self._lock:
+            index = self._entries.get(key)
+            if index is not None:
+                self._entries.move_to_end(key)
+                return index
+        index = load_index(index_path, price_config) if index_path else None
+        if index is None:
+            index = PriceIndex.from_source(source, price_config)
+        self.put(key, index)
+        return index
+
+    def put(self, key: tuple, index: PriceIndex) -> None:
+        with self._lock:
+            self._entries[key] = index
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+price_index_cache = PriceIndexCache()
+
+
+def build_stored_index(config: Dict) -> Dict:
+    """Строит индекс прайса поставщика, сохраняет его рядом с шаблоном и возвращает
+    запись для config['price_index']. Карта артикулов прогревается сразу.
+    """
+    price_config = config['price_list']
+    index = price_index_cache.get_or_build(config['price_file'], price_config, config.get('price_sha256'))
+    index.positions()
+    path = index_path_for(config.get('price_template') or config['price_file'], price_config)
+    save_index(index, path, price_config)
+    return {
+        'version': PRICE_INDEX_VERSION,
+        'path': path,
+        'sha256': config.get('price_sha256'),
+        'layout': index_layout(price_config),
+        'rows': len(index),
+    }
@@ -0,0 +1,128 @@
+"""Передача результатов генерации из рабочих процессов через разделяемую память.
+
+Рабочий процесс кладёт готовый файл заказа и карту количеств в сегмент
+multiprocessing.shared_memory и возвращает только его имя. Процесс бота открывает
+сегмент и читает файл прямо из него, без распаковки pickle и лишних копий.
+
+Формат сегмента: заголовок '<4sIII' (магия, число позиций, длина артикулов, длина файла),
+затем количества array('d'), концы артикулов array('I') (смещения в блоке артикулов),
+артикулы в UTF-8 подряд и байты файла. Артикулы хранятся по длинам, а не через
+разделитель: в артикуле может оказаться любой символ, включая перевод строки.
+
+Владелец сегмента — получатель: SharedResult.release() (или выход из with) закрывает и
+удаляет его. Сегменты, до которых получатель не дошёл, удаляет resource_tracker
+multiprocessing при завершении процесса бота.
+"""
+import logging
+import struct
+from array import array
+from multiprocessing import shared_memory
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+RESULT_MAGIC = b'ORES'
+_HEADER = struct.Struct('<4sIII')
+
+
+class SharedResultHandle:
+    """Имя и размер сегмента: это всё, что пересылается между процессами."""
+    __slots__ = ('name', 'size')
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+
+
+def publish_result(output, quantities: Dict[str, float]) -> SharedResultHandle:
+    """Записывает результат в новый сегмент (вызывается в рабочем процессе).
+
+    output — bytes или буфер (например BytesIO.getbuffer()), копируется один раз: в сегмент.
+    """
+    encoded = [article.encode('utf-8') for article in quantities]
+    ends = array('I')
+    end = 0
+    for article in encoded:
+        end += len(article)
+        ends.append(end)
+    articles = b''.join(encoded)
+    values = array('d', quantities.values())
+    output = memoryview(output).cast('B')
+    values_size = len(values) * values.itemsize
+    ends_size = len(ends) * ends.itemsize
+    size = _HEADER.size + values_size + ends_size + len(articles) + output.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        buf = shm.buf
+        _HEADER.pack_into(buf, 0, RESULT_MAGIC, len(values), len(articles), output.nbytes)
+        offset = _HEADER.size
+        buf[offset:offset + values_size] = memoryview(values).cast('B')
+        offset += values_size
+        buf[offset:offset + ends_size] = memoryview(ends).cast('B')
+        offset += ends_size
+        buf[offset:offset + len(articles)] = articles
+        offset += len(articles)
+        buf[offset:offset + output.nbytes] = output
+        del buf
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    shm.close()
+    return SharedResultHandle(shm.name, size)
+
+
+class SharedResult:
+    """Результат из сегмента на стороне получателя.
+
+    output — memoryview прямо на байты файла в разделяемой памяти, действителен до release().
+    quantities — обычный словарь, восстановленный из массива.
+    """
+
+    def __init__(self, handle: SharedResultHandle):
+        self._shm: Optional[shared_memory.SharedMemory] = shared_memory.SharedMemory(name=handle.name)
+        try:
+            magic, items, articles_size, output_size = _HEADER.unpack_from(self._shm.buf, 0)
+            if magic != RESULT_MAGIC:
+                raise ValueError(f"сегмент {handle.name} не содержит результата генерации")
+            offset = _HEADER.size
+            values_size = items * array('d').itemsize
+            values = array('d')
+            values.frombytes(self._shm.buf[offset:offset + values_size])
+            offset += values_size
+            ends = array('I')
+            ends.frombytes(self._shm.buf[offset:offset + items * ends.itemsize])
+            offset += items * ends.itemsize
+            articles = bytes(self._shm.buf[offset:offset + articles_size])
+            offset += articles_size
+            self.quantities: Dict[str, float] = {}
+            start = 0
+            for end, value in zip(ends, values):
+                self.quantities[articles[start:end].decode('utf-8')] = value
+                start = end
+            self.output: Optional[memoryview] = self._shm.buf[offset:offset + output_size]
+        except BaseException:
+            self._shm.close()
+            self._shm.unlink()
+            raise
+
+    def release(self) -> None:
+        """Закрывает и удаляет сегмент; повторный вызов ничего не делает."""
+        if self._shm is None:
+            return
+        shm, self._shm = self._shm, None
+        if self.output is not None:
+            self.output.release()
+            self.output = None
+        try:
+            shm.close()
+        except BufferError:
+            # Кто-то ещё держит срез результата: память освободится, когда он его отпустит
+            logger.warning(f"Сегмент результата {shm.name} удалён при открытых ссылках")
+        shm.unlink()
+
+    def __enter__(self) -> 'SharedResult':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
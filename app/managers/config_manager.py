@@ -1,4 +1,5 @@
 """Модуль для управления конфигурациями поставщиков (Postgres)"""
+from datetime import datetime
 from typing import Dict, Optional, List
 
 from app.core.db import Database
@@ -21,6 +22,16 @@ class SupplierConfigManager:
     
     def delete_supplier(self, supplier_name: str) -> bool:
         return self.db.suppliers_delete(supplier_name)
+
+    def get_notification_times(self) -> Dict[str, datetime]:
+        """Время последнего напоминания по каждому поставщику (общее для всех реплик)."""
+        return self.db.notifications_get_sent()
+
+    def set_notification_time(self, supplier_name: str, sent_at: datetime):
+        self.db.notifications_set_sent(supplier_name, sent_at)
+
+    def reset_notification_time(self, supplier_name: str):
+        self.db.notifications_reset(supplier_name)
     
     def get_default_config(self) -> Dict:
         return {
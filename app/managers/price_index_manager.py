@@ -0,0 +1,126 @@
+"""Модуль для общего хранения индексов прайс-листов между репликами (Postgres)"""
+import logging
+import os
+from typing import Dict, Optional
+
+from app.core.blob_store import BlobStore
+from app.core.db import Database
+from app.excel.excel_processor import patch_xlsx_numbers
+from app.excel.price_index import (PRICE_INDEX_VERSION, PriceIndex, build_stored_index, index_layout,
+                                   index_path_for, price_index_cache, save_index_bytes, stored_index_path)
+
+
+logger = logging.getLogger(__name__)
+
+
+class PriceIndexManager:
+    """Индексы и шаблоны прайс-листов поставщиков в таблице supplier_price_index.
+
+    Реплика, построившая индекс, публикует его вместе с байтами шаблона. Остальные
+    реплики лениво скачивают их при первом обращении к поставщику и дальше работают
+    с локальной копией в blob-хранилище (шаблон по sha256, индекс рядом с ним).
+    """
+
+    def __init__(self, blob_store: BlobStore):
+        self.db = Database.get_instance()
+        self.blob_store = blob_store
+
+    def publish(self, supplier_name: str, config: Dict) -> bool:
+        """Выгружает актуальный локальный индекс и шаблон поставщика в Postgres."""
+        index_path = stored_index_path(config)
+        if not index_path or not config.get('price_sha256'):
+            return False
+        template_path = config.get('price_template') or config['price_file']
+        with open(index_path, 'rb') as f:
+            index_data = f.read()
+        with open(template_path, 'rb') as f:
+            template = f.read()
+        meta = config['price_index']
+        self.db.price_index_put(supplier_name, config['price_sha256'], meta['version'], meta['layout'],
+                                index_data, template)
+        logger.info(f"Индекс прайса '{supplier_name}' опубликован ({len(index_data) + len(template)} байт)")
+        return True
+
+    def resolve(self, supplier_name: str, config: Optional[Dict]) -> Optional[Dict]:
+        """Конфигурация с локальными путями к прайсу и индексу.
+
+        Если файлов на этой реплике нет, они скачиваются из Postgres. Возвращается копия
+        конфигурации; обратно в базу её сохранять не нужно — пути в ней локальные.
+        """
+        sha256 = (config or {}).get('price_sha256')
+        if not sha256:
+            return config
+        local = dict(config)
+        price_file = config.get('price_file')
+        if not (price_file and os.path.exists(price_file)):
+            path = self.blob_store.path_for(sha256)
+            if not path.exists():
+                template = self.db.price_index_get_template(supplier_name, sha256)
+                if template is None:
+                    return config
+                path, _ = self.blob_store.put_bytes(template)
+                logger.info(f"Прайс '{supplier_name}' загружен из общего хранилища")
+            local['price_file'] = local['price_template'] = str(path)
+        if stored_index_path(local) is None:
+            meta = self._fetch_index(supplier_name, local)
+            if meta is not None:
+                local['price_index'] = meta
+        return local
+
+    def ensure(self, supplier_name: str) -> str:
+        """Готовит всё, что нужно для заказа поставщику: индекс прайса в кэше процесса
+        и локальную копию шаблона (заказ пишется прямо в XML шаблона, без разбора книги).
+
+        Сохранённый индекс (локальный или из Postgres) загружается, иначе индекс строится
+        разбором прайса, записывается в конфигурацию и публикуется для других реплик.
+        Возвращает 'loaded', 'built' или 'skipped' (у поставщика нет прайса).
+        """
+        config = self.resolve(supplier_name, self.db.suppliers_get_config(supplier_name))
+        if not config or not config.get('price_file') or not os.path.exists(config['price_file']):
+            return 'skipped'
+        self._check_template(supplier_name, config['price_file'])
+        index_path = stored_index_path(config)
+        if index_path:
+            price_index_cache.get_or_build(config['price_file'], config['price_list'],
+                                           config.get('price_sha256'), index_path)
+            return 'loaded'
+        meta = build_stored_index(config)
+        # Пока строился индекс, прайс или разметку могли поменять — тогда запись устарела.
+        # Остальные поля конфигурации не перезаписываются: их могли изменить параллельно
+        def matches(current: Dict) -> bool:
+            return (current.get('price_sha256') == meta['sha256']
+                    and index_layout(current['price_list']) == meta['layout'])
+
+        if self.db.suppliers_set_price_index(supplier_name, meta, matches):
+            logger.info(f"Индекс прайса '{supplier_name}' построен: {meta['rows']} строк")
+            if meta['sha256']:
+                self.publish(supplier_name, dict(config, price_index=meta))
+        return 'built'
+
+    @staticmethod
+    def _check_template(supplier_name: str, price_file: str) -> None:
+        # Заодно шаблон попадает в кэш страниц ОС, как после первого заказа
+        with open(price_file, 'rb') as f:
+            template = f.read()
+        if patch_xlsx_numbers(template, 0, {}) is None:
+            logger.warning(f"Прайс '{supplier_name}' нельзя поправить в XML: заказы будут собираться через openpyxl")
+
+    def _fetch_index(self, supplier_name: str, config: Dict) -> Optional[Dict]:
+        row = self.db.price_index_get(supplier_name, config['price_sha256'])
+        layout = index_layout(config['price_list'])
+        if row is None or row['format_version'] != PRICE_INDEX_VERSION or row['layout'] != layout:
+            return None
+        try:
+            index, _ = PriceIndex.from_bytes(row['index_data'])
+        except ValueError as e:
+            logger.warning(f"Индекс прайса '{supplier_name}' в общем хранилище повреждён: {e}")
+            return None
+        path = index_path_for(config.get('price_template') or config['price_file'], config['price_list'])
+        save_index_bytes(row['index_data'], path)
+        return {
+            'version': PRICE_INDEX_VERSION,
+            'path': path,
+            'sha256': config['price_sha256'],
+            'layout': layout,
+            'rows': len(index),
+        }
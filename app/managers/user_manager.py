@@ -1,25 +1,98 @@
 """Модуль для управления пользователями бота (Postgres)"""
-from typing import Set
+import logging
+import threading
+from typing import Iterable, Optional, Set
 
-from app.core.db import Database
+from app.core.db import Database, USERS_CHANNEL
+
+
+logger = logging.getLogger(__name__)
 
 
 class UserManager:
-    """Менеджер для работы с пользователями бота (через Postgres)"""
-    
+    """Менеджер для работы с пользователями бота (через Postgres).
+
+    Зарегистрированные пользователи держатся в памяти: загружаются один раз, изменения
+    пишутся в Postgres и сразу в кэш, а изменения с других реплик приходят через
+    LISTEN/NOTIFY (см. start_sync).
+    """
+
     def __init__(self):
         self.db = Database.get_instance()
-    
+        self._users: Optional[Set[int]] = None
+        self._lock = threading.RLock()
+        self._sync_stop = threading.Event()
+        self._sync_thread: Optional[threading.Thread] = None
+
+    def load(self) -> None:
+        users = set(self.db.users_get_all())
+        with self._lock:
+            self._users = users
+        logger.info(f"Загружено пользователей: {len(users)}")
+
+    def _registry(self) -> Set[int]:
+        if self._users is None:
+            self.load()
+        return self._users
+
     def add_user(self, user_id: int) -> bool:
-        return self.db.users_add(user_id)
-    
+        result = self.db.users_add(user_id)
+        with self._lock:
+            self._registry().add(user_id)
+        return result
+
     def is_user_registered(self, user_id: int) -> bool:
-        return self.db.users_is_registered(user_id)
-    
+        return user_id in self._registry()
+
     def get_all_users(self) -> Set[int]:
-        return set(self.db.users_get_all())
+        with self._lock:
+            return set(self._registry())
 
     def remove_user(self, user_id: int) -> bool:
-        return self.db.users_remove(user_id)
+        result = self.db.users_remove(user_id)
+        with self._lock:
+            self._registry().discard(user_id)
+        return result
+
+    def remove_users(self, user_ids: Iterable[int]) -> int:
+        user_ids = list(user_ids)
+        removed = self.db.users_remove_many(user_ids)
+        with self._lock:
+            self._registry().difference_update(user_ids)
+        return removed
+
+    def start_sync(self) -> None:
+        """Запускает фоновый поток, применяющий изменения пользователей с других реплик."""
+        if self._sync_thread is not None:
+            return
+        self._sync_stop.clear()
+        self._sync_thread = threading.Thread(
+            target=self.db.listen,
+            args=(USERS_CHANNEL, self._apply_notification, self._sync_stop),
+            kwargs={'on_connect': self.load},
+            name="users-sync",
+            daemon=True,
+        )
+        self._sync_thread.start()
 
+    def stop_sync(self) -> None:
+        self._sync_stop.set()
+        self._sync_thread = None
 
+    def _apply_notification(self, payload: str) -> None:
+        if payload == 'reload':
+            # Массовое удаление: список id не помещается в уведомления, перечитываем таблицу
+            self.load()
+            return
+        action, _, ids = payload.partition(':')
+        try:
+            user_ids = [int(u) for u in ids.split(',') if u]
+        except ValueError:
+            logger.warning(f"Некорректное уведомление об изменении пользователей: {payload}")
+            return
+        with self._lock:
+            users = self._registry()
+            if action == 'add':
+                users.update(user_ids)
+            elif action == 'remove':
+                users.difference_update(user_ids)
@@ -0,0 +1,147 @@
+"""Рассылка сообщений с ограничением параллелизма и частоты отправки"""
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from aiogram.exceptions import TelegramRetryAfter
+
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram Bot API: ~30 сообщений в секунду суммарно и ~1 сообщение в секунду в один чат
+GLOBAL_RATE = 30.0
+PER_CHAT_RATE = 1.0
+
+
+class TokenBucket:
+    """Асинхронный token bucket: rate токенов в секунду, не более capacity в запасе.
+
+    pause(seconds) останавливает выдачу токенов всем ожидающим; после паузы запас
+    начинает копиться с нуля, чтобы не выпустить сразу весь capacity.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if now <= self.updated_at:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def is_idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+        self.updated_at = self.paused_until
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                delay = self.paused_until - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BroadcastResult:
+    """Итог рассылки: кому доставлено, кому нет и кто недоступен (бот заблокирован/чат не найден)."""
+
+    def __init__(self):
+        self.sent: List[int] = []
+        self.failed: List[int] = []
+        self.unreachable: Set[int] = set()
+
+    def __repr__(self) -> str:
+        return f"BroadcastResult(sent={len(self.sent)}, failed={len(self.failed)}, unreachable={len(self.unreachable)})"
+
+
+def is_unreachable_error(error: Exception) -> bool:
+    text = str(error).lower()
+    return "chat not found" in text or "blocked" in text
+
+
+class NotificationDispatcher:
+    """Параллельная рассылка через bot.send_message.
+
+    Параллелизм ограничен семафором, частота — общим и поканальными token bucket'ами.
+    TelegramRetryAfter ставит на паузу общий bucket: Telegram ограничивает бота целиком,
+    поэтому ждут все отправители, а не только получивший ошибку. Для тестов достаточно
+    передать Bot с локальной фейковой сессией (или любой объект с методом send_message).
+    """
+
+    def __init__(self, bot, concurrency: int = 20, global_rate: float = GLOBAL_RATE,
+                 per_chat_rate: float = PER_CHAT_RATE, max_retries: int = 3):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_chat_rate, capacity=1.0)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _prune_chat_buckets(self) -> None:
+        for chat_id in [c for c, b in self.chat_buckets.items() if b.is_idle()]:
+            del self.chat_buckets[chat_id]
+
+    async def broadcast(self, user_ids: Iterable[int], text: str) -> BroadcastResult:
+        return await self.broadcast_many({user_id: text for user_id in user_ids})
+
+    async def broadcast_many(self, messages: Dict[int, str]) -> BroadcastResult:
+        """Отправляет каждому chat_id свой текст."""
+        result = BroadcastResult()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def worker(chat_id: int, text: str):
+            async with semaphore:
+                await self._send(chat_id, text, result)
+
+        await asyncio.gather(*(worker(chat_id, text) for chat_id, text in messages.items()))
+        self._prune_chat_buckets()
+        logger.info(f"Рассылка завершена: {result}")
+        return result
+
+    async def _send(self, chat_id: int, text: str, result: BroadcastResult) -> None:
+        attempt = 0
+        while True:
+            await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id, text)
+                result.sent.append(chat_id)
+                return
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    logger.error(f"Превышено число повторов отправки пользователю {chat_id}: {e}")
+                    result.failed.append(chat_id)
+                    return
+                logger.warning(f"Flood control для {chat_id}, рассылка приостановлена на {e.retry_after} с")
+                self.global_bucket.pause(e.retry_after)
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомления пользователю {chat_id}: {e}")
+                result.failed.append(chat_id)
+                if is_unreachable_error(e):
+                    result.unreachable.add(chat_id)
+                return
@@ -0,0 +1,174 @@
+"""Фоновая очистка uploads/ и outputs/ по возрасту и суммарному размеру"""
+import asyncio
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Set, Tuple
+
+from app.managers.config_manager import SupplierConfigManager
+
+
+logger = logging.getLogger(__name__)
+
+# Файлы моложе этого возраста не трогаем никогда: они могут ещё дозаписываться
+MIN_FILE_AGE = 600
+
+
+class CleanupRule:
+    """Правило очистки каталога: максимальный возраст файла и квота на суммарный размер."""
+
+    def __init__(self, directory: Path, max_age_seconds: Optional[float] = None, max_total_bytes: Optional[int] = None):
+        self.directory = Path(directory)
+        self.max_age_seconds = max_age_seconds
+        self.max_total_bytes = max_total_bytes
+
+
+class CleanupReport:
+    def __init__(self):
+        self.removed_files = 0
+        self.reclaimed_bytes = 0
+        self.kept_referenced = 0
+
+    def __repr__(self) -> str:
+        return (f"CleanupReport(removed_files={self.removed_files}, "
+                f"reclaimed_mb={self.reclaimed_bytes / 1024 / 1024:.1f}, kept_referenced={self.kept_referenced})")
+
+
+class StorageJanitor:
+    """Периодически удаляет старые файлы и держит каталоги в пределах квот.
+
+    Файлы, на которые ссылаются конфигурации поставщиков (price_file/price_template/price_index),
+    и файлы живых пользовательских сессий не удаляются никогда.
+
+    release_min_age — release() не трогает файлы, изменённые позже этого срока. Нужен, когда
+    сессии других процессов видны только через общее хранилище: только что загруженный
+    (или совпавший по sha256) blob попадает туда лишь после завершения обработчика.
+    """
+
+    def __init__(self, config_manager: SupplierConfigManager, rules: List[CleanupRule], interval: float = 3600,
+                 extra_references: Optional[Callable[[], Iterable[str]]] = None,
+                 on_run: Optional[Callable[[], None]] = None, release_min_age: float = 0.0):
+        self.config_manager = config_manager
+        self.rules = rules
+        self.interval = interval
+        self.extra_references = extra_references
+        self.on_run = on_run
+        self.release_min_age = release_min_age
+        self.running = False
+
+    async def start(self):
+        self.running = True
+        logger.info("Очистка хранилища запущена")
+        while self.running:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка очистки хранилища: {e}")
+            await asyncio.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        logger.info("Очистка хранилища остановлена")
+
+    async def run_once(self) -> CleanupReport:
+        if self.on_run:
+            self.on_run()
+        referenced = await asyncio.to_thread(self._referenced_files)
+        report = await asyncio.to_thread(self._cleanup, referenced)
+        logger.info(f"Очистка хранилища: удалено файлов {report.removed_files}, "
+                    f"освобождено {report.reclaimed_bytes / 1024 / 1024:.1f} МБ, "
+                    f"сохранено используемых {report.kept_referenced}")
+        return report
+
+    def release(self, paths: Iterable[str]) -> int:
+        """Удаляет временные файлы закрытой сессии, кроме всё ещё используемых (блокирующий вызов).
+
+        Хранилище дедуплицирует загрузки, поэтому тот же blob может оказаться прайсом поставщика
+        или файлом другой сессии. Если ссылки проверить не удалось, файлы остаются до обычной очистки.
+        """
+        paths = {os.path.abspath(p) for p in paths if p}
+        if not paths:
+            return 0
+        try:
+            referenced = self._referenced_files()
+        except Exception as e:
+            logger.warning(f"Временные файлы сессии оставлены до плановой очистки: {e}")
+            return 0
+        removed = 0
+        now = time.time()
+        for path in paths - referenced:
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            if now - mtime < self.release_min_age:
+                continue
+            if self._remove(path):
+                removed += 1
+        return removed
+
+    def _referenced_files(self) -> Set[str]:
+        referenced: Set[str] = set()
+        for supplier_name in self.config_manager.list_suppliers():
+            config = self.config_manager.get_supplier_config(supplier_name) or {}
+            for key in ('price_file', 'price_template'):
+                if config.get(key):
+                    referenced.add(os.path.abspath(config[key]))
+            if (config.get('price_index') or {}).get('path'):
+                referenced.add(os.path.abspath(config['price_index']['path']))
+        if self.extra_references:
+            referenced.update(os.path.abspath(p) for p in self.extra_references() if p)
+        return referenced
+
+    def _cleanup(self, referenced: Set[str]) -> CleanupReport:
+        report = CleanupReport()
+        now = time.time()
+        for rule in self.rules:
+            files = self._scan(rule.directory)
+            candidates: List[Tuple[float, int, str]] = []
+            total_bytes = 0
+            for mtime, size, path in files:
+                total_bytes += size
+                if path in referenced:
+                    report.kept_referenced += 1
+                    continue
+                if now - mtime < MIN_FILE_AGE:
+                    continue
+                candidates.append((mtime, size, path))
+            # Сначала самые старые: и правило возраста, и квота освобождают их первыми
+            candidates.sort()
+            for mtime, size, path in candidates:
+                expired = rule.max_age_seconds is not None and now - mtime > rule.max_age_seconds
+                over_quota = rule.max_total_bytes is not None and total_bytes > rule.max_total_bytes
+                if not (expired or over_quota):
+                    continue
+                if self._remove(path):
+                    total_bytes -= size
+                    report.removed_files += 1
+                    report.reclaimed_bytes += size
+        return report
+
+    @staticmethod
+    def _scan(directory: Path) -> List[Tuple[float, int, str]]:
+        files: List[Tuple[float, int, str]] = []
+        if not directory.exists():
+            return files
+        for root, _, names in os.walk(directory):
+            for name in names:
+                path = os.path.abspath(os.path.join(root, name))
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        return files
+
+    @staticmethod
+    def _remove(path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except OSError as e:
+            logger.warning(f"Не удалось удалить {path}: {e}")
+            return False
@@ -0,0 +1,77 @@
+"""Выбор ведущей реплики через advisory-блокировку Postgres"""
+import logging
+import threading
+from typing import Optional
+
+import psycopg
+
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLease:
+    """Сессионная блокировка pg_try_advisory_lock на выделенном соединении.
+
+    Ведущий тот, кто держит блокировку. Если процесс ведущего падает или его соединение
+    рвётся, Postgres снимает блокировку, и её забирает следующая реплика при очередной
+    проверке. Keepalive на соединении ускоряет обнаружение «мёртвого» клиента сервером.
+    """
+
+    def __init__(self, dsn: str, name: str, keepalive_seconds: int = 10):
+        self.dsn = dsn
+        self.name = name
+        self.keepalive_seconds = keepalive_seconds
+        self._conn: Optional[psycopg.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_leader(self) -> bool:
+        return self._conn is not None
+
+    def _drop(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def ensure(self) -> bool:
+        """Проверяет лидерство и пытается его получить; возвращает True, если эта реплика ведущая."""
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.execute("SELECT 1")
+                    return True
+                except Exception as e:
+                    logger.warning(f"Соединение ведущего '{self.name}' потеряно: {e}")
+                    self._drop()
+            conn = psycopg.connect(
+                self.dsn, autocommit=True,
+                keepalives=1, keepalives_idle=self.keepalive_seconds,
+                keepalives_interval=self.keepalive_seconds, keepalives_count=3,
+            )
+            try:
+                # Серверная сторона тоже должна быстро замечать пропавшего клиента
+                for param in ('tcp_keepalives_idle', 'tcp_keepalives_interval'):
+                    conn.execute(f"SET {param} = {int(self.keepalive_seconds)}")
+                acquired = conn.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (self.name,)).fetchone()[0]
+            except Exception:
+                conn.close()
+                raise
+            if not acquired:
+                conn.close()
+                return False
+            self._conn = conn
+            logger.info(f"Эта реплика стала ведущей для '{self.name}'")
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.execute("SELECT pg_advisory_unlock(hashtext(%s))", (self.name,))
+                except Exception:
+                    pass
+                self._drop()
+                logger.info(f"Реплика отказалась от роли ведущей для '{self.name}'")
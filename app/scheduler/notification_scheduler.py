@@ -2,31 +2,70 @@
 import asyncio
 import logging
 from datetime import datetime
-from typing import Dict
+from typing import Dict, List, Optional, Set
 
 from aiogram import Bot
 
 from app.managers.config_manager import SupplierConfigManager
 from app.managers.user_manager import UserManager
+from app.scheduler.dispatcher import NotificationDispatcher
+from app.scheduler.leader import LeaderLease
 
 
 logger = logging.getLogger(__name__)
 
+# Между порциями рассылки ведущая заново проверяет блокировку
+BROADCAST_BATCH = 100
+
+
+class LeadershipLost(Exception):
+    """Реплика перестала быть ведущей посреди рассылки."""
+
 
 class NotificationScheduler:
-    def __init__(self, bot: Bot, config_manager: SupplierConfigManager, user_manager: UserManager):
+    """Периодическая рассылка напоминаний о поставщиках.
+
+    При нескольких репликах бота рассылает только ведущая (leader — advisory-блокировка
+    в Postgres); время последних отправок хранится в базе, поэтому новая ведущая
+    после переключения не повторяет уже отправленные напоминания. Время пишется до
+    рассылки, а лидерство перепроверяется между порциями по BROADCAST_BATCH получателей:
+    потерявшая блокировку реплика прекращает отправку, и одно напоминание не уходит дважды.
+    """
+
+    def __init__(self, bot: Bot, config_manager: SupplierConfigManager, user_manager: UserManager,
+                 digest: bool = True, leader: Optional[LeaderLease] = None):
         self.bot = bot
         self.config_manager = config_manager
         self.user_manager = user_manager
+        self.dispatcher = NotificationDispatcher(bot)
+        # В режиме дайджеста все поставщики, подошедшие в один тик, уходят одним сообщением
+        self.digest = digest
         self.last_check_time: Dict[str, datetime] = {}
+        self.leader = leader
         self.running = False
 
+    async def _is_leader(self) -> bool:
+        if self.leader is None:
+            return True
+        was_leader = self.leader.is_leader
+        try:
+            is_leader = await asyncio.to_thread(self.leader.ensure)
+        except Exception as e:
+            logger.error(f"Ошибка выбора ведущей реплики: {e}")
+            is_leader = False
+        if was_leader and not is_leader:
+            logger.warning("Реплика больше не ведущая, рассылка уведомлений приостановлена")
+        return is_leader
+
     async def start(self):
         self.running = True
         logger.info("Планировщик уведомлений запущен")
         while self.running:
             try:
-                await self.check_and_send_notifications()
+                if await self._is_leader():
+                    # Отправки могли выполнить другие реплики, пока эта не была ведущей
+                    self.last_check_time = await asyncio.to_thread(self.config_manager.get_notification_times)
+                    await self.check_and_send_notifications()
                 await asyncio.sleep(60)
             except Exception as e:
                 logger.error(f"Ошибка в планировщике уведомлений: {e}")
@@ -34,9 +73,12 @@ class NotificationScheduler:
 
     def stop(self):
         self.running = False
+        if self.leader is not None:
+            self.leader.release()
         logger.info("Планировщик уведомлений остановлен")
 
     def reset_notification_time(self, supplier_name: str):
+        self.config_manager.reset_notification_time(supplier_name)
         if supplier_name in self.last_check_time:
             del self.last_check_time[supplier_name]
             logger.info(f"Время последней отправки для '{supplier_name}' сброшено")
@@ -48,6 +90,7 @@ class NotificationScheduler:
         suppliers = self.config_manager.list_suppliers()
         current_time = datetime.now()
         logger.debug(f"Проверка уведомлений: {len(suppliers)} поставщиков, текущее время: {current_time}")
+        due_suppliers = []
         for supplier_name in suppliers:
             config = self.config_manager.get_supplier_config(supplier_name)
             if not config:
@@ -58,9 +101,25 @@ class NotificationScheduler:
             should_send = await self.should_send_notification(supplier_name, notification, current_time)
             logger.debug(f"Поставщик '{supplier_name}': должно отправляться = {should_send}")
             if should_send:
-                await self.send_notification(supplier_name)
-                self.last_check_time[supplier_name] = current_time
-                logger.info(f"Уведомление для '{supplier_name}' отправлено, время сохранено: {current_time}")
+                due_suppliers.append(supplier_name)
+        if not due_suppliers:
+            return
+        # Время сохраняется до отправки: если лидерство перейдёт посреди рассылки,
+        # новая ведущая не начнёт эти напоминания заново
+        for supplier_name in due_suppliers:
+            self.last_check_time[supplier_name] = current_time
+            await asyncio.to_thread(self.config_manager.set_notification_time, supplier_name, current_time)
+        try:
+            if self.digest:
+                await self.send_digest(due_suppliers)
+            else:
+                for supplier_name in due_suppliers:
+                    await self.send_notification(supplier_name)
+        except LeadershipLost as e:
+            logger.warning(f"Рассылка прервана: реплика больше не ведущая ({e})")
+            return
+        for supplier_name in due_suppliers:
+            logger.info(f"Уведомление для '{supplier_name}' отправлено, время сохранено: {current_time}")
 
     async def should_send_notification(self, supplier_name: str, notification: Dict, current_time: datetime) -> bool:
         if notification.get('type') == 'days':
@@ -99,15 +158,37 @@ class NotificationScheduler:
             f"Поставщик: {supplier_name}\n"
             f"Не забудьте проверить наличие новых прайс-листов или заказов."
         )
-        for user_id in users:
-            try:
-                await self.bot.send_message(user_id, message_text)
-            except Exception as e:
-                logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
-                if "chat not found" in str(e).lower() or "blocked" in str(e).lower():
-                    try:
-                        self.user_manager.remove_user(user_id)
-                    except Exception:
-                        pass
+        await self._broadcast(users, message_text)
 
+    async def send_digest(self, supplier_names: List[str]):
+        if len(supplier_names) == 1:
+            await self.send_notification(supplier_names[0])
+            return
+        users = self.user_manager.get_all_users()
+        if not users:
+            logger.info(f"Нет пользователей для отправки дайджеста ({len(supplier_names)} поставщиков)")
+            return
+        message_text = (
+            "🔔 Напоминание о поставщиках\n\n"
+            + "\n".join(f"• {name}" for name in supplier_names)
+            + "\n\nНе забудьте проверить наличие новых прайс-листов или заказов."
+        )
+        await self._broadcast(users, message_text)
 
+    async def _broadcast(self, users: Set[int], message_text: str):
+        users = sorted(users)
+        unreachable: Set[int] = set()
+        try:
+            for start in range(0, len(users), BROADCAST_BATCH):
+                if start and not await self._is_leader():
+                    raise LeadershipLost(f"не отправлено {len(users) - start} из {len(users)}")
+                result = await self.dispatcher.broadcast(users[start:start + BROADCAST_BATCH], message_text)
+                unreachable |= result.unreachable
+        finally:
+            if unreachable:
+                # Недоступных пользователей удаляем одним запросом после рассылки
+                try:
+                    removed = await asyncio.to_thread(self.user_manager.remove_users, unreachable)
+                    logger.info(f"Удалено недоступных пользователей: {removed}")
+                except Exception as e:
+                    logger.error(f"Ошибка удаления недоступных пользователей: {e}")
@@ -0,0 +1,242 @@
+"""Очередь генерации заказов в Postgres: постановка, воркеры и доставка результатов"""
+import asyncio
+import io
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.core.db import Database, JOBS_CHANNEL, JOBS_DONE_CHANNEL
+from app.excel.order_generator import OrderGenerator
+from app.excel.price_index import stored_index_path
+from app.managers.price_index_manager import PriceIndexManager
+
+
+logger = logging.getLogger(__name__)
+
+
+class OrderJobQueue:
+    """Постановка заданий на генерацию заказа в таблицу jobs."""
+
+    def __init__(self):
+        self.db = Database.get_instance()
+
+    def enqueue(self, user_id: int, chat_id: int, supplier: str, config: Dict, hashes: Dict[str, str],
+                output_name: str, warehouse: bytes, preorders: bytes, price: Optional[bytes] = None) -> int:
+        """hashes — sha256 прайса, склада и предзаказов (price_sha256, warehouse_sha256, preorders_sha256).
+
+        Байты прайса передаются, только если это не сохранённый прайс поставщика:
+        сохранённый воркер возьмёт локально или из общего хранилища индексов.
+        """
+        payload = dict(hashes, config=config, output_name=output_name)
+        return self.db.jobs_enqueue(user_id, chat_id, supplier, payload, warehouse, preorders, price)
+
+
+class OrderJobWorker:
+    """Воркер очереди: забирает задания через FOR UPDATE SKIP LOCKED и выполняет generate_order.
+
+    Воркеров может быть сколько угодно (потоки бота или отдельные процессы app.worker).
+    Задания упавших воркеров возвращаются в очередь по истечении job_timeout; доставленные
+    задания удаляются через retention секунд.
+    """
+
+    def __init__(self, price_indexes: PriceIndexManager, worker_id: Optional[str] = None,
+                 poll_interval: float = 5.0, job_timeout: float = 600, max_attempts: int = 3,
+                 retention: float = 7 * 24 * 3600):
+        self.db = Database.get_instance()
+        self.price_indexes = price_indexes
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._listener: Optional[threading.Thread] = None
+
+    def _price_source(self, job: Dict[str, Any]):
+        if job['price'] is not None:
+            return job['price']
+        payload = job['payload']
+        config = self.price_indexes.resolve(job['supplier'], payload['config'])
+        if not config or not config.get('price_file') or not os.path.exists(config['price_file']):
+            raise RuntimeError("прайс-лист поставщика недоступен на воркере")
+        if config.get('price_sha256') != payload['price_sha256']:
+            raise RuntimeError("прайс-лист поставщика изменился, сгенерируйте заказ заново")
+        return config['price_file']
+
+    def process(self, job: Dict[str, Any]) -> None:
+        payload = job['payload']
+        config = payload['config']
+        started = time.perf_counter()
+        try:
+            price_source = self._price_source(job)
+            index_path = stored_index_path(config) if isinstance(price_source, str) else None
+            generator = OrderGenerator(config['price_list'])
+            output = io.BytesIO()
+            quantities = generator.generate_order(
+                price_source, job['warehouse'], job['preorders'], output,
+                config['warehouse_order'], config['preorders'],
+                price_sha256=payload['price_sha256'], price_index_path=index_path,
+            )
+            diagnostics = dict(generator.last_diagnostics)
+            warehouse_diag = diagnostics.get('warehouse') or {}
+            if not quantities or warehouse_diag.get('total_items_found', 0) == 0:
+                # Предпросмотр склада нужен боту для диагностики, а сам файл у бота уже не хранится
+                try:
+                    diagnostics['preview'] = generator.preview_warehouse(
+                        job['warehouse'], config['price_list'].get('article_col', 0),
+                        config['price_list'].get('quantity_col', 9), rows=10)
+                except Exception:
+                    pass
+            finished = self.db.jobs_finish(job['id'], self.worker_id, job['attempts'],
+                                           output.getvalue(), quantities, diagnostics)
+            logger.info(f"Задание {job['id']} ('{job['supplier']}') выполнено за {time.perf_counter() - started:.2f} с")
+        except Exception as e:
+            logger.error(f"Задание {job['id']} ('{job['supplier']}') завершилось ошибкой: {e}", exc_info=True)
+            finished = self.db.jobs_finish(job['id'], self.worker_id, job['attempts'], error=str(e))
+        if not finished:
+            logger.warning(f"Результат задания {job['id']} отброшен: задание уже передано другому воркеру")
+
+    def run_once(self) -> bool:
+        job = self.db.jobs_claim(self.worker_id)
+        if job is None:
+            return False
+        self.process(job)
+        return True
+
+    def run(self) -> None:
+        """Блокирующий цикл воркера до вызова stop()."""
+        self._stop.clear()
+        self._listener = threading.Thread(
+            target=self.db.listen,
+            args=(JOBS_CHANNEL, lambda _: self._wake.set(), self._stop),
+            kwargs={'on_connect': self._wake.set},
+            name="jobs-listen",
+            daemon=True,
+        )
+        self._listener.start()
+        logger.info(f"Воркер очереди заказов {self.worker_id} запущен")
+        last_requeue = last_purge = 0.0
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - last_requeue > self.poll_interval * 6:
+                    last_requeue = time.monotonic()
+                    requeued = self.db.jobs_requeue_stale(self.job_timeout, self.max_attempts)
+                    if requeued:
+                        logger.warning(f"Возвращено в очередь зависших заданий: {requeued}")
+                if time.monotonic() - last_purge > 3600:
+                    last_purge = time.monotonic()
+                    purged = self.db.jobs_purge(self.retention)
+                    if purged:
+                        logger.info(f"Удалено доставленных заданий: {purged}")
+                if self.run_once():
+                    continue
+            except Exception as e:
+                logger.error(f"Ошибка воркера очереди заказов: {e}")
+                self._stop.wait(1.5)
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+        logger.info(f"Воркер очереди заказов {self.worker_id} остановлен")
+
+    def start(self) -> None:
+        """Запускает воркер в фоновом потоке процесса бота."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self.run, name="jobs-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        self._thread = None
+
+
+class JobResultDispatcher:
+    """Доставляет пользователям результаты выполненных заданий.
+
+    Готовые задания забираются атомарно (каждое — одной репликой бота), сигнал о готовности
+    приходит через LISTEN, а периодический опрос подбирает результаты, готовые пока бот
+    был остановлен. shard = (номер, число процессов) ограничивает доставку пользователями
+    этого процесса в режиме супервизора.
+
+    Задание помечается доставленным только после успешной отправки. Неудачная доставка
+    повторяется через retry_delay секунд (с ростом паузы), после max_delivery_attempts попыток
+    результат снимается с доставки.
+    """
+
+    def __init__(self, deliver: Callable[[Dict[str, Any]], Awaitable[None]],
+                 poll_interval: float = 5.0, batch_size: int = 20, shard: Optional[Tuple[int, int]] = None,
+                 retry_delay: float = 30.0, max_delivery_attempts: int = 5):
+        self.db = Database.get_instance()
+        self.deliver = deliver
+        self.shard = shard
+        self.retry_delay = retry_delay
+        self.max_delivery_attempts = max_delivery_attempts
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.running = False
+        self._stop = threading.Event()
+
+    async def start(self):
+        self.running = True
+        self._stop.clear()
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+
+        def signal(*_):
+            loop.call_soon_threadsafe(wake.set)
+
+        threading.Thread(
+            target=self.db.listen,
+            args=(JOBS_DONE_CHANNEL, signal, self._stop),
+            kwargs={'on_connect': signal},
+            name="jobs-done-listen",
+            daemon=True,
+        ).start()
+        logger.info("Доставка результатов очереди заказов запущена")
+        while self.running:
+            try:
+                jobs = await asyncio.to_thread(self.db.jobs_claim_finished, self.batch_size, self.shard)
+            except Exception as e:
+                logger.error(f"Ошибка чтения результатов очереди заказов: {e}")
+                jobs = []
+            for job in jobs:
+                await self._deliver_one(job)
+            if len(jobs) == self.batch_size:
+                continue
+            try:
+                await asyncio.wait_for(wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            wake.clear()
+
+    async def _deliver_one(self, job: Dict[str, Any]) -> None:
+        try:
+            await self.deliver(job)
+        except Exception as e:
+            attempt = job['delivery_attempts']
+            if attempt < self.max_delivery_attempts:
+                delay = self.retry_delay * 2 ** (attempt - 1)
+                logger.warning(f"Не удалось доставить результат задания {job['id']} (попытка {attempt}): {e}; "
+                               f"повтор через {delay:.0f} с")
+                try:
+                    await asyncio.to_thread(self.db.jobs_retry_delivery, job['id'], delay)
+                except Exception as e:
+                    # Аренда истечёт сама, и задание будет доставлено повторно
+                    logger.warning(f"Не удалось отложить доставку задания {job['id']}: {e}")
+                return
+            logger.error(f"Результат задания {job['id']} не доставлен после {attempt} попыток: {e}")
+        try:
+            await asyncio.to_thread(self.db.jobs_mark_delivered, job['id'])
+        except Exception as e:
+            logger.warning(f"Не удалось отметить доставку задания {job['id']}: {e}")
+
+    def stop(self):
+        self.running = False
+        self._stop.set()
+        logger.info("Доставка результатов очереди заказов остановлена")
@@ -0,0 +1,326 @@
+"""Супервизор: несколько процессов бота, апдейты распределяются по user_id.
+
+Пример:
+    python -m app.supervisor --processes 4
+
+Супервизор сам получает апдейты (BOT_MODE=polling или webhook, как бот) и передаёт
+каждый в процесс abs(user_id) % N. Все апдейты пользователя обрабатывает один процесс,
+поэтому состояние FSM и сессии остаются в его памяти. Уведомления и очистку хранилища
+запускает только процесс 0. Упавший процесс перезапускается и заново получает апдейты,
+обработку которых он не подтвердил (WorkerChannel).
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+
+logger = logging.getLogger(__name__)
+
+# Апдейты без пользователя (посты каналов, опросы) обрабатывает процесс 0
+UPDATE_USER_KEYS = ('from', 'user')
+
+
+def route_key(payload: Dict[str, Any]) -> int:
+    """user_id апдейта, для апдейтов без пользователя — id чата, иначе 0."""
+    for name, event in payload.items():
+        if name == 'update_id' or not isinstance(event, dict):
+            continue
+        for key in UPDATE_USER_KEYS:
+            user = event.get(key)
+            if isinstance(user, dict) and 'id' in user:
+                return user['id']
+        chat = event.get('chat') or (event.get('message') or {}).get('chat')
+        if isinstance(chat, dict) and 'id' in chat:
+            return chat['id']
+    return 0
+
+
+def shard_for(user_id: int, count: int) -> int:
+    # То же правило использует Database.jobs_claim_finished при доставке результатов очереди
+    return abs(user_id) % count
+
+
+def run_bot_process(index: int, count: int, updates) -> None:
+    """Точка входа процесса бота: обычный app.bot.main, но апдейты приходят из канала супервизора."""
+    os.environ['BOT_WORKER_INDEX'] = str(index)
+    os.environ['BOT_WORKER_COUNT'] = str(count)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from app.bot.main import main
+    asyncio.run(main(updates=updates))
+
+
+class WorkerChannel:
+    """Канал апдейтов одного процесса бота поверх multiprocessing.Pipe.
+
+    Апдейт остаётся в pending, пока процесс не подтвердит его обработку. После перезапуска
+    процесса неподтверждённые апдейты отправляются заново (Telegram они уже подтверждены
+    и повторно не придут), поэтому апдейт может обработаться дважды, но не теряется.
+    Апдейт, на котором процесс упал max_deliveries раз, отбрасывается.
+    Очередь ограничена maxsize: когда процесс не успевает, route ждёт, и супервизор
+    перестаёт забирать новые апдейты.
+
+    multiprocessing.Queue здесь не подходит: процесс, убитый внутри get(), оставляет
+    захваченной блокировку чтения, и очередь становится непригодной ни для нового процесса,
+    ни для того, чтобы забрать из неё оставшиеся апдейты.
+    """
+
+    def __init__(self, index: int, maxsize: int = 256, max_deliveries: int = 3):
+        self.index = index
+        self.max_deliveries = max_deliveries
+        # seq -> [апдейт, число отправок]
+        self.pending: "OrderedDict[int, list]" = OrderedDict()
+        self._slots = asyncio.Semaphore(max(1, maxsize))
+        self._seq = 0
+        self._last_sent = 0
+        self._conn = None
+        self._wake = asyncio.Event()
+        self._closing = False
+        self._loop = asyncio.get_running_loop()
+        self._sender = asyncio.create_task(self._send_loop())
+
+    def attach(self, conn) -> None:
+        """Подключает канал к новому процессу; неподтверждённое отправится ему заново."""
+        if self._conn is not None:
+            self._conn.close()
+        for seq, entry in list(self.pending.items()):
+            if entry[1] >= self.max_deliveries:
+                logger.error(f"Апдейт {entry[0].get('update_id')} отброшен: процесс бота {self.index} "
+                             f"падал на нём {entry[1]} раз")
+                self._ack(seq)
+        self._conn = conn
+        self._last_sent = 0
+        threading.Thread(target=self._read_acks, args=(conn,), name=f"bot-{self.index}-acks", daemon=True).start()
+        self._wake.set()
+
+    async def put(self, payload: Dict[str, Any]) -> None:
+        await self._slots.acquire()
+        self._seq += 1
+        self.pending[self._seq] = [payload, 0]
+        self._wake.set()
+
+    async def close(self, timeout: float) -> None:
+        """Отправляет накопленное и сигнал остановки (None)."""
+        self._closing = True
+        self._wake.set()
+        try:
+            await asyncio.wait_for(self._sender, timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Процессу бота {self.index} не отправлено апдейтов: {len(self.pending)}")
+
+    def _ack(self, seq: int) -> None:
+        if self.pending.pop(seq, None) is not None:
+            self._slots.release()
+
+    def _read_acks(self, conn) -> None:
+        while True:
+            try:
+                seq = conn.recv()
+            except (EOFError, OSError):
+                return
+            self._loop.call_soon_threadsafe(self._ack, seq)
+
+    async def _send_loop(self) -> None:
+        # Единственный отправитель: апдейты уходят по порядку и без дублей в рамках одного процесса
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            conn = self._conn
+            if conn is None:
+                if self._closing:
+                    return
+                continue
+            sent_all = True
+            for seq in [seq for seq in self.pending if seq > self._last_sent]:
+                entry = self.pending.get(seq)
+                if entry is None:
+                    continue
+                if conn is not self._conn:
+                    sent_all = False
+                    break
+                entry[1] += 1
+                try:
+                    # send блокируется, пока процесс не вычитает буфер канала
+                    await asyncio.to_thread(conn.send, (seq, entry[0]))
+                except (OSError, ValueError):
+                    # Процесс завершился: отправка возобновится после перезапуска (attach)
+                    if self._closing:
+                        return
+                    sent_all = False
+                    break
+                if conn is self._conn:
+                    self._last_sent = seq
+            if self._closing and sent_all and conn is self._conn:
+                try:
+                    await asyncio.to_thread(conn.send, None)
+                except (OSError, ValueError):
+                    pass
+                return
+
+
+class Supervisor:
+    """Запускает процессы бота и раздаёт им апдейты."""
+
+    def __init__(self, count: int, restart_delay: float = 5.0, stop_timeout: float = 40.0, queue_size: int = 256):
+        self.count = max(1, count)
+        self.restart_delay = restart_delay
+        self.stop_timeout = stop_timeout
+        self.queue_size = queue_size
+        self._ctx = multiprocessing.get_context('spawn')
+        self.channels: List[Optional[WorkerChannel]] = [None] * self.count
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * self.count
+        self._started_at = [0.0] * self.count
+
+    def _spawn(self, index: int) -> None:
+        # Канал (и неподтверждённые апдейты в нём) переживает перезапуск; меняется только Pipe
+        if self.channels[index] is None:
+            self.channels[index] = WorkerChannel(index, self.queue_size)
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=run_bot_process, args=(index, self.count, child_conn),
+                                    name=f"bot-{index}")
+        process.start()
+        # Копия дочернего конца у супервизора не нужна: иначе смерть процесса не закроет канал
+        child_conn.close()
+        self.channels[index].attach(parent_conn)
+        self.processes[index] = process
+        self._started_at[index] = time.monotonic()
+        logger.info(f"Процесс бота {index} запущен (pid {process.pid})")
+        if self.channels[index].pending:
+            logger.warning(f"Процессу бота {index} повторно отправляются неподтверждённые апдейты: "
+                           f"{len(self.channels[index].pending)}")
+
+    def start(self) -> None:
+        """Запускает процессы; вызывается из работающего цикла событий."""
+        for index in range(self.count):
+            self._spawn(index)
+
+    async def route(self, payload: Dict[str, Any]) -> bool:
+        await self.channels[shard_for(route_key(payload), self.count)].put(payload)
+        return True
+
+    async def watch(self, stop_event: asyncio.Event) -> None:
+        """Перезапускает завершившиеся процессы (не чаще раза в restart_delay секунд)."""
+        while not stop_event.is_set():
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive() \
+                        and time.monotonic() - self._started_at[index] >= self.restart_delay:
+                    logger.error(f"Процесс бота {index} завершился с кодом {process.exitcode}, перезапуск")
+                    self._spawn(index)
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self) -> None:
+        """Просит процессы доработать начатые апдейты и завершиться; зависшие снимаются."""
+        deadline = time.monotonic() + self.stop_timeout
+        for channel in self.channels:
+            if channel is not None:
+                await channel.close(max(0.0, deadline - time.monotonic()))
+        await asyncio.to_thread(self._join, deadline)
+
+    def _join(self, deadline: float) -> None:
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Процесс бота {index} не завершился вовремя, принудительная остановка")
+                process.terminate()
+                process.join(5)
+        logger.info("Процессы бота остановлены")
+
+
+async def poll_updates(bot, supervisor: Supervisor, stop_event: asyncio.Event, polling_timeout: int = 30) -> None:
+    """Long polling в супервизоре: апдейты не обрабатываются, а только раздаются процессам."""
+    from aiogram.methods import GetUpdates
+
+    get_updates = GetUpdates(timeout=polling_timeout)
+    request_timeout = int(bot.session.timeout + polling_timeout)
+    while not stop_event.is_set():
+        fetch = asyncio.create_task(bot(get_updates, request_timeout=request_timeout))
+        stopped = asyncio.create_task(stop_event.wait())
+        await asyncio.wait({fetch, stopped}, return_when=asyncio.FIRST_COMPLETED)
+        stopped.cancel()
+        if not fetch.done():
+            fetch.cancel()
+            break
+        try:
+            updates = fetch.result()
+        except Exception as e:
+            logger.error(f"Ошибка получения апдейтов: {e}")
+            await asyncio.sleep(1.5)
+            continue
+        for update in updates:
+            await supervisor.route(update.model_dump(mode='json', by_alias=True, exclude_unset=True))
+            get_updates.offset = update.update_id + 1
+
+
+async def run(args) -> None:
+    from aiogram import Bot
+
+    token = os.getenv('BOT_TOKEN')
+    if not token:
+        raise ValueError("BOT_TOKEN не установлен в переменных окружения")
+    mode = os.getenv('BOT_MODE', 'polling').lower()
+    bot = Bot(token=token)
+    supervisor = Supervisor(args.processes, queue_size=args.queue_size)
+    supervisor.start()
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    watcher = asyncio.create_task(supervisor.watch(stop_event))
+    try:
+        if mode == 'webhook':
+            from app.bot.webhook import WebhookServer
+
+            secret = os.getenv('WEBHOOK_SECRET', '')
+            if not secret:
+                raise ValueError("WEBHOOK_SECRET не установлен в переменных окружения (нужен в режиме webhook)")
+            server = WebhookServer(
+                bot, secret, supervisor.route,
+                path=os.getenv('WEBHOOK_PATH', '/telegram/webhook'),
+                host=os.getenv('WEBHOOK_HOST', '0.0.0.0'),
+                port=int(os.getenv('WEBHOOK_PORT', '8080')),
+                public_url=os.getenv('WEBHOOK_URL') or None,
+                max_connections=int(os.getenv('UPDATE_CONCURRENCY', '32')) * supervisor.count,
+            )
+            await server.run(stop_event)
+        else:
+            await poll_updates(bot, supervisor, stop_event)
+    finally:
+        stop_event.set()
+        await watcher
+        await supervisor.stop()
+        await bot.session.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Супервизор процессов Telegram-бота")
+    parser.add_argument('--processes', type=int, default=int(os.getenv('BOT_PROCESSES', '0')) or os.cpu_count() or 1)
+    parser.add_argument('--queue-size', type=int, default=int(os.getenv('SUPERVISOR_QUEUE_SIZE', '256')),
+                        help="сколько неподтверждённых апдейтов может ждать один процесс бота")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(run(args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
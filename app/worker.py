@@ -0,0 +1,60 @@
+"""Отдельный процесс-воркер очереди генерации заказов.
+
+Пример:
+    python -m app.worker --threads 2
+
+Воркер берёт задания из таблицы jobs (см. ORDER_QUEUE в app/bot/main.py), генерирует
+заказы и сохраняет результат в Postgres; пользователю его отправляет бот.
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+import threading
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+
+logger = logging.getLogger(__name__)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Воркер очереди генерации заказов")
+    parser.add_argument('--threads', type=int, default=int(os.getenv('ORDER_WORKERS', '1')) or 1)
+    parser.add_argument('--poll-interval', type=float, default=float(os.getenv('JOB_POLL_INTERVAL', '5')))
+    parser.add_argument('--job-timeout', type=float, default=float(os.getenv('JOB_TIMEOUT', '600')))
+    parser.add_argument('--retention-hours', type=float, default=float(os.getenv('JOB_RETENTION_HOURS', '168')),
+                        help="сколько хранить доставленные задания")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    from app.core.blob_store import BlobStore
+    from app.core.db import Database
+    from app.managers.price_index_manager import PriceIndexManager
+    from app.scheduler.order_jobs import OrderJobWorker
+
+    Database.get_instance().migrate()
+    price_indexes = PriceIndexManager(BlobStore(Path('uploads') / 'blobs'))
+    workers = [OrderJobWorker(price_indexes, poll_interval=args.poll_interval, job_timeout=args.job_timeout,
+                              retention=args.retention_hours * 3600)
+               for _ in range(max(1, args.threads))]
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    for worker in workers:
+        worker.start()
+    logger.info(f"Воркеров очереди заказов: {len(workers)}")
+    stop.wait()
+    # Текущие задания дорабатывают в потоках-демонах; незавершённые вернутся в очередь по таймауту
+    for worker in workers:
+        worker.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,9 @@
 import asyncio
 
-from app.bot.main import main
-
 
 if __name__ == "__main__":
+    # Импорт внутри: процессы пула генерации (spawn) импортируют этот модуль и не должны поднимать бота
+    from app.bot.main import main
+
     asyncio.run(main())
 
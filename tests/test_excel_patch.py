@@ -0,0 +1,125 @@
+"""Запись заказа прямо в XML листа против эталонной записи через openpyxl"""
+import io
+import zipfile
+
+import pytest
+
+openpyxl = pytest.importorskip("openpyxl")
+
+from openpyxl.styles import Font, PatternFill
+
+from app.excel.excel_processor import ExcelProcessor, patch_xlsx_numbers
+from app.excel.price_index import PriceIndex
+
+
+def make_template() -> bytes:
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Прайс"
+    ws.append(["Артикул", "Название", "Цена", "Кол-во", "Сумма"])
+    ws.append(["A-1", "Болт", 10.0, None, None])
+    ws.append(["A-2", "Гайка", 2.5, "шт", None])
+    ws.append(["A-3", "Шайба", 1.0, 0, 0])
+    ws["A6"] = "A-6"
+    ws["C6"] = 4.0
+    ws["A8"] = "Итого"
+    ws["E8"] = "=SUM(E2:E7)"
+    # Пустые ячейки заказа оформлены заранее — стиль должен сохраниться
+    for row in range(2, 8):
+        ws.cell(row, 4).fill = PatternFill("solid", fgColor="FFFF00")
+    ws["E2"].font = Font(bold=True)
+    ws.column_dimensions["B"].width = 30
+    wb.create_sheet("Справочник")["A1"] = "не трогать"
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def snapshot(xlsx: bytes):
+    wb = openpyxl.load_workbook(io.BytesIO(xlsx))
+    cells = {}
+    for ws in wb.worksheets:
+        for row in ws.iter_rows():
+            for cell in row:
+                if cell.value is not None or cell.has_style:
+                    cells[(ws.title, cell.coordinate)] = (cell.value, cell.fill.fgColor.rgb, cell.font.b,
+                                                          cell.number_format)
+    return cells
+
+
+def render_both(template: bytes, updates):
+    xml = io.BytesIO()
+    ExcelProcessor(template).apply_updates(xml, updates)
+    reference = io.BytesIO()
+    ExcelProcessor(template).apply_updates_with_openpyxl(reference, updates)
+    return xml.getvalue(), reference.getvalue()
+
+
+@pytest.mark.parametrize("updates", [
+    {"D2": 3.0, "E2": 30.0},
+    # Строковая ячейка, существующие нули, ячейки в пропущенных строке и столбце
+    {"D3": 4.0, "E3": 10.0, "D4": 1.5, "E4": 1.5, "D6": 2.0, "E6": 8.0, "D5": 7.0, "G2": 1.0},
+    {},
+])
+def test_xml_patch_matches_openpyxl(updates):
+    template = make_template()
+
+    xml, reference = render_both(template, updates)
+
+    assert patch_xlsx_numbers(template, 0, updates) == xml
+    assert snapshot(xml) == snapshot(reference)
+
+
+def test_xml_patch_keeps_sheet_markup_and_forces_recalculation():
+    template = make_template()
+
+    patched = patch_xlsx_numbers(template, 0, {"D2": 3.0, "D9": 1.0})
+
+    with zipfile.ZipFile(io.BytesIO(template)) as zf:
+        original_sheet = zf.read("xl/worksheets/sheet1.xml")
+        original_other = zf.read("xl/worksheets/sheet2.xml")
+    with zipfile.ZipFile(io.BytesIO(patched)) as zf:
+        sheet = zf.read("xl/worksheets/sheet1.xml")
+        workbook = zf.read("xl/workbook.xml")
+        other = zf.read("xl/worksheets/sheet2.xml")
+    # Всё до sheetData (корневой элемент с пространствами имён, столбцы) — как в шаблоне,
+    # кроме расширенной области листа
+    assert b'ref="A1:E9"' in sheet
+    head = sheet[:sheet.index(b"<sheetData")]
+    assert head.replace(b"A1:E9", b"A1:E8") == original_sheet[:original_sheet.index(b"<sheetData")]
+    assert b'fullCalcOnLoad="1"' in workbook
+    assert other == original_other
+
+
+def test_formula_cell_falls_back_to_openpyxl():
+    template = make_template()
+
+    assert patch_xlsx_numbers(template, 0, {"E8": 100.0}) is None
+    xml, reference = render_both(template, {"E8": 100.0})
+    assert snapshot(xml) == snapshot(reference)
+
+
+def test_sheet_is_resolved_through_workbook_relationships():
+    wb = openpyxl.Workbook()
+    wb.active.title = "Первый"
+    wb.create_sheet("Второй")
+    # Второй лист переносится в начало: его XML остаётся sheet2.xml
+    wb.move_sheet("Второй", offset=-1)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+
+    patched = patch_xlsx_numbers(buffer.getvalue(), 0, {"B2": 5.0})
+
+    assert openpyxl.load_workbook(io.BytesIO(patched))["Второй"]["B2"].value == 5
+
+
+def test_cell_map_is_cached_per_column():
+    index = PriceIndex.from_rows([["Артикул"], ["A-1"], ["A-2"]], article_col=0, start_row=1)
+
+    refs = index.cell_refs(3)
+
+    assert refs == ["D2", "D3"]
+    assert index.cell_refs(3) is refs
+    assert index.compute_updates({"A-2": 2}, 3) == {"D3": 2.0}
+    index.append(5, "A-5", 0.0)
+    assert index.cell_refs(3) == ["D2", "D3", "D6"]
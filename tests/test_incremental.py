@@ -0,0 +1,165 @@
+"""IncrementalOrderSession: каждый путь перегенерации даёт тот же заказ, что и полная генерация"""
+import hashlib
+import io
+
+import pytest
+
+openpyxl = pytest.importorskip("openpyxl")
+
+from openpyxl.styles import PatternFill
+
+from app.excel import incremental
+from app.excel.incremental import MAX_PARSED_INPUTS, IncrementalOrderSession
+from app.excel.order_generator import OrderGenerator
+
+PRICE_CONFIG = {'start_row': 1, 'article_col': 0, 'price_col': 2, 'quantity_col': 3, 'sum_col': 4}
+CONFIG = {
+    'price_list': PRICE_CONFIG,
+    # Склад читается по столбцам прайса: артикул в A, количество в D
+    'warehouse_order': {},
+    'preorders': {'article_col': 0, 'article_col2': 1, 'quantity_col': 2},
+}
+
+
+def xlsx(rows) -> bytes:
+    wb = openpyxl.Workbook()
+    for row in rows:
+        wb.active.append(row)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def sha(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+@pytest.fixture
+def price_file(tmp_path):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["Артикул", "Название", "Цена", "Кол-во", "Сумма"])
+    ws.append(["A-1", "Болт", 10.0])
+    ws.append(["A-2", "Гайка", 2.5, "шт"])
+    ws.append(["A-3", "Шайба", 1.0, 0, 0])
+    ws.append(["A-4", "Винт", 4.0])
+    ws["A7"] = "Итого"
+    ws["E7"] = "=SUM(E2:E6)"
+    for row in range(2, 6):
+        ws.cell(row, 4).fill = PatternFill("solid", fgColor="FFFF00")
+    path = tmp_path / "price.xlsx"
+    wb.save(path)
+    return str(path)
+
+
+def warehouse(**quantities) -> bytes:
+    return xlsx([["Артикул", None, None, "Кол-во"]]
+                + [[article.replace("_", "-"), None, None, qty] for article, qty in quantities.items()])
+
+
+def preorders(**quantities) -> bytes:
+    return xlsx([["Артикул", "Артикул 2", "Кол-во"]]
+                + [[article.replace("_", "-"), None, qty] for article, qty in quantities.items()])
+
+
+def snapshot(xlsx_bytes: bytes):
+    wb = openpyxl.load_workbook(io.BytesIO(xlsx_bytes))
+    return {(ws.title, cell.coordinate): (cell.value, cell.fill.fgColor.rgb)
+            for ws in wb.worksheets for row in ws.iter_rows() for cell in row
+            if cell.value is not None or cell.has_style}
+
+
+def fresh_order(price_file: str, warehouse_bytes: bytes, preorders_bytes: bytes) -> bytes:
+    buffer = io.BytesIO()
+    OrderGenerator(PRICE_CONFIG).generate_order(price_file, warehouse_bytes, preorders_bytes, buffer,
+                                                CONFIG['warehouse_order'], CONFIG['preorders'])
+    return buffer.getvalue()
+
+
+def generate(session: IncrementalOrderSession, warehouse_bytes: bytes, preorders_bytes: bytes) -> bytes:
+    output, _ = session.generate(warehouse_bytes, sha(warehouse_bytes), preorders_bytes, sha(preorders_bytes))
+    return output
+
+
+def assert_same_as_fresh(session, price_file, warehouse_bytes, preorders_bytes, mode):
+    output = generate(session, warehouse_bytes, preorders_bytes)
+    assert session.last_mode == mode
+    assert snapshot(output) == snapshot(fresh_order(price_file, warehouse_bytes, preorders_bytes))
+    return output
+
+
+def test_first_generation_is_full(price_file):
+    session = IncrementalOrderSession("Поставщик", CONFIG, price_file)
+
+    assert_same_as_fresh(session, price_file, warehouse(A_1=2), preorders(A_2=3), 'full')
+
+
+def test_unchanged_inputs_reuse_previous_output(price_file):
+    session = IncrementalOrderSession("Поставщик", CONFIG, price_file)
+    first = generate(session, warehouse(A_1=2), preorders(A_2=3))
+
+    # Другие файлы с тем же итогом заказа — прежний результат возвращается как есть
+    second = assert_same_as_fresh(session, price_file, warehouse(A_1=1), preorders(A_1=1, A_2=3), 'unchanged')
+
+    assert second is first
+
+
+def test_changed_quantities_are_patched_in_xml(price_file):
+    session = IncrementalOrderSession("Поставщик", CONFIG, price_file)
+    generate(session, warehouse(A_1=2), preorders(A_2=3))
+
+    # Изменилось количество и добавился артикул (ячейки, которых не было в прошлом заказе)
+    assert_same_as_fresh(session, price_file, warehouse(A_1=5, A_4=1), preorders(A_2=3), 'xml-patch')
+
+
+def test_openpyxl_patch_of_previous_output(price_file, monkeypatch):
+    session = IncrementalOrderSession("Поставщик", CONFIG, price_file)
+    generate(session, warehouse(A_1=2), preorders(A_2=3))
+    monkeypatch.setattr(incremental, "patch_xlsx_numbers", lambda *args: None)
+
+    assert_same_as_fresh(session, price_file, warehouse(A_1=5, A_3=2), preorders(A_2=3), 'patch')
+
+
+def test_removed_article_falls_back_to_full_render(price_file):
+    session = IncrementalOrderSession("Поставщик", CONFIG, price_file)
+    generate(session, warehouse(A_1=2, A_3=4), preorders(A_2=3))
+
+    # A-2 ушёл из заказа: в D3 должно вернуться значение шаблона («шт»), а не 3
+    output = assert_same_as_fresh(session, price_file, warehouse(A_1=2, A_3=4), preorders(), 'full')
+
+    assert snapshot(output)[("Sheet", "D3")][0] == "шт"
+
+
+def test_each_changed_input_is_parsed_once(price_file, monkeypatch):
+    session = IncrementalOrderSession("Поставщик", CONFIG, price_file)
+    calls = []
+    read_warehouse = session.generator.read_warehouse_order
+    monkeypatch.setattr(session.generator, "read_warehouse_order",
+                        lambda source, config: calls.append(source) or read_warehouse(source, config))
+    warehouse_bytes = warehouse(A_1=2)
+
+    generate(session, warehouse_bytes, preorders(A_2=3))
+    # Исправлены только предзаказы: склад берётся из кэша по хэшу, источник не нужен
+    session.generate(None, sha(warehouse_bytes), preorders(A_2=4), sha(preorders(A_2=4)))
+
+    assert calls == [warehouse_bytes]
+
+
+def test_parsed_inputs_are_evicted_at_limit(price_file):
+    session = IncrementalOrderSession("Поставщик", CONFIG, price_file)
+    preorders_bytes = preorders()
+    warehouses = [warehouse(A_1=n) for n in range(1, MAX_PARSED_INPUTS + 1)]
+
+    for warehouse_bytes in warehouses[:-1]:
+        session.prefetch('warehouse', warehouse_bytes, sha(warehouse_bytes))
+    session.prefetch('preorders', preorders_bytes, sha(preorders_bytes))
+    assert len(session.parsed) == MAX_PARSED_INPUTS
+    # Обращение к самому старому входу делает его свежим — вытесняется следующий
+    session.prefetch('warehouse', warehouses[0], sha(warehouses[0]))
+    session.prefetch('warehouse', warehouses[-1], sha(warehouses[-1]))
+
+    assert len(session.parsed) == MAX_PARSED_INPUTS
+    assert session.has_parsed('warehouse', sha(warehouses[0]))
+    assert not session.has_parsed('warehouse', sha(warehouses[1]))
+    assert session.has_parsed('warehouse', sha(warehouses[-1]))
+    assert session.has_parsed('preorders', sha(preorders_bytes))
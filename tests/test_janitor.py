@@ -0,0 +1,144 @@
+"""Очистка uploads/ и outputs/: возраст, квота и файлы, которые удалять нельзя"""
+import asyncio
+import os
+import time
+
+import pytest
+
+pytest.importorskip("psycopg")
+
+from app.scheduler.janitor import MIN_FILE_AGE, CleanupRule, StorageJanitor
+
+DAY = 24 * 3600
+
+
+class FakeConfigManager:
+    def __init__(self, configs=None):
+        self.configs = configs or {}
+
+    def list_suppliers(self):
+        return list(self.configs)
+
+    def get_supplier_config(self, name):
+        return self.configs.get(name)
+
+
+def make_file(path, age: float, size: int = 100) -> str:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def run_cleanup(janitor: StorageJanitor):
+    return asyncio.run(janitor.run_once())
+
+
+def test_age_rule_keeps_referenced_and_young_files(tmp_path):
+    old = make_file(tmp_path / "old.xlsx", age=40 * DAY)
+    young = make_file(tmp_path / "young.xlsx", age=MIN_FILE_AGE / 2)
+    price = make_file(tmp_path / "price.xlsx", age=40 * DAY)
+    index = make_file(tmp_path / "price.abc.pidx", age=40 * DAY)
+    session_file = make_file(tmp_path / "blobs" / "ab" / "session.xlsx", age=40 * DAY)
+    configs = {"Альфа": {'price_file': price, 'price_index': {'path': index}}}
+    janitor = StorageJanitor(FakeConfigManager(configs), [CleanupRule(tmp_path, max_age_seconds=0)],
+                             extra_references=lambda: [session_file])
+
+    report = run_cleanup(janitor)
+
+    assert not os.path.exists(old)
+    assert all(os.path.exists(p) for p in (young, price, index, session_file))
+    assert report.removed_files == 1
+    assert report.kept_referenced == 3
+
+
+def test_files_within_max_age_are_kept(tmp_path):
+    recent = make_file(tmp_path / "recent.xlsx", age=DAY)
+    janitor = StorageJanitor(FakeConfigManager(), [CleanupRule(tmp_path, max_age_seconds=30 * DAY)])
+
+    assert run_cleanup(janitor).removed_files == 0
+    assert os.path.exists(recent)
+
+
+def test_quota_removes_oldest_files_first(tmp_path):
+    files = [make_file(tmp_path / f"{i}.xlsx", age=(10 - i) * DAY, size=100) for i in range(5)]
+    referenced = make_file(tmp_path / "referenced.xlsx", age=20 * DAY, size=100)
+    young = make_file(tmp_path / "young.xlsx", age=0, size=100)
+    # 7 файлов по 100 байт при квоте 500: удаляются два самых старых из неиспользуемых
+    janitor = StorageJanitor(FakeConfigManager({"Альфа": {'price_template': referenced}}),
+                             [CleanupRule(tmp_path, max_total_bytes=500)])
+
+    report = run_cleanup(janitor)
+
+    assert [os.path.exists(p) for p in files] == [False, False, True, True, True]
+    assert os.path.exists(referenced) and os.path.exists(young)
+    assert report.reclaimed_bytes == 200
+
+
+def test_quota_stops_when_only_protected_files_remain(tmp_path):
+    young = [make_file(tmp_path / f"young{i}.xlsx", age=0, size=100) for i in range(3)]
+    janitor = StorageJanitor(FakeConfigManager(), [CleanupRule(tmp_path, max_total_bytes=50)])
+
+    assert run_cleanup(janitor).removed_files == 0
+    assert all(os.path.exists(p) for p in young)
+
+
+def test_on_run_is_called_before_references_are_collected(tmp_path):
+    calls = []
+    janitor = StorageJanitor(FakeConfigManager(), [CleanupRule(tmp_path / "missing", max_age_seconds=0)],
+                             extra_references=lambda: calls.append('refs') or [],
+                             on_run=lambda: calls.append('sweep'))
+
+    run_cleanup(janitor)
+
+    assert calls == ['sweep', 'refs']
+
+
+def test_release_skips_referenced_files(tmp_path):
+    temporary = make_file(tmp_path / "tmp.xlsx", age=0)
+    price = make_file(tmp_path / "price.xlsx", age=0)
+    shared = make_file(tmp_path / "shared.xlsx", age=0)
+    janitor = StorageJanitor(FakeConfigManager({"Альфа": {'price_file': price}}), [],
+                             extra_references=lambda: [shared])
+
+    removed = janitor.release([temporary, price, shared, str(tmp_path / "gone.xlsx"), None])
+
+    assert removed == 1
+    assert not os.path.exists(temporary)
+    assert os.path.exists(price) and os.path.exists(shared)
+
+
+def test_release_keeps_everything_when_references_are_unknown(tmp_path):
+    temporary = make_file(tmp_path / "tmp.xlsx", age=0)
+
+    class BrokenConfigManager(FakeConfigManager):
+        def list_suppliers(self):
+            raise ConnectionError("база недоступна")
+
+    janitor = StorageJanitor(BrokenConfigManager(), [])
+
+    assert janitor.release([temporary]) == 0
+    assert os.path.exists(temporary)
+
+
+def test_release_keeps_recently_touched_files(tmp_path):
+    # Blob, только что совпавший с загрузкой другого процесса, ещё не виден в общем хранилище сессий
+    fresh = make_file(tmp_path / "fresh.xlsx", age=MIN_FILE_AGE / 2)
+    stale = make_file(tmp_path / "stale.xlsx", age=MIN_FILE_AGE * 2)
+    janitor = StorageJanitor(FakeConfigManager(), [], release_min_age=MIN_FILE_AGE)
+
+    assert janitor.release([fresh, stale]) == 1
+    assert os.path.exists(fresh) and not os.path.exists(stale)
+
+
+def test_reupload_refreshes_blob_age(tmp_path):
+    from app.core.blob_store import BlobStore
+
+    store = BlobStore(tmp_path / "blobs")
+    path, _ = store.put_bytes(b"price")
+    old = time.time() - 40 * DAY
+    os.utime(path, (old, old))
+
+    assert store.put_bytes(b"price")[0] == path
+    assert time.time() - os.stat(path).st_mtime < MIN_FILE_AGE
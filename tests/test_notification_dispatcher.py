@@ -0,0 +1,159 @@
+"""NotificationDispatcher против локальной фейковой сессии Bot API (без сети)"""
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, Message
+
+from app.scheduler.dispatcher import NotificationDispatcher
+
+
+class FakeSession(BaseSession):
+    """Отвечает на sendMessage локально и запоминает, когда и куда шли запросы.
+
+    failures — {chat_id: [исключение или None, ...]}: очередной запрос в чат завершается
+    следующим исключением из списка (None — успех).
+    """
+
+    def __init__(self, delay: float = 0.0, failures=None):
+        super().__init__()
+        self.delay = delay
+        self.failures = failures or {}
+        self.requests = []
+        self.rejected = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        assert isinstance(method, SendMessage)
+        self.requests.append((method.chat_id, time.monotonic()))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            planned = self.failures.get(method.chat_id)
+            if planned:
+                error = planned.pop(0)
+                if error is not None:
+                    self.rejected.append((method.chat_id, time.monotonic()))
+                    raise error(method)
+            return Message(message_id=len(self.requests), date=datetime.now(),
+                           chat=Chat(id=method.chat_id, type="private"), text=method.text)
+        finally:
+            self.in_flight -= 1
+
+    async def stream_content(self, *args, **kwargs):
+        raise NotImplementedError
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def retry_after(seconds: int):
+    return lambda method: TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=seconds)
+
+
+def forbidden(method):
+    return TelegramForbiddenError(method=method, message="Forbidden: bot was blocked by the user")
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def make_dispatcher(session: FakeSession, **kwargs) -> NotificationDispatcher:
+    kwargs.setdefault("global_rate", 1000.0)
+    kwargs.setdefault("per_chat_rate", 1000.0)
+    return NotificationDispatcher(Bot(token="42:TEST", session=session), **kwargs)
+
+
+def test_concurrency_is_limited():
+    session = FakeSession(delay=0.05)
+    dispatcher = make_dispatcher(session, concurrency=3)
+
+    result = run(dispatcher.broadcast(range(1, 11), "напоминание"))
+
+    assert sorted(result.sent) == list(range(1, 11))
+    assert session.max_in_flight == 3
+
+
+def test_messages_to_one_chat_are_spaced():
+    session = FakeSession()
+    dispatcher = make_dispatcher(session, per_chat_rate=5.0)
+
+    async def scenario():
+        await asyncio.gather(*(dispatcher.broadcast([7], f"сообщение {i}") for i in range(3)))
+
+    run(scenario())
+
+    times = [at for chat_id, at in session.requests if chat_id == 7]
+    assert len(times) == 3
+    # 5 сообщений в секунду в один чат — не чаще раза в 0.2 с (с небольшим допуском таймера)
+    assert all(b - a >= 0.18 for a, b in zip(times, times[1:]))
+
+
+def test_other_chats_are_not_delayed_by_per_chat_limit():
+    session = FakeSession()
+    dispatcher = make_dispatcher(session, per_chat_rate=1.0)
+
+    started = time.monotonic()
+    result = run(dispatcher.broadcast(range(1, 21), "напоминание"))
+
+    assert len(result.sent) == 20
+    assert time.monotonic() - started < 0.5
+
+
+def test_retry_after_is_respected():
+    session = FakeSession(failures={5: [retry_after(1), None]})
+    dispatcher = make_dispatcher(session)
+
+    result = run(dispatcher.broadcast([5, 6], "напоминание"))
+
+    assert sorted(result.sent) == [5, 6]
+    attempts = [at for chat_id, at in session.requests if chat_id == 5]
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.95
+
+
+def test_retry_after_pauses_every_sender():
+    session = FakeSession(delay=0.05, failures={1: [retry_after(1), None]})
+    dispatcher = make_dispatcher(session, concurrency=2)
+
+    result = run(dispatcher.broadcast(range(1, 7), "напоминание"))
+
+    assert sorted(result.sent) == list(range(1, 7))
+    (_, rejected_at), = session.rejected
+    # Запросы, начатые после flood control, — в любые чаты — ждут всю паузу
+    later = [at for _, at in session.requests if at > rejected_at]
+    assert len(later) == len(session.requests) - 2
+    assert all(at - rejected_at >= 0.95 for at in later)
+
+
+def test_retry_after_gives_up_after_max_retries():
+    session = FakeSession(failures={5: [retry_after(0), retry_after(0), retry_after(0)]})
+    dispatcher = make_dispatcher(session, max_retries=2)
+
+    result = run(dispatcher.broadcast([5], "напоминание"))
+
+    assert result.failed == [5]
+    assert len(session.requests) == 3
+
+
+def test_blocked_user_is_reported_unreachable():
+    session = FakeSession(failures={9: [forbidden]})
+    dispatcher = make_dispatcher(session)
+
+    result = run(dispatcher.broadcast([8, 9], "напоминание"))
+
+    assert result.sent == [8]
+    assert result.failed == [9]
+    assert result.unreachable == {9}
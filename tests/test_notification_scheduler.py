@@ -0,0 +1,107 @@
+"""NotificationScheduler: смена ведущей реплики посреди рассылки"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+from app.scheduler import notification_scheduler
+from app.scheduler.dispatcher import NotificationDispatcher
+from app.scheduler.notification_scheduler import NotificationScheduler
+
+
+class FakeBot:
+    def __init__(self, events):
+        self.events = events
+
+    async def send_message(self, chat_id, text):
+        self.events.append(('send', chat_id))
+
+
+class FakeLeader:
+    """Ведущая, пока не исчерпан запас успешных проверок ensure()."""
+
+    def __init__(self, checks: int):
+        self.checks = checks
+        self.is_leader = True
+
+    def ensure(self) -> bool:
+        self.checks -= 1
+        self.is_leader = self.checks >= 0
+        return self.is_leader
+
+    def release(self):
+        self.is_leader = False
+
+
+class FakeConfigManager:
+    def __init__(self, events, suppliers):
+        self.events = events
+        self.suppliers = suppliers
+
+    def list_suppliers(self):
+        return list(self.suppliers)
+
+    def get_supplier_config(self, name):
+        return {'notification': {'type': 'days', 'interval': 1}}
+
+    def set_notification_time(self, name, sent_at):
+        self.events.append(('saved', name))
+
+
+class FakeUserManager:
+    def __init__(self, users):
+        self.users = set(users)
+
+    def get_all_users(self):
+        return set(self.users)
+
+    def remove_users(self, user_ids):
+        self.users -= set(user_ids)
+        return len(user_ids)
+
+
+def make_scheduler(events, users, leader, suppliers=('Альфа', 'Бета')):
+    bot = FakeBot(events)
+    scheduler = NotificationScheduler(bot, FakeConfigManager(events, suppliers), FakeUserManager(users),
+                                      leader=leader)
+    scheduler.dispatcher = NotificationDispatcher(bot, global_rate=10000.0, per_chat_rate=10000.0)
+    return scheduler
+
+
+@pytest.fixture(autouse=True)
+def small_batches(monkeypatch):
+    monkeypatch.setattr(notification_scheduler, "BROADCAST_BATCH", 10)
+
+
+def test_times_are_saved_before_sending():
+    events = []
+    scheduler = make_scheduler(events, range(1, 26), FakeLeader(checks=100))
+
+    asyncio.run(scheduler.check_and_send_notifications())
+
+    assert events[:2] == [('saved', 'Альфа'), ('saved', 'Бета')]
+    assert sorted(chat for kind, chat in events if kind == 'send') == list(range(1, 26))
+
+
+def test_broadcast_stops_when_lease_is_lost():
+    events = []
+    # Лидерство подтверждается перед второй порцией и теряется перед третьей
+    scheduler = make_scheduler(events, range(1, 26), FakeLeader(checks=1))
+
+    asyncio.run(scheduler.check_and_send_notifications())
+
+    sent = sorted(chat for kind, chat in events if kind == 'send')
+    assert sent == list(range(1, 21))
+    assert ('saved', 'Альфа') in events and ('saved', 'Бета') in events
+
+
+def test_separate_notifications_stop_after_lease_is_lost():
+    events = []
+    scheduler = make_scheduler(events, range(1, 16), FakeLeader(checks=0))
+    scheduler.digest = False
+
+    asyncio.run(scheduler.check_and_send_notifications())
+
+    # Первая порция первого напоминания ушла, остальное — уже задача новой ведущей
+    assert len([e for e in events if e[0] == 'send']) == 10
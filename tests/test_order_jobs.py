@@ -0,0 +1,244 @@
+"""Жизненный цикл задания очереди заказов: claim -> finish -> claim_finished -> доставка.
+
+Тесты идут против FakeJobsDatabase (модель SQL из app/core/db.py в памяти) и, если задана
+переменная TEST_DATABASE_URL, ещё и против настоящего Postgres. Таблица jobs тестовой
+базы очищается перед каждым тестом.
+"""
+import asyncio
+import os
+import time
+
+import pytest
+
+pytest.importorskip("psycopg")
+pytest.importorskip("openpyxl")
+
+from app.core.db import Database
+from app.scheduler import order_jobs
+from app.scheduler.order_jobs import JobResultDispatcher, OrderJobQueue, OrderJobWorker
+
+_JOB_FIELDS = ("id", "status", "user_id", "chat_id", "supplier", "payload", "attempts")
+
+
+class FakeJobsDatabase:
+    """Таблица jobs в памяти с той же семантикой, что и запросы jobs_* в Database."""
+
+    def __init__(self):
+        self.jobs = {}
+
+    @staticmethod
+    def _now() -> float:
+        return time.monotonic()
+
+    def _public(self, job, *extra):
+        return {key: job[key] for key in _JOB_FIELDS + extra}
+
+    def jobs_enqueue(self, user_id, chat_id, supplier, payload, warehouse, preorders, price=None):
+        job_id = len(self.jobs) + 1
+        self.jobs[job_id] = dict(
+            id=job_id, status='queued', user_id=user_id, chat_id=chat_id, supplier=supplier, payload=payload,
+            attempts=0, worker=None, started_at=None, price=price, warehouse=warehouse, preorders=preorders,
+            result=None, quantities=None, diagnostics=None, error=None, finished_at=None,
+            deliver_after=None, delivery_attempts=0, delivered_at=None,
+        )
+        return job_id
+
+    def jobs_claim(self, worker):
+        queued = [job for job in self.jobs.values() if job['status'] == 'queued']
+        if not queued:
+            return None
+        job = min(queued, key=lambda j: j['id'])
+        job.update(status='running', attempts=job['attempts'] + 1, worker=worker, started_at=self._now())
+        return self._public(job, 'price', 'warehouse', 'preorders')
+
+    def jobs_finish(self, job_id, worker, attempt, result=None, quantities=None, diagnostics=None, error=None):
+        job = self.jobs[job_id]
+        if job['status'] != 'running' or job['worker'] != worker or job['attempts'] != attempt:
+            return False
+        job.update(status='failed' if error is not None else 'done', result=result, quantities=quantities,
+                   diagnostics=diagnostics, error=error, finished_at=self._now(),
+                   price=None, warehouse=None, preorders=None)
+        return True
+
+    def jobs_requeue_stale(self, timeout_seconds, max_attempts):
+        requeued = 0
+        for job in self.jobs.values():
+            if job['status'] == 'running' and job['started_at'] < self._now() - timeout_seconds:
+                if job['attempts'] >= max_attempts:
+                    job.update(status='failed', error='превышено число попыток', finished_at=self._now())
+                else:
+                    job['status'] = 'queued'
+                requeued += 1
+        return requeued
+
+    def jobs_claim_finished(self, limit=20, shard=None, lease_seconds=300):
+        claimed = []
+        for job in sorted(self.jobs.values(), key=lambda j: j['id']):
+            if len(claimed) == limit:
+                break
+            if job['status'] not in ('done', 'failed') or job['delivered_at'] is not None:
+                continue
+            if job['deliver_after'] is not None and job['deliver_after'] > self._now():
+                continue
+            if shard and abs(job['user_id']) % shard[1] != shard[0]:
+                continue
+            job.update(deliver_after=self._now() + lease_seconds, delivery_attempts=job['delivery_attempts'] + 1)
+            claimed.append(self._public(job, 'delivery_attempts', 'result', 'quantities', 'diagnostics', 'error'))
+        return claimed
+
+    def jobs_mark_delivered(self, job_id):
+        self.jobs[job_id].update(delivered_at=self._now(), deliver_after=None, result=None)
+
+    def jobs_retry_delivery(self, job_id, delay_seconds):
+        self.jobs[job_id]['deliver_after'] = self._now() + delay_seconds
+
+
+@pytest.fixture(params=["fake", "postgres"])
+def database(request, monkeypatch):
+    if request.param == "fake":
+        db = FakeJobsDatabase()
+    else:
+        dsn = os.getenv("TEST_DATABASE_URL")
+        if not dsn:
+            pytest.skip("TEST_DATABASE_URL не задан")
+        db = Database(dsn)
+        db.migrate()
+        with db.connection() as conn:
+            conn.execute("DELETE FROM jobs")
+    monkeypatch.setattr(Database, "get_instance", classmethod(lambda cls: db))
+    return db
+
+
+class FakeGenerator:
+    """Вместо разбора Excel — фиксированный результат (тест про очередь, а не про генерацию)."""
+
+    def __init__(self, price_config):
+        self.last_diagnostics = {'warehouse': {'total_items_found': 1}}
+
+    def generate_order(self, price_source, warehouse, preorders, output, *args, **kwargs):
+        output.write(b"order:" + warehouse)
+        return {"AB-100": 2.0}
+
+
+@pytest.fixture(autouse=True)
+def fake_generator(monkeypatch):
+    monkeypatch.setattr(order_jobs, "OrderGenerator", FakeGenerator)
+
+
+CONFIG = {'price_list': {}, 'warehouse_order': {}, 'preorders': {}}
+HASHES = {'price_sha256': "p", 'warehouse_sha256': "w", 'preorders_sha256': "o"}
+
+
+def enqueue(user_id: int = 7, warehouse: bytes = b"w") -> int:
+    return OrderJobQueue().enqueue(user_id, user_id, "Альфа", CONFIG, HASHES, "order.xlsx",
+                                   warehouse, b"o", price=b"price")
+
+
+def make_worker(name: str) -> OrderJobWorker:
+    return OrderJobWorker(price_indexes=None, worker_id=name)
+
+
+def test_job_is_generated_delivered_once_and_marked(database):
+    job_id = enqueue()
+    worker = make_worker("w1")
+
+    assert worker.run_once()
+    assert not worker.run_once()
+
+    delivered = []
+
+    async def deliver(job):
+        delivered.append(job)
+
+    dispatcher = JobResultDispatcher(deliver)
+    jobs = database.jobs_claim_finished()
+    assert [job['id'] for job in jobs] == [job_id]
+    asyncio.run(dispatcher._deliver_one(jobs[0]))
+
+    assert delivered[0]['status'] == 'done'
+    assert delivered[0]['result'] == b"order:w"
+    assert delivered[0]['quantities'] == {"AB-100": 2.0}
+    assert database.jobs_claim_finished(lease_seconds=0) == []
+
+
+def test_stale_worker_is_fenced_out(database):
+    job_id = enqueue()
+    stale, fresh = make_worker("stale"), make_worker("fresh")
+    stale_job = database.jobs_claim(stale.worker_id)
+
+    # Воркер «завис»: задание вернули в очередь, и его взял другой
+    assert database.jobs_requeue_stale(0, max_attempts=3) == 1
+    fresh_job = database.jobs_claim(fresh.worker_id)
+    assert fresh_job['id'] == job_id and fresh_job['attempts'] == 2
+
+    fresh.process(fresh_job)
+    assert not database.jobs_finish(job_id, stale.worker_id, stale_job['attempts'], b"stale", {})
+    # Той же попытки, но от чужого воркера, результат тоже не принимается
+    assert not database.jobs_finish(job_id, stale.worker_id, fresh_job['attempts'], b"stale", {})
+
+    (job,) = database.jobs_claim_finished()
+    assert job['result'] == b"order:w"
+
+
+def test_job_fails_after_max_attempts(database):
+    enqueue()
+    for attempt in range(1, 3):
+        assert database.jobs_claim(f"w{attempt}")['attempts'] == attempt
+        database.jobs_requeue_stale(0, max_attempts=2)
+
+    assert database.jobs_claim("w3") is None
+    (job,) = database.jobs_claim_finished()
+    assert job['status'] == 'failed'
+    assert job['error'] == 'превышено число попыток'
+
+
+def test_claimed_result_is_leased(database):
+    enqueue()
+    make_worker("w1").run_once()
+
+    assert len(database.jobs_claim_finished(lease_seconds=300)) == 1
+    # Пока аренда действует, другая реплика задание не получит
+    assert database.jobs_claim_finished() == []
+
+
+def test_failed_delivery_is_retried_with_backoff_then_dropped(database):
+    enqueue()
+    make_worker("w1").run_once()
+    delays = []
+    retry_delivery = database.jobs_retry_delivery
+
+    def record_retry(job_id, delay):
+        delays.append(delay)
+        retry_delivery(job_id, 0)
+
+    database.jobs_retry_delivery = record_retry
+    attempts = []
+
+    async def deliver(job):
+        attempts.append(job['delivery_attempts'])
+        raise ConnectionError("Telegram недоступен")
+
+    dispatcher = JobResultDispatcher(deliver, retry_delay=10, max_delivery_attempts=3)
+
+    async def scenario():
+        for _ in range(5):
+            for job in await asyncio.to_thread(database.jobs_claim_finished):
+                await dispatcher._deliver_one(job)
+
+    asyncio.run(scenario())
+
+    assert attempts == [1, 2, 3]
+    assert delays == [10, 20]
+    # После последней попытки результат снят с доставки
+    assert database.jobs_claim_finished(lease_seconds=0) == []
+
+
+def test_results_are_sharded_by_user(database):
+    enqueue(user_id=4)
+    enqueue(user_id=5)
+    worker = make_worker("w1")
+    while worker.run_once():
+        pass
+
+    assert [job['user_id'] for job in database.jobs_claim_finished(shard=(1, 2))] == [5]
+    assert [job['user_id'] for job in database.jobs_claim_finished(shard=(0, 2))] == [4]
@@ -0,0 +1,96 @@
+"""Двоичный формат индекса прайс-листа и поиск позиций по артикулу"""
+from array import array
+
+import pytest
+
+pytest.importorskip("openpyxl")
+
+from app.excel.price_index import PriceIndex, index_layout, index_path_for, load_index, save_index
+
+PRICE_CONFIG = {'start_row': 2, 'article_col': 1, 'price_col': 4, 'quantity_col': 9}
+
+
+def make_index() -> PriceIndex:
+    index = PriceIndex()
+    index.append(2, "AB-100", 10.5)
+    index.append(3, "ЩУ-7", 0.0)
+    index.append(5, "AB-100", 11.0)
+    index.append(8, "X1", 3.25)
+    return index
+
+
+def test_round_trip():
+    index = make_index()
+
+    restored, header = PriceIndex.from_bytes(index.to_bytes(index_layout(PRICE_CONFIG)))
+
+    assert list(restored) == list(index)
+    assert isinstance(restored.rows, array) and isinstance(restored.prices, array)
+    assert header['layout'] == index_layout(PRICE_CONFIG)
+    assert header['count'] == 4
+
+
+def test_empty_index_round_trip():
+    restored, header = PriceIndex.from_bytes(PriceIndex().to_bytes(index_layout(PRICE_CONFIG)))
+
+    assert len(restored) == 0
+    assert header['count'] == 0
+
+
+def test_bad_magic_is_rejected():
+    payload = make_index().to_bytes(index_layout(PRICE_CONFIG))
+
+    with pytest.raises(ValueError):
+        PriceIndex.from_bytes(b'XXXX' + payload[4:])
+
+
+@pytest.mark.parametrize("cut", [2, 10, 30, -20, -1])
+def test_truncated_payload_is_rejected(cut):
+    payload = make_index().to_bytes(index_layout(PRICE_CONFIG))
+
+    with pytest.raises(ValueError):
+        PriceIndex.from_bytes(payload[:cut])
+
+
+def test_trailing_garbage_is_rejected():
+    payload = make_index().to_bytes(index_layout(PRICE_CONFIG))
+
+    with pytest.raises(ValueError):
+        PriceIndex.from_bytes(payload + b'\0')
+
+
+def test_positions_with_duplicate_articles():
+    index = make_index()
+
+    positions = index.positions()
+
+    assert positions == {"AB-100": (0, 2), "ЩУ-7": 1, "X1": 3}
+    index.append(9, "AB-100", 12.0)
+    assert index.positions()["AB-100"] == (0, 2, 4)
+
+
+def test_duplicate_article_is_written_to_every_row():
+    updates = make_index().compute_updates({" AB-100 ": 2}, quantity_col=9, sum_col=10, price_col=4)
+
+    assert updates == {"J3": 2.0, "K3": 21.0, "J6": 2.0, "K6": 22.0}
+
+
+def test_index_path_depends_only_on_layout(tmp_path):
+    price_file = tmp_path / "price.xlsx"
+    path = index_path_for(price_file, PRICE_CONFIG)
+
+    assert path.startswith(str(tmp_path / "price."))
+    assert path.endswith(".pidx")
+    assert index_path_for(price_file, {**PRICE_CONFIG, 'quantity_col': 3}) == path
+    assert index_path_for(price_file, {**PRICE_CONFIG, 'article_col': 0}) != path
+
+
+def test_load_index_checks_layout(tmp_path):
+    path = index_path_for(tmp_path / "price.xlsx", PRICE_CONFIG)
+    save_index(make_index(), path, PRICE_CONFIG)
+
+    assert list(load_index(path, PRICE_CONFIG)) == list(make_index())
+    assert load_index(path, {**PRICE_CONFIG, 'start_row': 0}) is None
+    with open(path, 'r+b') as f:
+        f.truncate(40)
+    assert load_index(path, PRICE_CONFIG) is None
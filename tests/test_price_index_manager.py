@@ -0,0 +1,83 @@
+"""Прогрев индекса прайса: после ensure первый заказ не разбирает книгу прайса"""
+import io
+from collections import OrderedDict
+
+import pytest
+
+openpyxl = pytest.importorskip("openpyxl")
+
+from app.core.blob_store import BlobStore
+from app.core.db import Database
+from app.excel import excel_processor
+from app.excel.order_generator import OrderGenerator
+from app.excel.price_index import (PRICE_INDEX_VERSION, PriceIndex, index_layout, index_path_for,
+                                   price_index_cache, save_index)
+from app.managers.price_index_manager import PriceIndexManager
+
+PRICE_CONFIG = {'start_row': 1, 'article_col': 0, 'price_col': 2, 'quantity_col': 3, 'sum_col': 4}
+
+
+class FakeDatabase:
+    def __init__(self, configs):
+        self.configs = configs
+
+    def suppliers_get_config(self, name):
+        return self.configs.get(name)
+
+    def price_index_get_template(self, name, sha256):
+        return None
+
+
+@pytest.fixture
+def supplier(tmp_path, monkeypatch):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["Артикул", "Название", "Цена", "Кол-во", "Сумма"])
+    ws.append(["A-1", "Болт", 10.0])
+    ws.append(["A-2", "Гайка", 2.5])
+    price_file = str(tmp_path / "price.xlsx")
+    wb.save(price_file)
+    index_path = index_path_for(price_file, PRICE_CONFIG)
+    save_index(PriceIndex.from_source(price_file, PRICE_CONFIG), index_path, PRICE_CONFIG)
+    config = {
+        'price_file': price_file,
+        'price_list': PRICE_CONFIG,
+        'price_sha256': 'sha-price',
+        'price_index': {'version': PRICE_INDEX_VERSION, 'path': index_path, 'sha256': 'sha-price',
+                        'layout': index_layout(PRICE_CONFIG), 'rows': 2},
+    }
+    db = FakeDatabase({'Поставщик': config})
+    monkeypatch.setattr(Database, "get_instance", classmethod(lambda cls: db))
+    monkeypatch.setattr(price_index_cache, "_entries", OrderedDict())
+    return config
+
+
+def test_first_order_after_ensure_does_not_parse_the_workbook(supplier, monkeypatch):
+    assert PriceIndexManager(blob_store=None).ensure('Поставщик') == 'loaded'
+
+    def no_parse(*args, **kwargs):
+        raise AssertionError("книга прайса не должна разбираться")
+
+    monkeypatch.setattr(excel_processor, "load_workbook", no_parse)
+    output = io.BytesIO()
+    updates = OrderGenerator(PRICE_CONFIG).render_order(supplier['price_file'], {'A-2': 4}, output,
+                                                        price_key='sha-price',
+                                                        index_path=supplier['price_index']['path'])
+    monkeypatch.undo()
+
+    assert updates == {'D3': 4.0, 'E3': 10.0}
+    ws = openpyxl.load_workbook(io.BytesIO(output.getvalue())).active
+    assert (ws['D3'].value, ws['E3'].value) == (4, 10)
+
+
+def test_unsupported_template_is_reported(supplier, monkeypatch, caplog):
+    monkeypatch.setattr("app.managers.price_index_manager.patch_xlsx_numbers", lambda *args: None)
+
+    assert PriceIndexManager(blob_store=None).ensure('Поставщик') == 'loaded'
+    assert "через openpyxl" in caplog.text
+
+
+def test_supplier_without_price_is_skipped(supplier, tmp_path):
+    supplier['price_file'] = supplier['price_file'] + '.missing'
+
+    assert PriceIndexManager(BlobStore(tmp_path / "blobs")).ensure('Поставщик') == 'skipped'
@@ -0,0 +1,115 @@
+"""Передача результатов генерации через разделяемую память"""
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import pytest
+
+pytest.importorskip("openpyxl")
+
+from app.excel.batch import BatchOrderBuilder, build_order_in_process
+from app.excel.result_channel import SharedResult, SharedResultHandle, publish_result
+
+
+def segment_exists(name: str) -> bool:
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    shm.close()
+    return True
+
+
+QUANTITIES = {"AB-100": 2.0, "ЩУ-7": 0.5, "с\nпереводом": 3.0, "": 1.0}
+
+
+def test_publish_and_attach_round_trip():
+    handle = publish_result(b"PK\x03\x04xlsx-bytes", QUANTITIES)
+
+    with SharedResult(handle) as result:
+        assert bytes(result.output) == b"PK\x03\x04xlsx-bytes"
+        assert result.quantities == QUANTITIES
+        assert list(result.quantities) == list(QUANTITIES)
+
+    assert not segment_exists(handle.name)
+
+
+def test_publish_accepts_buffers_and_empty_results():
+    handle = publish_result(memoryview(bytearray(b"abc")), {})
+
+    with SharedResult(handle) as result:
+        assert bytes(result.output) == b"abc"
+        assert result.quantities == {}
+
+
+def test_release_unlinks_and_is_idempotent():
+    handle = publish_result(b"data", {"A": 1.0})
+    result = SharedResult(handle)
+
+    result.release()
+    result.release()
+
+    assert result.output is None
+    assert not segment_exists(handle.name)
+    with pytest.raises(FileNotFoundError):
+        SharedResult(handle)
+
+
+def test_foreign_segment_is_rejected_and_removed():
+    shm = shared_memory.SharedMemory(create=True, size=64)
+    shm.buf[:4] = b"NOPE"
+    handle = SharedResultHandle(shm.name, shm.size)
+    shm.close()
+
+    with pytest.raises(ValueError):
+        SharedResult(handle)
+    assert not segment_exists(handle.name)
+
+
+class FailingPool:
+    """Пул, который выполняет задания синхронно и отказывает на failing_call-м submit."""
+
+    def __init__(self, failing_call: int):
+        self.failing_call = failing_call
+        self.handles = []
+
+    def submit(self, fn, *args):
+        if len(self.handles) + 1 == self.failing_call:
+            raise RuntimeError("пул процессов остановлен")
+        assert fn is build_order_in_process
+        handle = publish_result(b"order", {"A": 1.0})
+        self.handles.append(handle)
+        future = Future()
+        future.set_result(handle)
+        return future
+
+
+def make_builder(pool) -> BatchOrderBuilder:
+    builder = BatchOrderBuilder(b"", b"", pool=pool)
+    config = {'price_list': {}, 'preorders': {}}
+    # Входы уже «разобраны»: тест проверяет только приём результатов из пула
+    builder._warehouse[builder._warehouse_key(config)] = {"A": 1.0}
+    builder._preorders[builder._preorders_key(config)] = {}
+    return builder, config
+
+
+def test_submitted_segments_are_released_when_submit_fails():
+    pool = FailingPool(failing_call=3)
+    builder, config = make_builder(pool)
+
+    with pytest.raises(RuntimeError):
+        builder.run({"first": config, "second": config, "third": config})
+
+    assert len(pool.handles) == 2
+    assert not any(segment_exists(handle.name) for handle in pool.handles)
+
+
+def test_segments_live_until_builder_is_closed():
+    pool = FailingPool(failing_call=0)
+    builder, config = make_builder(pool)
+
+    with builder:
+        results = builder.run({"first": config, "second": config})
+        assert bytes(results["first"].output) == b"order"
+        assert all(segment_exists(handle.name) for handle in pool.handles)
+
+    assert not any(segment_exists(handle.name) for handle in pool.handles)
@@ -0,0 +1,187 @@
+"""Сессии пользователей: TTL, LRU, освобождение файлов и восстановление из общего хранилища"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+from aiogram.fsm.storage.base import StorageKey
+
+from app.bot import session_store
+from app.bot.session_store import SessionStore, TTLMemoryStorage
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(session_store, "time", clock)
+    return clock
+
+
+def make_store(**kwargs):
+    released = []
+    store = SessionStore(release_files=released.extend, **kwargs)
+    return store, released
+
+
+def test_expired_sessions_are_evicted_with_their_files(clock):
+    store, released = make_store(ttl_seconds=60)
+    store.track_file(1, "/uploads/a.xlsx")
+    store.track_file(1, "/uploads/a.xlsx")
+    clock.now += 30
+    store.track_file(2, "/uploads/b.xlsx")
+
+    clock.now += 31
+    store.get(3)
+
+    assert not store.has(1)
+    assert store.has(2)
+    assert released == ["/uploads/a.xlsx"]
+    assert store.sweep() == 0
+
+
+def test_access_refreshes_ttl(clock):
+    store, released = make_store(ttl_seconds=60)
+    store.get(1)
+    clock.now += 50
+    store.get(1)
+    clock.now += 50
+
+    assert store.sweep() == 0
+    clock.now += 11
+    assert store.sweep() == 1
+    assert len(store) == 0
+
+
+def test_overflow_evicts_least_recently_used(clock):
+    store, released = make_store(max_sessions=2)
+    store.track_file(1, "/uploads/1.xlsx")
+    store.track_file(2, "/uploads/2.xlsx")
+    store.get(1)
+
+    store.get(3)
+
+    assert store.has(1) and store.has(3) and not store.has(2)
+    assert released == ["/uploads/2.xlsx"]
+
+
+def test_shared_eviction_keeps_files(clock):
+    store, released = make_store(ttl_seconds=60, max_sessions=1, shared=True)
+    store.track_file(1, "/uploads/1.xlsx")
+    store.get(2)
+    clock.now += 61
+    store.sweep()
+
+    assert len(store) == 0
+    assert released == []
+
+
+def test_reset_keeps_requested_keys_and_files(clock):
+    store, released = make_store()
+    session = store.get(1)
+    session.update(supplier="Альфа", price_file="/uploads/price.xlsx", config={'x': 1})
+    for path in ("/uploads/price.xlsx", "/uploads/blob", "/uploads/old.xlsx"):
+        store.track_file(1, path)
+
+    new = store.reset(1, keep=('supplier', 'price_file'), keep_files=['/uploads/price.xlsx', '/uploads/blob'])
+
+    assert new is store.get(1) and new is not session
+    assert new['supplier'] == "Альфа" and new['price_file'] == "/uploads/price.xlsx"
+    assert new['config'] is None
+    assert new['uploads'] == ["/uploads/price.xlsx", "/uploads/blob"]
+    assert released == ["/uploads/old.xlsx"]
+
+
+def test_discard_and_untrack(clock):
+    store, released = make_store()
+    store.track_file(1, "/uploads/price.xlsx")
+    store.track_file(1, "/uploads/tmp.xlsx")
+    store.untrack_file(1, "/uploads/price.xlsx")
+
+    assert store.referenced_files() == ["/uploads/tmp.xlsx"]
+    store.discard(1)
+    assert released == ["/uploads/tmp.xlsx"]
+    assert not store.has(1)
+
+
+def test_snapshot_skips_bytes_and_objects(clock):
+    store, _ = make_store(shared=True)
+    session = store.get(1)
+    session.update(supplier="Альфа", warehouse_file=b"xlsx", warehouse_sha256="aaa", order_session=object())
+
+    assert store.snapshot(1) == {'supplier': "Альфа", 'warehouse_sha256': "aaa"}
+    assert store.snapshot(2) == {}
+
+
+def test_restore_keeps_objects_derived_from_same_data(clock):
+    store, _ = make_store(shared=True)
+    session = store.get(1)
+    order_session = object()
+    session.update(supplier="Альфа", warehouse_file=b"old", warehouse_sha256="aaa",
+                   preorders_file=b"pre", preorders_sha256="bbb", order_session=order_session, stale="x")
+
+    store.restore(1, {'supplier': "Бета", 'warehouse_sha256': "aaa", 'preorders_sha256': "ccc"})
+
+    # Словарь обновлён на месте: ссылки, взятые обработчиками, остаются действительными
+    assert store.get(1) is session
+    assert session['supplier'] == "Бета"
+    assert session['warehouse_file'] == b"old"
+    assert session['preorders_file'] is None
+    assert session['order_session'] is order_session
+    assert 'stale' not in session
+
+
+def test_restore_skips_unchanged_payload(clock):
+    store, _ = make_store(shared=True)
+    payload = {'supplier': "Альфа"}
+    store.restore(1, payload)
+    store.get(1)['supplier'] = "изменено параллельным апдейтом"
+
+    store.restore(1, dict(payload))
+    assert store.get(1)['supplier'] == "изменено параллельным апдейтом"
+
+    store.mark_synced(1, store.snapshot(1))
+    store.restore(1, {'supplier': "Гамма"})
+    assert store.get(1)['supplier'] == "Гамма"
+
+
+def test_restore_creates_missing_session(clock):
+    store, _ = make_store(shared=True, max_sessions=1)
+    store.get(1)
+
+    store.restore(2, {'supplier': "Альфа", 'uploads': ["/uploads/blob"]})
+
+    assert store.get(2)['uploads'] == ["/uploads/blob"]
+    assert store.get(2)['price_file'] is None
+    assert not store.has(1)
+
+
+def storage_key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=42, chat_id=user_id, user_id=user_id)
+
+
+def test_ttl_memory_storage_expires_and_limits_keys(clock):
+    async def scenario():
+        storage = TTLMemoryStorage(ttl_seconds=60, max_keys=2)
+        await storage.set_state(storage_key(1), "waiting")
+        await storage.set_data(storage_key(2), {'a': 1})
+        clock.now += 30
+        await storage.get_state(storage_key(1))
+        await storage.set_data(storage_key(3), {'b': 2})
+        # Лимит ключей: вытеснен 2 — к нему дольше всех не обращались
+        assert await storage.get_state(storage_key(1)) == "waiting"
+        assert storage_key(2) not in storage.storage
+        clock.now += 61
+        await storage.get_data(storage_key(4))
+        assert storage_key(1) not in storage.storage
+        assert storage_key(3) not in storage.storage
+
+    asyncio.run(scenario())
@@ -0,0 +1,159 @@
+"""Уведомления об изменении пользователей: нарезка NOTIFY и их применение репликой"""
+from contextlib import contextmanager
+
+import pytest
+
+pytest.importorskip("psycopg")
+
+from app.core import db as db_module
+from app.core.db import NOTIFY_MAX_CHUNKS, NOTIFY_PAYLOAD_LIMIT, USERS_CHANNEL, Database, _chunk_notify_payloads
+from app.managers.user_manager import UserManager
+
+
+def split_ids(payloads, prefix="remove:"):
+    ids = []
+    for payload in payloads:
+        assert payload.startswith(prefix)
+        ids += payload[len(prefix):].split(",")
+    return ids
+
+
+def test_chunks_fit_limit_and_keep_every_id():
+    ids = [str(10 ** 9 + i) for i in range(3000)]
+
+    payloads = _chunk_notify_payloads("remove:", ids)
+
+    assert len(payloads) > 1
+    assert all(len(p.encode()) <= NOTIFY_PAYLOAD_LIMIT for p in payloads)
+    assert split_ids(payloads) == ids
+    # Каждая часть, кроме последней, заполнена: следующий id в неё уже не влез бы
+    for payload in payloads[:-1]:
+        assert len(payload) + 1 + 10 > NOTIFY_PAYLOAD_LIMIT
+
+
+@pytest.mark.parametrize("extra", [-1, 0, 1])
+def test_chunk_boundary_is_exact(extra, monkeypatch):
+    prefix = "remove:"
+    # 10 id по 99 символов и запятые между ними дают ровно лимит; extra сдвигает последний id
+    item_len = 99
+    count = 10
+    limit = len(prefix) + count * item_len + (count - 1)
+    ids = ["1" * item_len] * (count - 1) + ["2" * (item_len + extra)]
+    monkeypatch.setattr(db_module, "NOTIFY_PAYLOAD_LIMIT", limit)
+
+    payloads = _chunk_notify_payloads(prefix, ids)
+
+    assert len(payloads) == (2 if extra > 0 else 1)
+    assert all(len(p) <= limit for p in payloads)
+    assert split_ids(payloads, prefix) == ids
+
+
+def test_single_oversized_item_is_not_dropped():
+    payloads = _chunk_notify_payloads("remove:", ["9" * (NOTIFY_PAYLOAD_LIMIT + 10), "1"])
+
+    assert split_ids(payloads) == ["9" * (NOTIFY_PAYLOAD_LIMIT + 10), "1"]
+
+
+class RecordingCursor:
+    def __init__(self, notifications):
+        self.notifications = notifications
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=()):
+        if query.startswith("DELETE"):
+            self.rowcount = len(params[0])
+        elif "pg_notify" in query:
+            self.notifications.append(params)
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.notifications = []
+
+    @contextmanager
+    def transaction(self):
+        yield
+
+    def cursor(self):
+        return RecordingCursor(self.notifications)
+
+
+def remove_many(user_ids):
+    database = Database("postgresql://unused")
+    conn = RecordingConnection()
+
+    @contextmanager
+    def connection():
+        yield conn
+
+    database.connection = connection
+    removed = database.users_remove_many(user_ids)
+    return removed, [payload for channel, payload in conn.notifications if channel == USERS_CHANNEL]
+
+
+def test_remove_many_sends_chunked_notifications():
+    user_ids = list(range(10 ** 9, 10 ** 9 + 2000))
+
+    removed, payloads = remove_many(user_ids)
+
+    assert removed == 2000
+    assert 1 < len(payloads) <= NOTIFY_MAX_CHUNKS
+    assert [int(u) for u in split_ids(payloads)] == user_ids
+
+
+def test_remove_many_falls_back_to_reload():
+    # Больше NOTIFY_MAX_CHUNKS частей по ~640 id в каждой
+    user_ids = list(range(10 ** 9, 10 ** 9 + 640 * (NOTIFY_MAX_CHUNKS + 1)))
+
+    removed, payloads = remove_many(user_ids)
+
+    assert removed == len(user_ids)
+    assert payloads == ["reload"]
+
+
+class FakeDatabase:
+    def __init__(self, users):
+        self.users = users
+        self.loads = 0
+
+    def users_get_all(self):
+        self.loads += 1
+        return list(self.users)
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    database = FakeDatabase({1, 2, 3})
+    monkeypatch.setattr(Database, "get_instance", classmethod(lambda cls: database))
+    manager = UserManager()
+    manager.load()
+    return manager
+
+
+def test_apply_add_and_remove(manager):
+    manager._apply_notification("add:4,5")
+    manager._apply_notification("remove:1,5")
+
+    assert manager.get_all_users() == {2, 3, 4}
+
+
+def test_apply_reload_rereads_table(manager):
+    manager.db.users = {7, 8}
+
+    manager._apply_notification("reload")
+
+    assert manager.get_all_users() == {7, 8}
+    assert manager.db.loads == 2
+
+
+def test_apply_ignores_malformed_payload(manager):
+    manager._apply_notification("remove:1,abc")
+    manager._apply_notification("unknown:1")
+
+    assert manager.get_all_users() == {1, 2, 3}
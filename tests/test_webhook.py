@@ -0,0 +1,91 @@
+"""WebhookServer через тестовый клиент aiohttp: секрет, доставка в диспетчер, остановка"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message
+from aiohttp.test_utils import TestClient, TestServer
+
+from app.bot.update_feeder import UpdateFeeder
+from app.bot.webhook import SECRET_HEADER, WebhookServer
+
+SECRET = "test-secret"
+PATH = "/telegram/webhook"
+
+
+def make_update(update_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "Test"}, "text": text,
+        },
+    }
+
+
+def run_with_client(scenario):
+    """Поднимает WebhookServer с настоящим диспетчером и выполняет scenario(client, server, received)."""
+    async def main():
+        received = []
+        dp = Dispatcher()
+
+        @dp.message()
+        async def record(message: Message):
+            received.append(message.text)
+
+        bot = Bot(token="42:TEST")
+        feeder = UpdateFeeder(dp, bot)
+        server = WebhookServer(bot, SECRET, accept=feeder.feed, path=PATH)
+        client = TestClient(TestServer(server.build_app()))
+        await client.start_server()
+        try:
+            await scenario(client, server, received)
+            await feeder.drain(timeout=5)
+        finally:
+            await client.close()
+            await bot.session.close()
+        return received
+
+    return asyncio.run(main())
+
+
+def test_wrong_or_missing_secret_is_rejected():
+    async def scenario(client, server, received):
+        response = await client.post(PATH, json=make_update(1, "/start"), headers={SECRET_HEADER: "wrong"})
+        assert response.status == 401
+        response = await client.post(PATH, json=make_update(2, "/start"))
+        assert response.status == 401
+
+    assert run_with_client(scenario) == []
+
+
+def test_valid_update_reaches_dispatcher():
+    async def scenario(client, server, received):
+        response = await client.post(PATH, json=make_update(1, "привет"), headers={SECRET_HEADER: SECRET})
+        assert response.status == 200
+
+    assert run_with_client(scenario) == ["привет"]
+
+
+def test_malformed_update_is_rejected():
+    async def scenario(client, server, received):
+        response = await client.post(PATH, data="{не json", headers={SECRET_HEADER: SECRET})
+        assert response.status == 400
+        response = await client.post(PATH, json={"message": "без update_id"}, headers={SECRET_HEADER: SECRET})
+        assert response.status == 400
+
+    assert run_with_client(scenario) == []
+
+
+def test_updates_get_503_while_draining():
+    async def scenario(client, server, received):
+        server._closing = True
+        response = await client.post(PATH, json=make_update(1, "/start"), headers={SECRET_HEADER: SECRET})
+        assert response.status == 503
+        health = await client.get("/healthz")
+        assert (await health.json()) == {"status": "closing"}
+
+    assert run_with_client(scenario) == []